@@ -0,0 +1,125 @@
+"""
+Concurrency benchmark for the MCP vector-store tools against a local stub of the vector store API.
+
+The stub answers search, file content and file metadata requests after a fixed latency. N
+concurrent research sessions each run one file_search and one file_fetch, with a query and file of
+their own so that shinan_mcp's result caches never hit, through:
+
+- sync:  the previous implementation, a blocking OpenAI client called inside the async tools
+- async: shinan_mcp's shared AsyncOpenAI client, with file_fetch's two lookups run concurrently
+
+Usage (from backend/app):
+    python -m benchmarks.bench_mcp_concurrency [--sessions 20] [--latency 0.2]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+LATENCY = 0.2
+
+
+async def _search(request: Request) -> JSONResponse:
+    await asyncio.sleep(LATENCY)
+    return JSONResponse({
+        "object": "vector_store.search_results.page",
+        "search_query": ["q"],
+        "data": [{
+            "file_id": f"file-{i}",
+            "filename": f"ir-{i}.pdf",
+            "score": 0.9,
+            "attributes": {},
+            "content": [{"type": "text", "text": "SoftBank Vision Fund " * 20}],
+        } for i in range(3)],
+        "has_more": False,
+        "next_page": None,
+    })
+
+
+async def _content(request: Request) -> JSONResponse:
+    await asyncio.sleep(LATENCY)
+    return JSONResponse({"object": "list", "data": [{"type": "text", "text": "Page text. " * 200}]})
+
+
+async def _file(request: Request) -> JSONResponse:
+    await asyncio.sleep(LATENCY)
+    return JSONResponse({
+        "id": request.path_params["file_id"],
+        "object": "vector_store.file",
+        "created_at": 0,
+        "last_error": None,
+        "status": "completed",
+        "usage_bytes": 1,
+        "vector_store_id": request.path_params["vs"],
+        "attributes": {"source": "stub"},
+    })
+
+
+stub = Starlette(routes=[
+    Route("/v1/vector_stores/{vs}/search", _search, methods=["POST"]),
+    Route("/v1/vector_stores/{vs}/files/{file_id}/content", _content),
+    Route("/v1/vector_stores/{vs}/files/{file_id}", _file),
+])
+
+
+def start_stub() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+async def run(name: str, session, sessions: int) -> None:
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<6} sessions={sessions:<4} wall={elapsed:6.2f}s  throughput={sessions / elapsed:6.1f} sessions/s")
+
+
+async def main() -> None:
+    global LATENCY
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub latency per API call, in seconds.")
+    args = parser.parse_args()
+    LATENCY = args.latency
+
+    base_url = start_stub()
+    os.environ.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY="stub", VECTOR_STORE_ID="vs_stub")
+
+    from openai import OpenAI
+    import shinan_mcp
+
+    sync_client = OpenAI(base_url=base_url, api_key="stub")
+
+    async def sync_session(i: int) -> None:
+        # What the tools used to do: blocking calls on the event loop, one after the other.
+        sync_client.vector_stores.search(vector_store_id="vs_stub", query=f"query {i}")
+        sync_client.vector_stores.files.content(vector_store_id="vs_stub", file_id=f"file-{i}")
+        sync_client.vector_stores.files.retrieve(vector_store_id="vs_stub", file_id=f"file-{i}")
+
+    async def async_session(i: int) -> None:
+        await shinan_mcp.search_vector_store(f"query {i}")
+        await shinan_mcp.fetch_vector_store_file(f"file-{i}")
+
+    await run("sync", sync_session, args.sessions)
+    await run("async", async_session, args.sessions)
+    hits = shinan_mcp.search_cache.stats.hits + shinan_mcp.fetch_cache.stats.hits
+    assert hits == 0, f"{hits} result cache hits; the async run would not be comparable."
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
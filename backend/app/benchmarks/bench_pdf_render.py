@@ -0,0 +1,101 @@
+"""
+PDF rendering benchmark over generated sample decks.
+
+Each deck is a synthetic slide deck (title, bullet text and a few shapes per page). Decks are
+converted to content parts by:
+
+- inline: the previous implementation, every page rendered at 1.5x in the request coroutine
+- pool:   materials.stream_pdf_parts over every page, rendered in the process pool and fitted
+          to the upload's image token budget (images.py)
+- capped: the same, limited to --max-pages pages
+
+While each run is in progress a ticker measures how long the event loop is blocked, which is
+how long every other request on the server would stall.
+
+Usage (from backend/app):
+    python -m benchmarks.bench_pdf_render [--pages 20 200] [--max-pages 10] [--dpi 108]
+"""
+
+import argparse
+import asyncio
+import base64
+import time
+
+import fitz
+
+import materials
+
+
+def make_deck(pages: int) -> bytes:
+    document = fitz.open()
+    for number in range(1, pages + 1):
+        page = document.new_page(width=960, height=540)
+        page.insert_text((60, 80), f"Slide {number}: SoftBank Group Quarterly Results", fontsize=28)
+        for line in range(8):
+            page.insert_text((80, 150 + line * 36), f"- Vision Fund segment metric {line} rose {line * 3.5:.1f}% YoY", fontsize=18)
+        for bar in range(6):
+            page.draw_rect(fitz.Rect(620 + bar * 50, 480 - bar * 40, 660 + bar * 50, 480), color=(0, 0, 1), fill=(0.3, 0.5, 0.9))
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+async def inline(data: bytes) -> int:
+    document = fitz.open(stream=data, filetype="pdf")
+    parts = []
+    for page in document:
+        parts.append(page.get_text())  # type: ignore
+        pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))  # type: ignore
+        parts.append("data:image/jpeg;base64," + base64.b64encode(pix.tobytes("png")).decode("utf-8"))
+    document.close()
+    return sum(len(part) for part in parts)
+
+
+async def pool(data: bytes, max_pages: int, dpi: int) -> int:
+    parts = [part async for part in materials.stream_pdf_parts(data, "deck.pdf", max_pages=max_pages, dpi=dpi)]
+    return sum(len(part.get("text") or part.get("image_url", "")) for part in parts)
+
+
+async def measure(name: str, pages: int, run) -> None:
+    stop = asyncio.Event()
+    worst = 0.0
+
+    async def ticker() -> None:
+        nonlocal worst
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            start = loop.time()
+            await asyncio.sleep(0.01)
+            worst = max(worst, loop.time() - start - 0.01)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    size = await run()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    print(f"{name:<7} pages={pages:<4} wall={elapsed:6.2f}s  max_loop_block={worst * 1000:7.1f}ms  payload={size / 1e6:6.2f}MB")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[20, 200])
+    parser.add_argument("--max-pages", type=int, default=materials.PDF_MAX_PAGES)
+    parser.add_argument("--dpi", type=int, default=materials.PDF_DPI)
+    args = parser.parse_args()
+
+    # Start the workers before timing, as the server does on its first upload.
+    await pool(make_deck(materials.PDF_WORKERS), materials.PDF_WORKERS, args.dpi)
+    try:
+        for pages in args.pages:
+            deck = make_deck(pages)
+            await measure("inline", pages, lambda: inline(deck))
+            await measure("pool", pages, lambda: pool(deck, pages, args.dpi))
+            await measure("capped", pages, lambda: pool(deck, args.max_pages, args.dpi))
+    finally:
+        materials.shutdown_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+"""
+Startup benchmark: how long the server takes to import and to become healthy.
+
+- import:  `python -X importtime -c "import main"` in a fresh interpreter. Reports the total and
+           where the time goes: each of Shinan's own modules, and the heaviest third-party
+           packages, by cumulative import time.
+- healthy: uvicorn started on a free port, timed until --health-path answers 200: /health/live
+           (default) once the server is up, or /health/ready once warmup is done and the
+           dependency probes pass (see readiness.py).
+
+Each is run --runs times in fresh processes and the median is reported. With --max-import-ms or
+--max-healthy-ms the benchmark exits with status 1 when a median exceeds it, so CI can track
+startup regressions; --json writes the results for comparison across builds.
+
+Usage (from backend/app):
+    python -m benchmarks.bench_startup [--runs 3] [--top 15] [--health-path /health/live]
+        [--max-import-ms 2500] [--max-healthy-ms 5000] [--json startup.json]
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+
+APP_DIR = Path(__file__).resolve().parent.parent
+HEALTHY_TIMEOUT = 60.0
+
+# "import time: self [us] | cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def first_party_modules() -> set:
+    modules = {path.stem for path in APP_DIR.glob("*.py")}
+    return modules | {"routers", "tools", "benchmarks"}
+
+
+def profile_imports() -> Tuple[float, List[Tuple[str, float, int]]]:
+    """Total import time of main in ms, and each import as (module, cumulative ms, depth)."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=APP_DIR, capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{completed.stderr[-2000:]}")
+    imports = []
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            imports.append((match.group(4), int(match.group(2)) / 1000, len(match.group(3)) // 2))
+    total = next((ms for module, ms, _ in imports if module == "main"), 0.0)
+    return total, imports
+
+
+def breakdown(imports: List[Tuple[str, float, int]], top: int) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Cumulative ms of Shinan's modules, and of the heaviest third-party packages (by top-level package)."""
+    ours = first_party_modules()
+    first_party: Dict[str, float] = {}
+    third_party: Dict[str, float] = {}
+    for module, ms, _ in imports:
+        root = module.split(".")[0]
+        if root in ours:
+            first_party[module] = max(first_party.get(module, 0.0), ms)
+        elif root not in sys.stdlib_module_names:
+            third_party[root] = max(third_party.get(root, 0.0), ms)
+    heaviest = dict(sorted(third_party.items(), key=lambda item: item[1], reverse=True)[:top])
+    return dict(sorted(first_party.items(), key=lambda item: item[1], reverse=True)), heaviest
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_healthy(health_path: str) -> float:
+    """Seconds from starting uvicorn until `health_path` answers 200."""
+    port = free_port()
+    # The server's output goes to a file, as an unread pipe would block it once full.
+    log = tempfile.TemporaryFile()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=log,
+    )
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - started < HEALTHY_TIMEOUT:
+                if server.poll() is not None:
+                    log.seek(0)
+                    raise RuntimeError(f"uvicorn exited:\n{log.read().decode(errors='replace')[-2000:]}")
+                try:
+                    if client.get(f"http://127.0.0.1:{port}{health_path}").status_code == 200:
+                        return time.perf_counter() - started
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.02)
+        raise RuntimeError(f"The server was not healthy after {HEALTHY_TIMEOUT:.0f}s.")
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="Third-party packages to list.")
+    parser.add_argument("--health-path", default="/health/live")
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-healthy-ms", type=float, default=None)
+    parser.add_argument("--skip-healthy", action="store_true", help="Only profile imports.")
+    parser.add_argument("--json", type=Path, default=None, help="Write the results to this file.")
+    args = parser.parse_args()
+
+    totals, imports = [], []
+    for _ in range(args.runs):
+        total, imports = profile_imports()
+        totals.append(total)
+    import_ms = statistics.median(totals)
+    first_party, third_party = breakdown(imports, args.top)
+
+    print(f"import main: {import_ms:7.0f} ms (median of {args.runs}: {', '.join(f'{t:.0f}' for t in totals)})")
+    print("\nShinan modules (cumulative):")
+    for module, ms in first_party.items():
+        print(f"  {module:<40} {ms:7.1f} ms")
+    print("\nHeaviest third-party packages (cumulative):")
+    for package, ms in third_party.items():
+        print(f"  {package:<40} {ms:7.1f} ms")
+
+    results: Dict[str, object] = {"import_ms": round(import_ms, 1), "first_party_ms": first_party, "third_party_ms": third_party}
+    failed = args.max_import_ms is not None and import_ms > args.max_import_ms
+
+    if not args.skip_healthy:
+        healthy = [time_to_healthy(args.health_path) * 1000 for _ in range(args.runs)]
+        healthy_ms = statistics.median(healthy)
+        print(f"\ntime to {args.health_path}: {healthy_ms:7.0f} ms (median of {args.runs}: {', '.join(f'{t:.0f}' for t in healthy)})")
+        results["healthy_ms"] = round(healthy_ms, 1)
+        failed = failed or (args.max_healthy_ms is not None and healthy_ms > args.max_healthy_ms)
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+    if failed:
+        print("\nStartup is over budget.", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
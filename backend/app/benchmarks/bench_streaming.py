@@ -0,0 +1,125 @@
+"""
+Time-to-first-byte and total-latency comparison for the /client/query stream.
+
+Replays a synthetic timeline of a typical text workflow (idea generation, three concurrent
+searches, report writing) with model latencies taken from local runs, through:
+
+- legacy:    the fixed asyncio.sleep pacing the workflow used to do after each event, with the
+             report sent only once complete
+- immediate: events emitted as soon as they happen (the default now), report text streamed
+- paced:     immediate emission wrapped in streaming.pace_updates (the opt-in UI pacing)
+
+`report` is when the first report text reaches the client.
+
+Usage (from backend/app):
+    python -m benchmarks.bench_streaming [--pacing 0.5]
+"""
+
+import argparse
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, List
+
+from streaming import StreamEvent, message, pace_updates, report, report_delta, update
+
+
+@dataclass
+class Event:
+    at: float             # Seconds after the stage starts that the agent produces the event.
+    chunk: str
+    sleep_before: float = 0.0   # Legacy pacing before yielding.
+    sleep_after: float = 0.0    # Legacy pacing after yielding.
+    streamed: bool = False      # Report text that the legacy workflow did not stream.
+
+    def event(self) -> StreamEvent:
+        if self.chunk.startswith("UPDATE "):
+            return update(self.chunk[len("UPDATE "):])
+        if self.chunk.startswith("**Report**"):
+            return report(self.chunk)
+        return report_delta(self.chunk) if self.streamed else message(self.chunk)
+
+
+# Each stage is a list of lanes; lanes within a stage run concurrently (one per search idea).
+STAGES: List[List[List[Event]]] = [
+    # Idea generation: context tool call, tool output, then the ideas message.
+    [[
+        Event(0.6, "UPDATE 背景を確認させていただきます。", sleep_after=1.0),
+        Event(0.8, "UPDATE SoftBankでInternとしてお勤めですね。"),
+        Event(2.4, "ご利用ありがとうございます。", sleep_before=1.0, sleep_after=1.0),
+        Event(2.4, "以下はアイデアをご提案いたします。"),
+    ]],
+    # Three concurrent searches, each with one web search call before its summary is ready.
+    [
+        [Event(0.5, f"UPDATE idea {i}をWEBで検索中...", sleep_after=1.0), Event(5.5 + i, "")]
+        for i in range(3)
+    ] + [[Event(8.0, "検索を完了しました！")]],
+    # Report writing: two MCP calls, their outputs, a web search, then the report message.
+    [[
+        Event(1.0, "UPDATE MCPを介して...", sleep_before=2.0),
+        Event(1.5, "", sleep_before=1.0),
+        Event(3.0, "UPDATE MCP経由で...", sleep_before=2.0),
+        Event(3.5, "", sleep_before=1.0),
+        Event(4.5, "UPDATE WEBで検索中...", sleep_before=1.0),
+        *(Event(5.0 + i * 0.5, f"report text {i} ", streamed=True) for i in range(10)),
+        Event(10.0, "UPDATE リポートを完成しました！", sleep_before=1.0, sleep_after=2.0),
+        Event(10.0, "**Report** ..."),
+    ]],
+]
+
+
+async def _lane(events: List[Event], start: float, legacy: bool, queue: asyncio.Queue) -> None:
+    for ev in events:
+        wait = start + ev.at - time.perf_counter()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if legacy and ev.sleep_before:
+            await asyncio.sleep(ev.sleep_before)
+        if ev.chunk and not (legacy and ev.streamed):
+            await queue.put(ev.event())
+        if legacy and ev.sleep_after:
+            await asyncio.sleep(ev.sleep_after)
+    await queue.put(None)
+
+
+async def workflow(legacy: bool) -> AsyncIterator[StreamEvent]:
+    """A stand-in for ShinanTextIntelligence.run_query."""
+    for lanes in STAGES:
+        queue: asyncio.Queue = asyncio.Queue()
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(_lane(lane, start, legacy, queue)) for lane in lanes]
+        finished = 0
+        while finished < len(tasks):
+            chunk = await queue.get()
+            if chunk is None:
+                finished += 1
+            else:
+                yield chunk
+        await asyncio.gather(*tasks)
+
+
+async def measure(name: str, stream: AsyncIterator[StreamEvent]) -> None:
+    start = time.perf_counter()
+    first = report = None
+    async for ev in stream:
+        now = time.perf_counter() - start
+        if first is None:
+            first = now
+        if report is None and ev.type in ("report_delta", "report"):
+            report = now
+    total = time.perf_counter() - start
+    print(f"{name:<10} ttfb={first:6.2f}s  report={report:6.2f}s  total={total:6.2f}s")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pacing", type=float, default=0.5, help="Pacing interval for the paced run.")
+    args = parser.parse_args()
+
+    await measure("legacy", workflow(legacy=True))
+    await measure("immediate", workflow(legacy=False))
+    await measure("paced", pace_updates(workflow(legacy=False), args.pacing))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,285 @@
+# Shinan Result Caching
+#
+# A small two-tier cache for JSON-serializable results: an in-process LRU bounded by a byte
+# budget, optionally backed by Redis so that workers and nodes share entries. For large results
+# that should survive restarts there is also an on-disk LRU. Hits, misses and evictions are
+# counted per cache for metrics.
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+class CacheStats(BaseModel):
+    """Counters for a cache."""
+    hits: int = 0
+    local_hits: int = 0
+    redis_hits: int = 0
+    misses: int = 0
+    sets: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+class LRUByteCache:
+    """In-process LRU cache whose total size is bounded by `max_bytes` of serialized values."""
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, tuple[Optional[float], int, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[float] = None) -> None:
+        if size > self.max_bytes:
+            logger.debug(f"Not caching {key}: {size} bytes exceeds the {self.max_bytes} byte budget.")
+            return
+        self._remove(key)
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._entries[key] = (expires_at, size, value)
+        self.stats.bytes += size
+        self.stats.entries = len(self._entries)
+        while self.stats.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.stats.bytes -= entry[1]
+            self.stats.entries = len(self._entries)
+
+class ResultCache:
+    """
+    Two-tier cache of JSON-serializable results. Reads check the local LRU, then Redis (promoting
+    hits into the LRU); writes go to both. Redis failures are logged and treated as misses.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        max_bytes: int,
+        ttl: Optional[float] = None,
+        redis: Optional["Redis"] = None,
+    ) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LRUByteCache(max_bytes=max_bytes, ttl=ttl)
+        self.redis = redis
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.local.stats
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            self.stats.hits += 1
+            self.stats.local_hits += 1
+            return value
+
+        if self.redis is not None:
+            try:
+                data = await self.redis.get(self._redis_key(key))
+            except Exception as e:
+                logger.warning(f"Redis cache read failed for {key}: {e!r}")
+                data = None
+            if data is not None:
+                value = json.loads(data)
+                self.local.set(key, value, len(data))
+                self.stats.hits += 1
+                self.stats.redis_hits += 1
+                return value
+
+        self.stats.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self.local.set(key, value, len(data), ttl=ttl)
+        self.stats.sets += 1
+
+        ttl = ttl if ttl is not None else self.ttl
+        if self.redis is not None:
+            try:
+                await self.redis.set(self._redis_key(key), data, ex=int(ttl) if ttl else None)
+            except Exception as e:
+                logger.warning(f"Redis cache write failed for {key}: {e!r}")
+
+    async def delete(self, key: str) -> None:
+        self.local.delete(key)
+        self.stats.invalidations += 1
+        if self.redis is not None:
+            try:
+                await self.redis.delete(self._redis_key(key))
+            except Exception as e:
+                logger.warning(f"Redis cache delete failed for {key}: {e!r}")
+
+    async def close(self) -> None:
+        """Close the Redis client, if any."""
+        if self.redis is not None:
+            await self.redis.aclose()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging."""
+        return {**self.stats.model_dump(), "hit_ratio": round(self.stats.hit_ratio, 4), "max_bytes": self.local.max_bytes}
+
+class DiskLRUCache:
+    """
+    JSON-serializable results stored as one file per key under `directory`, bounded by `max_bytes`
+    on disk. Reads refresh a file's modification time, and the least recently used files are
+    evicted first, so the order survives restarts. File I/O runs in threads.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._index: Optional[OrderedDict[str, int]] = None  # file name -> size, least recent first
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _load_index(self) -> OrderedDict[str, int]:
+        """Scan the directory once, ordering existing entries by modification time."""
+        if self._index is None:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".json"):
+                    info = entry.stat()
+                    entries.append((info.st_mtime, entry.name, info.st_size))
+            self._index = OrderedDict((name, size) for _, name, size in sorted(entries))
+            self.stats.entries = len(self._index)
+            self.stats.bytes = sum(self._index.values())
+        return self._index
+
+    def _get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        with self._lock:
+            index = self._load_index()
+            name = os.path.basename(path)
+            if name not in index:
+                return None
+            index.move_to_end(name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self._forget(os.path.basename(path))
+            return None
+        return json.loads(data)
+
+    def _set(self, key: str, value: Any) -> None:
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            logger.debug(f"Not caching {key}: {len(data)} bytes exceeds the {self.max_bytes} byte budget.")
+            return
+        path = self._path(key)
+        name = os.path.basename(path)
+        with self._lock:
+            self._load_index()
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            index = self._load_index()
+            self.stats.bytes += len(data) - index.pop(name, 0)
+            index[name] = len(data)
+            evicted = []
+            while self.stats.bytes > self.max_bytes and len(index) > 1:
+                oldest, size = index.popitem(last=False)
+                self.stats.bytes -= size
+                self.stats.evictions += 1
+                evicted.append(oldest)
+            self.stats.entries = len(index)
+        for oldest in evicted:
+            try:
+                os.unlink(os.path.join(self.directory, oldest))
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, name: str) -> None:
+        with self._lock:
+            index = self._load_index()
+            size = index.pop(name, None)
+            if size is not None:
+                self.stats.bytes -= size
+                self.stats.entries = len(index)
+
+    def _delete(self, key: str) -> None:
+        path = self._path(key)
+        self._forget(os.path.basename(path))
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            value = await asyncio.to_thread(self._get, key)
+        except Exception as e:
+            logger.warning(f"Disk cache read failed for {key}: {e!r}")
+            value = None
+        if value is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self.stats.local_hits += 1
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        try:
+            await asyncio.to_thread(self._set, key, value)
+            self.stats.sets += 1
+        except Exception as e:
+            logger.warning(f"Disk cache write failed for {key}: {e!r}")
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+        self.stats.invalidations += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging."""
+        return {**self.stats.model_dump(), "hit_ratio": round(self.stats.hit_ratio, 4), "max_bytes": self.max_bytes}
@@ -0,0 +1,294 @@
+# Shinan Context Window
+#
+# A session's input items (the conversation, material and every search result) grow with each
+# query, and were sent to the writer whole. The context manager builds each agent's input from
+# them instead:
+# - Items are normalized into plain messages: tool calls, reasoning and other items that only
+#   mean something to the agent that produced them are dropped, tool outputs become text.
+# - Overlapping search results (the same pages found by several searches) are deduplicated.
+# - The newest items are kept within a per-agent token budget. Tokens are counted per item with
+#   tiktoken (images by their size, as the API counts them).
+# - Once a session's items exceed SHINAN_CONTEXT_COMPACT_TOKENS, the older ones are summarized in
+#   the background after the request and replaced by the summary, keeping the most recent
+#   SHINAN_CONTEXT_KEEP_TOKENS tokens as they are.
+
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Set
+
+from agents import Runner, TResponseInputItem
+from images import MAX_PATCHES, PATCH_TOKEN_MULTIPLIER, image_tokens
+from sessions import ShinanSessionManager, session_store
+from tools.registry import agent_registry
+from usage import usage_accountant
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_DEFAULT_TOKENS = int(os.environ.get("SHINAN_CONTEXT_TOKENS", "32000"))
+CONTEXT_BUDGETS = {
+    "WriterAgent": int(os.environ.get("SHINAN_WRITER_CONTEXT_TOKENS", "64000")),
+    "Messager": int(os.environ.get("SHINAN_MESSAGES_CONTEXT_TOKENS", "16000")),
+}
+CONTEXT_COMPACT_TOKENS = int(os.environ.get("SHINAN_CONTEXT_COMPACT_TOKENS", "48000"))
+CONTEXT_KEEP_TOKENS = int(os.environ.get("SHINAN_CONTEXT_KEEP_TOKENS", "16000"))
+
+# Search results sharing at least this fraction of the shorter one's shingles are duplicates.
+DEDUPE_OVERLAP = 0.8
+SHINGLE_SIZE = 5
+# Per-message overhead of the chat format, in tokens.
+MESSAGE_OVERHEAD = 4
+# Tool outputs are cut to this many characters when turned into text.
+TOOL_OUTPUT_CHARS = 2000
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+# Items that only the agent that produced them can use; they are not passed on to other agents.
+AGENT_ONLY_TYPES = {
+    "function_call",
+    "reasoning",
+    "web_search_call",
+    "file_search_call",
+    "computer_call",
+    "computer_call_output",
+    "mcp_list_tools",
+    "mcp_call",
+    "mcp_approval_request",
+    "mcp_approval_response",
+    "code_interpreter_call",
+    "image_generation_call",
+    "local_shell_call",
+    "local_shell_call_output",
+}
+
+# --- Token counting ---
+_encoding: Any = None
+_encoding_failed = False
+_CJK = re.compile(r"[぀-ヿ㐀-鿿가-힯＀-￯]")
+
+def count_text_tokens(text: str) -> int:
+    """Tokens of a text, with o200k_base if it can be loaded, else estimated."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            _encoding_failed = True
+            logger.warning(f"tiktoken is unavailable, estimating token counts: {e!r}")
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Roughly one token per CJK character and per four other characters.
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+_image_tokens: Dict[str, int] = {}
+
+def count_image_tokens(url: str) -> int:
+    """Tokens of an image data URL, from the image size in its header."""
+    key = hashlib.sha1(url[-256:].encode("utf-8")).hexdigest() + str(len(url))
+    if key not in _image_tokens:
+        tokens = int(MAX_PATCHES * PATCH_TOKEN_MULTIPLIER)
+        if url.startswith("data:"):
+            try:
+                from PIL import Image
+
+                # The header holds the size; only decode the start of the data.
+                head = url.split(",", 1)[1][:65536]
+                with Image.open(io.BytesIO(base64.b64decode(head[: len(head) // 4 * 4]))) as image:
+                    tokens = image_tokens(*image.size)
+            except Exception:
+                pass
+        if len(_image_tokens) > 4096:
+            _image_tokens.clear()
+        _image_tokens[key] = tokens
+    return _image_tokens[key]
+
+def item_tokens(item: TResponseInputItem) -> int:
+    """Tokens of one input item."""
+    content = item.get("content")  # type: ignore[union-attr]
+    if isinstance(content, str):
+        return MESSAGE_OVERHEAD + count_text_tokens(content)
+    if isinstance(content, list):
+        tokens = MESSAGE_OVERHEAD
+        for part in content:
+            if part.get("type") in ("input_image",):
+                tokens += count_image_tokens(part.get("image_url") or "")
+            else:
+                tokens += count_text_tokens(part.get("text") or part.get("refusal") or "")
+        return tokens
+    return MESSAGE_OVERHEAD + count_text_tokens(str(item.get("output", "")))  # type: ignore[union-attr]
+
+# --- Normalization and deduplication ---
+def item_text(item: TResponseInputItem) -> str:
+    """The text of a message item, without its images."""
+    content = item.get("content")  # type: ignore[union-attr]
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if "text" in part)
+    return ""
+
+def normalize(items: List[TResponseInputItem]) -> List[TResponseInputItem]:
+    """Plain messages only: agent-specific items are dropped, tool outputs become assistant text."""
+    normalized: List[TResponseInputItem] = []
+    for item in items:
+        item_type = item.get("type")  # type: ignore[union-attr]
+        if item_type in AGENT_ONLY_TYPES:
+            continue
+        if item_type == "function_call_output":
+            output = str(item.get("output", ""))[:TOOL_OUTPUT_CHARS]  # type: ignore[union-attr]
+            normalized.append({"role": "assistant", "content": f"Tool output: {output}"})
+        elif "role" in item:
+            normalized.append(item)
+    return normalized
+
+def shingles(text: str) -> Set[str]:
+    """Overlapping runs of SHINGLE_SIZE words, or characters for unspaced text."""
+    tokens = text.lower().split() if len(_CJK.findall(text)) * 4 < len(text) else list(re.sub(r"\s+", "", text))
+    return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(len(tokens) - SHINGLE_SIZE + 1, 1))}
+
+def dedupe(items: List[TResponseInputItem]) -> List[TResponseInputItem]:
+    """Drop assistant messages that mostly repeat another one, keeping the longer of the two."""
+    seen: Dict[int, Set[str]] = {}
+    dropped: Set[int] = set()
+    for i, item in enumerate(items):
+        if item.get("role") != "assistant":  # type: ignore[union-attr]
+            continue
+        text = item_text(item)
+        if not text:
+            continue
+        current = shingles(text)
+        for j, previous in seen.items():
+            if j in dropped:
+                continue
+            overlap = len(current & previous) / max(min(len(current), len(previous)), 1)
+            if overlap >= DEDUPE_OVERLAP:
+                if len(current) > len(previous):
+                    dropped.add(j)
+                else:
+                    dropped.add(i)
+                    break
+        seen[i] = current
+    if dropped:
+        logger.info(f"Dropped {len(dropped)} duplicate search results from the context.")
+    return [item for i, item in enumerate(items) if i not in dropped]
+
+# --- Context manager ---
+class ContextManager:
+    """Builds agent inputs from session items within token budgets, and compacts sessions."""
+
+    def __init__(
+        self,
+        budgets: Dict[str, int] = CONTEXT_BUDGETS,
+        default_budget: int = CONTEXT_DEFAULT_TOKENS,
+        compact_tokens: int = CONTEXT_COMPACT_TOKENS,
+        keep_tokens: int = CONTEXT_KEEP_TOKENS,
+    ) -> None:
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.compact_tokens = compact_tokens
+        self.keep_tokens = keep_tokens
+        self._compacting: Dict[str, asyncio.Task[None]] = {}
+
+    def budget(self, agent_name: str) -> int:
+        return self.budgets.get(agent_name, self.default_budget)
+
+    def input_for(
+        self,
+        session: ShinanSessionManager,
+        agent_name: str,
+        tail: Optional[List[TResponseInputItem]] = None,
+    ) -> List[TResponseInputItem]:
+        """
+        The input for an agent: the session's items, normalized, deduplicated and cut to the
+        agent's budget by dropping the oldest, followed by `tail` (e.g. the query), which is
+        always kept. A summary of compacted items stays first.
+        """
+        tail = tail or []
+        items = dedupe(normalize(session.get_input_items()))
+        budget = self.budget(agent_name) - sum(item_tokens(item) for item in tail)
+
+        pinned: List[TResponseInputItem] = []
+        if items and item_text(items[0]).startswith(SUMMARY_PREFIX):
+            pinned = [items.pop(0)]
+            budget -= item_tokens(pinned[0])
+
+        kept: List[TResponseInputItem] = []
+        used = 0
+        for item in reversed(items):
+            tokens = item_tokens(item)
+            if used + tokens > budget:
+                break
+            kept.append(item)
+            used += tokens
+        kept.reverse()
+
+        if len(kept) < len(items):
+            logger.info(
+                f"Context for {agent_name}: kept the newest {len(kept)} of {len(items)} items "
+                f"({used} tokens, budget {self.budget(agent_name)})."
+            )
+        return pinned + kept + tail
+
+    def compact_later(self, session: ShinanSessionManager) -> None:
+        """Summarize the session's older items in the background if it has grown too large."""
+        if session.session_id in self._compacting:
+            return
+        if sum(item_tokens(item) for item in session.get_input_items()) <= self.compact_tokens:
+            return
+        task = asyncio.create_task(self._compact(session.session_id))
+        self._compacting[session.session_id] = task
+        task.add_done_callback(lambda _: self._compacting.pop(session.session_id, None))
+
+    async def _compact(self, session_id: str) -> None:
+        session = await session_store.get(session_id)
+        if session is None:
+            return
+        items = session.get_input_items()
+
+        # Keep the newest items up to keep_tokens as they are; summarize the rest.
+        kept = 0
+        split = len(items)
+        while split > 0 and kept + item_tokens(items[split - 1]) <= self.keep_tokens:
+            split -= 1
+            kept += item_tokens(items[split])
+        old = items[:split]
+        if len(old) < 2:
+            return
+
+        transcript = "\n\n".join(
+            f"{item.get('role', 'assistant')}: {item_text(item)}" for item in normalize(old) if item_text(item)  # type: ignore[union-attr]
+        )
+        try:
+            summary_agent = agent_registry.get("summary")
+            result = await Runner.run(summary_agent, transcript, context=session.get_context())
+        except Exception as e:
+            logger.warning(f"Could not summarize session {session_id}: {e!r}")
+            return
+        summary: TResponseInputItem = {"role": "assistant", "content": SUMMARY_PREFIX + str(result.final_output)}
+
+        # Another request may have changed the session meanwhile; only replace what was summarized.
+        current = await session_store.get(session_id)
+        if current is None or current.get_input_items()[:split] != old:
+            logger.info(f"Session {session_id} changed while it was summarized; not compacting.")
+            return
+        current.set_input_items([summary] + current.get_input_items()[split:])
+        usage_accountant.record_run(result, summary_agent, "compaction", current.usage)
+        await session_store.save(current)
+        logger.info(
+            f"Compacted {split} items of session {session_id} into a summary of {item_tokens(summary)} tokens."
+        )
+
+    async def close(self) -> None:
+        """Stop any summarization in progress."""
+        tasks = list(self._compacting.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+context_manager = ContextManager()
@@ -0,0 +1,452 @@
+# Shinan Deep Research Jobs
+#
+# Deep Research API runs take many minutes, so they run as background jobs instead of inside the
+# request. Submitting returns a job ID; the run streams from the Responses API in background mode,
+# and its progress (status, reasoning summaries, web searches, citations, report text) is recorded
+# as numbered events in a job store. Clients follow a job over SSE or by polling, and can resume
+# from the last event they saw after reconnecting.
+#
+# SHINAN_JOB_STORE selects the store: "memory" (default, per process) or "redis" (REDIS_URL).
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Literal, Optional
+
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI
+from pydantic import BaseModel, Field
+
+from sessions import session_store
+from streaming import SSE_HEARTBEAT, SSE_HEARTBEAT_INTERVAL, format_sse
+from tools.prompts import Prompt
+from tools.schemas import Report
+from usage import usage_accountant
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+DEEP_RESEARCH_MODEL = os.environ.get("SHINAN_DEEP_RESEARCH_MODEL", "o3-deep-research")
+DEEP_RESEARCH_CONCURRENCY = int(os.environ.get("SHINAN_DEEP_RESEARCH_CONCURRENCY", "2"))
+DEEP_RESEARCH_MAX_RESUMES = int(os.environ.get("SHINAN_DEEP_RESEARCH_MAX_RESUMES", "5"))
+JOB_TTL = int(os.environ.get("SHINAN_JOB_TTL", str(60 * 60 * 24 * 7)))
+JOB_MAX_ENTRIES = int(os.environ.get("SHINAN_JOB_MAX_ENTRIES", "256"))
+
+# Report text deltas are coalesced into events of at least this many characters, or this often.
+DELTA_FLUSH_CHARS = 200
+DELTA_FLUSH_INTERVAL = 0.5
+
+JobStatus = Literal["queued", "running", "completed", "failed", "cancelled"]
+TERMINAL_STATUSES = {"completed", "failed", "cancelled"}
+
+class JobEvent(BaseModel):
+    """A numbered progress event of a job."""
+    seq: int
+    type: Literal["status", "reasoning", "search", "citation", "delta", "final", "error"]
+    data: Dict[str, Any] = Field(default_factory=dict)
+    at: float = Field(default_factory=time.time)
+
+class Citation(BaseModel):
+    """A source cited in the report."""
+    title: str
+    url: str
+    start_index: Optional[int] = None
+    end_index: Optional[int] = None
+
+class DeepResearchJob(BaseModel):
+    """A deep research run and its result."""
+    job_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    session_id: str
+    query: str
+    status: JobStatus = "queued"
+    response_id: Optional[str] = None
+    last_sequence: Optional[int] = None
+    report: str = ""
+    citations: List[Citation] = Field(default_factory=list)
+    error: Optional[str] = None
+    created_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+
+# --- Job stores ---
+class JobStore(ABC):
+    """Persists jobs and their event logs."""
+
+    def __init__(self, ttl: int = JOB_TTL) -> None:
+        self.ttl = ttl
+
+    @abstractmethod
+    async def save(self, job: DeepResearchJob) -> None:
+        """Create or update a job."""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[DeepResearchJob]:
+        """Get a job, or None if it does not exist or has expired."""
+
+    @abstractmethod
+    async def append_event(self, job_id: str, event_type: str, data: Dict[str, Any]) -> JobEvent:
+        """Append an event to a job's log, numbering it."""
+
+    @abstractmethod
+    async def events(self, job_id: str, after: int = 0) -> List[JobEvent]:
+        """Get a job's events with seq greater than `after`."""
+
+    @abstractmethod
+    async def wait_for_events(self, job_id: str, after: int, timeout: float) -> bool:
+        """Wait up to `timeout` for an event with seq greater than `after`. Returns whether one arrived."""
+
+    async def close(self) -> None:
+        """Release any resources held by the store."""
+
+class InMemoryJobStore(JobStore):
+    """Per-process job store. The oldest jobs are evicted beyond `max_entries`."""
+
+    def __init__(self, ttl: int = JOB_TTL, max_entries: int = JOB_MAX_ENTRIES) -> None:
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._jobs: OrderedDict[str, DeepResearchJob] = OrderedDict()
+        self._events: Dict[str, List[JobEvent]] = {}
+        self._conditions: Dict[str, asyncio.Condition] = {}
+
+    def _evict(self) -> None:
+        now = time.time()
+        for job_id in [jid for jid, job in self._jobs.items() if job.updated_at + self.ttl <= now]:
+            self._drop(job_id)
+        while len(self._jobs) > self.max_entries:
+            self._drop(next(iter(self._jobs)))
+
+    def _drop(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+        self._events.pop(job_id, None)
+        self._conditions.pop(job_id, None)
+
+    async def save(self, job: DeepResearchJob) -> None:
+        job.updated_at = time.time()
+        self._jobs[job.job_id] = job.model_copy(deep=True)
+        self._events.setdefault(job.job_id, [])
+        self._conditions.setdefault(job.job_id, asyncio.Condition())
+        self._evict()
+
+    async def get(self, job_id: str) -> Optional[DeepResearchJob]:
+        job = self._jobs.get(job_id)
+        return job.model_copy(deep=True) if job else None
+
+    async def append_event(self, job_id: str, event_type: str, data: Dict[str, Any]) -> JobEvent:
+        events = self._events.setdefault(job_id, [])
+        event = JobEvent(seq=len(events) + 1, type=event_type, data=data)  # type: ignore[arg-type]
+        events.append(event)
+        condition = self._conditions.setdefault(job_id, asyncio.Condition())
+        async with condition:
+            condition.notify_all()
+        return event
+
+    async def events(self, job_id: str, after: int = 0) -> List[JobEvent]:
+        return self._events.get(job_id, [])[after:]
+
+    async def wait_for_events(self, job_id: str, after: int, timeout: float) -> bool:
+        condition = self._conditions.setdefault(job_id, asyncio.Condition())
+        async with condition:
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: len(self._events.get(job_id, [])) > after),
+                    timeout=timeout,
+                )
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+class RedisJobStore(JobStore):
+    """Job store shared across workers and nodes. Jobs and events expire `ttl` seconds after their last update."""
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, redis: "Redis", ttl: int = JOB_TTL, prefix: str = "shinan:job:") -> None:
+        super().__init__(ttl)
+        self.redis = redis
+        self.prefix = prefix
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}"
+
+    def _events_key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}:events"
+
+    async def save(self, job: DeepResearchJob) -> None:
+        job.updated_at = time.time()
+        await self.redis.set(self._key(job.job_id), job.model_dump_json(), ex=self.ttl)
+
+    async def get(self, job_id: str) -> Optional[DeepResearchJob]:
+        data = await self.redis.get(self._key(job_id))
+        return DeepResearchJob.model_validate_json(data) if data else None
+
+    async def append_event(self, job_id: str, event_type: str, data: Dict[str, Any]) -> JobEvent:
+        key = self._events_key(job_id)
+        # Reserve the sequence number by pushing a placeholder, then fill it in.
+        seq = await self.redis.rpush(key, "")
+        event = JobEvent(seq=seq, type=event_type, data=data)  # type: ignore[arg-type]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lset(key, seq - 1, event.model_dump_json())
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        return event
+
+    async def events(self, job_id: str, after: int = 0) -> List[JobEvent]:
+        raw = await self.redis.lrange(self._events_key(job_id), after, -1)
+        events: List[JobEvent] = []
+        for item in raw:
+            if not item:
+                break   # A placeholder still being written; later events wait for the next read.
+            events.append(JobEvent.model_validate_json(item))
+        return events
+
+    async def wait_for_events(self, job_id: str, after: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            if await self.redis.llen(self._events_key(job_id)) > after:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(self.POLL_INTERVAL, remaining))
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+def create_job_store() -> JobStore:
+    """Create the job store configured by SHINAN_JOB_STORE."""
+    backend = os.environ.get("SHINAN_JOB_STORE", "memory").lower()
+    if backend == "redis":
+        from redis.asyncio import Redis  # Only imported when Redis is used.
+
+        return RedisJobStore(Redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0")))
+    if backend != "memory":
+        raise ValueError(f"Unknown job store: {backend}. Use 'memory' or 'redis'.")
+    return InMemoryJobStore()
+
+# --- Runner ---
+class DeepResearchRunner:
+    """Runs deep research jobs in the background, at most `concurrency` at a time."""
+
+    def __init__(self, store: JobStore, concurrency: int = DEEP_RESEARCH_CONCURRENCY) -> None:
+        self.store = store
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Dict[str, asyncio.Task[None]] = {}
+        self._client: Optional[AsyncOpenAI] = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self._client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        return self._client
+
+    async def submit(self, session_id: str, query: str) -> DeepResearchJob:
+        """Queue a deep research run and return its job."""
+        job = DeepResearchJob(session_id=session_id, query=query)
+        await self.store.save(job)
+        await self.store.append_event(job.job_id, "status", {"status": job.status})
+        self._tasks[job.job_id] = asyncio.create_task(self._run(job), name=f"deep-research-{job.job_id}")
+        self._tasks[job.job_id].add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+        logger.info(f"Deep research job {job.job_id} queued.")
+        return job
+
+    async def cancel(self, job: DeepResearchJob) -> DeepResearchJob:
+        """Cancel a job, whether it is running in this process or not."""
+        if job.status in TERMINAL_STATUSES:
+            return job
+        task = self._tasks.get(job.job_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        else:
+            if job.response_id:
+                await self.client.responses.cancel(job.response_id)
+            await self._set_status(job, "cancelled")
+        return await self.store.get(job.job_id) or job
+
+    async def close(self) -> None:
+        """Cancel the jobs running in this process, e.g. on shutdown."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _set_status(self, job: DeepResearchJob, status: JobStatus, **data: Any) -> None:
+        job.status = status
+        await self.store.save(job)
+        await self.store.append_event(job.job_id, "status", {"status": status, **data})
+
+    async def _run(self, job: DeepResearchJob) -> None:
+        try:
+            async with self._semaphore:
+                await self._set_status(job, "running")
+                await self._stream(job)
+        except asyncio.CancelledError:
+            if job.response_id:
+                try:
+                    await self.client.responses.cancel(job.response_id)
+                except Exception as e:
+                    logger.warning(f"Could not cancel response {job.response_id}: {e!r}")
+            await self._set_status(job, "cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Deep research job {job.job_id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            await self.store.append_event(job.job_id, "error", {"message": str(e)})
+            await self._set_status(job, "failed")
+
+    async def _stream(self, job: DeepResearchJob) -> None:
+        """Stream the background response, resuming from the last sequence number if the connection drops."""
+        resumes = 0
+        deltas = _DeltaBuffer()
+        while True:
+            try:
+                if job.response_id is None:
+                    stream = await self.client.responses.create(
+                        model=DEEP_RESEARCH_MODEL,
+                        input=[
+                            {"role": "developer", "content": [{"type": "input_text", "text": Prompt().get_deep_research_system_prompt()}]},
+                            {"role": "user", "content": [{"type": "input_text", "text": job.query}]},
+                        ],
+                        reasoning={"summary": "auto"},
+                        tools=[{"type": "web_search_preview"}],
+                        background=True,
+                        stream=True,
+                    )
+                else:
+                    stream = await self.client.responses.retrieve(
+                        job.response_id, stream=True, starting_after=job.last_sequence or 0
+                    )
+
+                async for event in stream:
+                    job.last_sequence = event.sequence_number
+                    if await self._handle(job, event, deltas):
+                        return
+
+            except (APIConnectionError, APITimeoutError) as e:
+                if job.response_id is None or resumes >= DEEP_RESEARCH_MAX_RESUMES:
+                    raise
+                logger.warning(f"Deep research job {job.job_id} stream dropped, resuming: {e!r}")
+
+            if job.response_id is None:
+                raise RuntimeError("Deep research stream ended before the response was created.")
+            resumes += 1
+            if resumes > DEEP_RESEARCH_MAX_RESUMES:
+                raise RuntimeError("Deep research stream ended without completing.")
+            await asyncio.sleep(min(2 ** resumes, 30))
+
+    async def _handle(self, job: DeepResearchJob, event: Any, deltas: "_DeltaBuffer") -> bool:
+        """Record one Responses API stream event. Returns True once the response has finished."""
+        if event.type == "response.created":
+            job.response_id = event.response.id
+            await self.store.save(job)
+
+        elif event.type == "response.reasoning_summary_text.done":
+            await self.store.append_event(job.job_id, "reasoning", {"text": event.text})
+
+        elif event.type == "response.output_item.done" and event.item.type == "web_search_call":
+            action = getattr(event.item, "action", None)
+            if action is not None and getattr(action, "type", None) == "search":
+                await self.store.append_event(job.job_id, "search", {"query": getattr(action, "query", "")})
+
+        elif event.type == "response.output_text.delta":
+            job.report += event.delta
+            chunk = deltas.add(event.delta)
+            if chunk:
+                await self.store.append_event(job.job_id, "delta", {"text": chunk})
+
+        elif event.type.startswith("response.output_text") and event.type.endswith("annotation.added"):
+            annotation = event.annotation if isinstance(event.annotation, dict) else {}
+            if annotation.get("type") == "url_citation":
+                await self.store.append_event(job.job_id, "citation", _citation(annotation).model_dump())
+
+        elif event.type == "response.completed":
+            chunk = deltas.flush()
+            if chunk:
+                await self.store.append_event(job.job_id, "delta", {"text": chunk})
+            self._complete(job, event.response)
+            await self.store.append_event(
+                job.job_id, "final", {"report": job.report, "citations": [c.model_dump() for c in job.citations]}
+            )
+            await self._set_status(job, "completed")
+            await self._save_report(job, event.response)
+            return True
+
+        elif event.type in ("response.failed", "response.incomplete", "error"):
+            response = getattr(event, "response", None)
+            error = getattr(response, "error", None) or getattr(event, "message", None) or event.type
+            raise RuntimeError(str(getattr(error, "message", error)))
+
+        return False
+
+    def _complete(self, job: DeepResearchJob, response: Any) -> None:
+        """Take the report text and citations from the finished response."""
+        message = next((item for item in reversed(response.output) if item.type == "message"), None)
+        if message is None:
+            return
+        for content in message.content:
+            if content.type == "output_text":
+                job.report = content.text
+                job.citations = [
+                    _citation(annotation.model_dump())
+                    for annotation in content.annotations
+                    if annotation.type == "url_citation"
+                ]
+
+    async def _save_report(self, job: DeepResearchJob, response: Any) -> None:
+        """Store the report in the session, so follow-up messages can refer to it, and count its usage."""
+        session = await session_store.load(job.session_id)
+        session.set_report(Report(report=job.report))
+        if response.usage is not None:
+            usage_accountant.record_usage(response.usage, "DeepResearch", response.model or DEEP_RESEARCH_MODEL, "deep_research", session.usage)
+        await session_store.save(session)
+
+    # --- Following jobs ---
+    async def follow(self, job_id: str, after: int = 0) -> AsyncIterator[str]:
+        """Stream a job's events as SSE from `after`, with heartbeats, until the job finishes."""
+        last = after
+        while True:
+            for event in await self.store.events(job_id, last):
+                last = event.seq
+                yield format_sse(event.model_dump_json(), event=event.type, id=event.seq)
+                if event.type == "status" and event.data.get("status") in TERMINAL_STATUSES:
+                    return
+            if not await self.store.wait_for_events(job_id, last, SSE_HEARTBEAT_INTERVAL):
+                if await self.store.get(job_id) is None:
+                    return
+                yield SSE_HEARTBEAT
+
+class _DeltaBuffer:
+    """Coalesces report text deltas so the event log does not grow by one event per token."""
+
+    def __init__(self) -> None:
+        self._parts: List[str] = []
+        self._size = 0
+        self._flushed_at = time.monotonic()
+
+    def add(self, delta: str) -> str:
+        self._parts.append(delta)
+        self._size += len(delta)
+        if self._size >= DELTA_FLUSH_CHARS or time.monotonic() - self._flushed_at >= DELTA_FLUSH_INTERVAL:
+            return self.flush()
+        return ""
+
+    def flush(self) -> str:
+        chunk = "".join(self._parts)
+        self._parts, self._size, self._flushed_at = [], 0, time.monotonic()
+        return chunk
+
+def _citation(annotation: Dict[str, Any]) -> Citation:
+    return Citation(
+        title=annotation.get("title", ""),
+        url=annotation.get("url", ""),
+        start_index=annotation.get("start_index"),
+        end_index=annotation.get("end_index"),
+    )
+
+job_store: JobStore = create_job_store()
+deep_research = DeepResearchRunner(job_store)
@@ -0,0 +1,177 @@
+# Shinan Guardrails
+#
+# The sensitive-material guardrail (tools/idea_generation/guardrail_agent.py) is an LLM call over
+# the agent's whole input, which for uploads means every slide image. To keep it off the critical
+# path:
+# - A local pre-filter scans the input's text (including extracted and OCR'd slide text) for
+#   explicit confidentiality markers such as CONFIDENTIAL or 社外秘, which trip the guardrail
+#   without the LLM. Short text-only inputs (typed queries) pass without it unless they contain
+#   the markers' words in another case ("confidential"), which are left to the LLM.
+# - Verdicts are cached by the SHA-256 of the input, so identical material is checked once.
+#   SHINAN_GUARDRAIL_CACHE_REDIS_URL shares verdicts across workers.
+# - run_guarded runs an agent and its input guardrails side by side, cancelling the run as soon
+#   as a guardrail trips. (Streamed runs get the same from the Agents SDK.)
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Literal, Optional
+
+from agents import Agent, InputGuardrail, InputGuardrailResult, InputGuardrailTripwireTriggered, Runner, RunResult, guardrail_span
+from agents.run_context import RunContextWrapper
+from pydantic import BaseModel
+
+from caching import ResultCache
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+GUARDRAIL_CACHE_TTL = int(os.environ.get("SHINAN_GUARDRAIL_CACHE_TTL", str(60 * 60 * 24 * 7)))
+GUARDRAIL_CACHE_BYTES = int(os.environ.get("SHINAN_GUARDRAIL_CACHE_BYTES", str(4 * 1024 * 1024)))
+GUARDRAIL_CACHE_REDIS_URL = os.environ.get("SHINAN_GUARDRAIL_CACHE_REDIS_URL")
+# Text-only inputs up to this many characters without markers skip the LLM check. 0 disables.
+GUARDRAIL_LOCAL_MAX_CHARS = int(os.environ.get("SHINAN_GUARDRAIL_LOCAL_MAX_CHARS", "500"))
+
+# Explicit confidentiality markers. The English ones must be upper case, as markers are, so that
+# a question about "confidential computing" is not mistaken for one. The same words in another
+# case are left to the LLM rather than passed locally.
+_MARKERS = (
+    r"\b(?:STRICTLY\s+)?CONFIDENTIAL\b"
+    r"|\bPROPRIETARY\s+(?:AND\s+CONFIDENTIAL|INFORMATION)\b"
+    r"|\bINTERNAL\s+(?:USE\s+)?ONLY\b"
+    r"|\b(?:UNDER\s+NDA|NDA\s+PROTECTED)\b"
+    r"|\bDO\s+NOT\s+(?:DISTRIBUTE|FORWARD|COPY)\b"
+    r"|社外秘|部外秘|関係者外秘|極秘|取扱注意|機密情報"
+)
+SENSITIVE_MARKERS = re.compile(_MARKERS)
+POSSIBLE_MARKERS = re.compile(_MARKERS, re.IGNORECASE)
+
+class Verdict(BaseModel):
+    """The outcome of the sensitive-material check."""
+    is_sensitive: bool
+    reason: str
+    source: Literal["prefilter", "cache", "model"]
+
+# --- Input inspection ---
+def input_text(input: str | list[Any]) -> tuple[str, bool]:
+    """The text of an agent input, and whether it also contains images or files."""
+    if isinstance(input, str):
+        return input, False
+    texts: list[str] = []
+    has_media = False
+    for item in input:
+        content = item.get("content") if isinstance(item, dict) else None
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") in ("input_text", "output_text"):
+                    texts.append(part.get("text", ""))
+                else:
+                    has_media = True
+    return "\n".join(texts), has_media
+
+def prefilter(input: str | list[Any]) -> Optional[Verdict]:
+    """
+    Decide obvious cases locally: explicit markers trip, short plain text without the markers'
+    words in any case passes. None if unsure.
+    """
+    text, has_media = input_text(input)
+    marker = SENSITIVE_MARKERS.search(text)
+    if marker:
+        return Verdict(is_sensitive=True, reason=f"The material is marked {marker.group(0)!r}.", source="prefilter")
+    if POSSIBLE_MARKERS.search(text):
+        return None
+    if not has_media and len(text) <= GUARDRAIL_LOCAL_MAX_CHARS:
+        return Verdict(is_sensitive=False, reason="Short text without confidentiality markers.", source="prefilter")
+    return None
+
+def _digest(input: str | list[Any]) -> str:
+    return hashlib.sha256(json.dumps(input, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+async def input_digest(input: str | list[Any]) -> str:
+    """The SHA-256 of an agent input. Inputs with images are hashed in a thread."""
+    _, has_media = input_text(input)
+    return await asyncio.to_thread(_digest, input) if has_media else _digest(input)
+
+# --- Screening ---
+def _verdict_redis() -> Optional["Redis"]:
+    if not GUARDRAIL_CACHE_REDIS_URL:
+        return None
+    from redis.asyncio import Redis  # Only imported when Redis is used.
+
+    return Redis.from_url(GUARDRAIL_CACHE_REDIS_URL)
+
+verdict_cache = ResultCache(
+    "shinan:guardrail",
+    max_bytes=GUARDRAIL_CACHE_BYTES,
+    ttl=GUARDRAIL_CACHE_TTL,
+    redis=_verdict_redis(),
+)
+
+async def screen(input: str | list[Any], check: Callable[[], Awaitable[Verdict]], version: str = "") -> Verdict:
+    """
+    Check an input for sensitive material: locally if the case is obvious, else from the verdict
+    cache, else with `check` (the LLM), whose verdict is cached. `version` identifies the check,
+    so a changed prompt does not reuse old verdicts.
+    """
+    verdict = prefilter(input)
+    if verdict is not None:
+        logger.info(f"Guardrail decided locally: {verdict.reason}")
+        return verdict
+
+    key = f"{version}:{await input_digest(input)}"
+    cached = await verdict_cache.get(key)
+    if cached is not None:
+        return Verdict(**{**cached, "source": "cache"})
+
+    verdict = await check()
+    await verdict_cache.set(key, verdict.model_dump())
+    return verdict
+
+# --- Running agents ---
+async def run_guarded(agent: Agent[Any], input: str | list[Any], context: Any = None, **kwargs: Any) -> RunResult:
+    """
+    Run an agent to completion with its input guardrails running alongside it. The run is
+    cancelled as soon as a guardrail trips, raising InputGuardrailTripwireTriggered as Runner.run
+    does; otherwise its result is returned once every guardrail has passed.
+    """
+    if not agent.input_guardrails:
+        return await Runner.run(agent, input, context=context, **kwargs)
+
+    wrapper = RunContextWrapper(context=context)
+
+    async def check(guardrail: InputGuardrail[Any]) -> InputGuardrailResult:
+        # Traced like the guardrails the Runner runs itself.
+        with guardrail_span(guardrail.get_name()) as span:
+            result = await guardrail.run(agent, input, wrapper)
+            span.span_data.triggered = result.output.tripwire_triggered
+            return result
+
+    run = asyncio.create_task(Runner.run(agent.clone(input_guardrails=[]), input, context=context, **kwargs))
+    checks = [asyncio.create_task(check(guardrail)) for guardrail in agent.input_guardrails]
+    try:
+        results: list[InputGuardrailResult] = []
+        for done in asyncio.as_completed(checks):
+            result = await done
+            if result.output.tripwire_triggered:
+                logger.info(f"Guardrail {result.guardrail.get_name()} tripped; cancelling the {agent.name} run.")
+                raise InputGuardrailTripwireTriggered(result)
+            results.append(result)
+        run_result = await run
+        run_result.input_guardrail_results = results
+        return run_result
+    finally:
+        pending = [task for task in (run, *checks) if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+def snapshot() -> Dict[str, Any]:
+    """Stats for metrics and logging."""
+    return verdict_cache.snapshot()
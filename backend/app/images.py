@@ -0,0 +1,161 @@
+# Shinan Image Preparation
+#
+# Prepares images for the vision model before they are sent as material. Each image is
+# downscaled to fit a maximum edge and an image-token budget, and encoded by content: flat
+# slide graphics and text stay lossless PNG, photographic images become JPEG (or WebP). Images
+# that already fit and are already in the right format are passed through untouched.
+#
+# SHINAN_IMAGE_FORMAT forces one format (png, jpeg, webp) instead of choosing by content,
+# SHINAN_IMAGE_MAX_EDGE caps the longest side in pixels, and SHINAN_IMAGE_TOKEN_BUDGET caps the
+# image tokens of one upload, shared between its images.
+
+import base64
+import io
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterable, Literal, Tuple
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+ImageFormat = Literal["auto", "png", "jpeg", "webp"]
+
+IMAGE_FORMAT: ImageFormat = os.environ.get("SHINAN_IMAGE_FORMAT", "auto").lower()  # type: ignore[assignment]
+IMAGE_LOSSY_FORMAT = os.environ.get("SHINAN_IMAGE_LOSSY_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.environ.get("SHINAN_IMAGE_QUALITY", "85"))
+IMAGE_MAX_EDGE = int(os.environ.get("SHINAN_IMAGE_MAX_EDGE", "2048"))
+IMAGE_TOKEN_BUDGET = int(os.environ.get("SHINAN_IMAGE_TOKEN_BUDGET", "32000"))
+
+# Images with more distinct colours than this (on a 256x256 sample) are treated as photographic.
+PHOTO_COLOR_THRESHOLD = 4096
+
+# Vision token accounting for o4-mini: images are covered by 32px patches, at most 1536 of them
+# (larger images are scaled down by the API), and each patch costs a model-specific multiple.
+PATCH_SIZE = 32
+MAX_PATCHES = 1536
+PATCH_TOKEN_MULTIPLIER = 1.72
+
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+def _patches(width: int, height: int) -> int:
+    return math.ceil(width / PATCH_SIZE) * math.ceil(height / PATCH_SIZE)
+
+def image_tokens(width: int, height: int) -> int:
+    """The input tokens an image of this size costs, after the API's own downscaling."""
+    width, height = _fit_patches(width, height, MAX_PATCHES)
+    return math.ceil(_patches(width, height) * PATCH_TOKEN_MULTIPLIER)
+
+def _fit_patches(width: int, height: int, max_patches: int) -> Tuple[int, int]:
+    if _patches(width, height) <= max_patches:
+        return width, height
+    scale = math.sqrt(PATCH_SIZE * PATCH_SIZE * max_patches / (width * height))
+    while True:
+        fitted = max(1, int(width * scale)), max(1, int(height * scale))
+        if _patches(*fitted) <= max_patches:
+            return fitted
+        scale *= 0.98
+
+def fit_size(width: int, height: int, max_edge: int = IMAGE_MAX_EDGE, max_tokens: int | None = None) -> Tuple[int, int]:
+    """The largest size, keeping the aspect ratio, within `max_edge` pixels and `max_tokens` image tokens."""
+    if max(width, height) > max_edge:
+        scale = max_edge / max(width, height)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+    max_patches = MAX_PATCHES
+    if max_tokens is not None:
+        max_patches = max(1, min(max_patches, int(max_tokens / PATCH_TOKEN_MULTIPLIER)))
+    return _fit_patches(width, height, max_patches)
+
+def choose_format(image: "Image.Image") -> str:
+    """PNG for transparency and flat graphics such as slides and charts, the lossy format for photographs."""
+    if IMAGE_FORMAT != "auto":
+        return IMAGE_FORMAT
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        return "png"
+    # Nearest-neighbour sampling keeps the original colours; averaging would blend them into new ones.
+    from PIL import Image
+
+    sample = image.convert("RGB").resize((256, 256), Image.Resampling.NEAREST)
+    return "png" if sample.getcolors(maxcolors=PHOTO_COLOR_THRESHOLD) is not None else IMAGE_LOSSY_FORMAT
+
+@dataclass
+class PreparedImage:
+    """An image ready to send, with its size and token cost before and after preparation."""
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    original_bytes: int
+    original_tokens: int
+    reencoded: bool
+
+    @property
+    def tokens(self) -> int:
+        return image_tokens(self.width, self.height)
+
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+def prepare_image(
+    data: bytes,
+    max_edge: int = IMAGE_MAX_EDGE,
+    max_tokens: int | None = None,
+    original_size: Tuple[int, int] | None = None,
+) -> PreparedImage:
+    """
+    Downscale and re-encode an encoded image as needed. CPU-bound: call it off the event loop.
+    `original_size` is the size the image had before any earlier downscaling, for reporting savings.
+    """
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    source_format = (image.format or "").lower()
+    width, height = image.size
+    target = fit_size(width, height, max_edge, max_tokens)
+    image_format = choose_format(image)
+    original_tokens = image_tokens(*(original_size or image.size))
+
+    if target == (width, height) and image_format == source_format:
+        return PreparedImage(data, MIME_TYPES[image_format], width, height, len(data), original_tokens, reencoded=False)
+
+    if target != (width, height):
+        image = image.resize(target, Image.Resampling.LANCZOS)
+        if image_format == "png" and image.mode == "RGB":
+            # Resampling blends flat graphics into thousands of colours; a palette keeps the PNG small.
+            image = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    buffer = io.BytesIO()
+    if image_format == "png":
+        image.save(buffer, format="PNG")
+    else:
+        image.convert("RGB").save(buffer, format=image_format.upper(), quality=IMAGE_QUALITY)
+    encoded = buffer.getvalue()
+
+    # Re-encoding at the same size can come out larger (e.g. an already well-compressed JPEG).
+    if target == (width, height) and len(encoded) >= len(data) and source_format in MIME_TYPES:
+        return PreparedImage(data, MIME_TYPES[source_format], width, height, len(data), original_tokens, reencoded=False)
+    return PreparedImage(encoded, MIME_TYPES[image_format], *target, len(data), original_tokens, reencoded=True)
+
+def report_savings(name: str | None, images: Iterable[PreparedImage]) -> dict:
+    """
+    Log and return the byte and token savings of an upload's images. Bytes are compared with the
+    images as uploaded or rendered; tokens with their size before any downscaling.
+    """
+    images = list(images)
+    report = {
+        "images": len(images),
+        "reencoded": sum(image.reencoded for image in images),
+        "bytes_before": sum(image.original_bytes for image in images),
+        "bytes_after": sum(len(image.data) for image in images),
+        "tokens_before": sum(image.original_tokens for image in images),
+        "tokens_after": sum(image.tokens for image in images),
+    }
+    if images:
+        logger.info(
+            f"Prepared {report['images']} images for {name}: "
+            f"{report['bytes_before'] / 1e6:.2f}MB -> {report['bytes_after'] / 1e6:.2f}MB, "
+            f"{report['tokens_before']} -> {report['tokens_after']} image tokens."
+        )
+    return report
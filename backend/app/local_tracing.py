@@ -0,0 +1,282 @@
+# Shinan Local Tracing
+#
+# The workflows' traces (trace("Shinan Intelligence Text Workflow", group_id=...)) normally go to
+# OpenAI's hosted dashboard only. With SHINAN_TRACE_FILE set, a local trace processor also writes
+# every trace and span (agent runs, model responses, tool calls, handoffs, guardrails) to that file
+# as compact JSONL, one line per finished span, rotated at SHINAN_TRACE_MAX_BYTES with
+# SHINAN_TRACE_BACKUPS old files kept. Model inputs and outputs are not written, only names,
+# timings, token counts and errors. SHINAN_TRACE_OPENAI=0 stops exporting to OpenAI altogether.
+#
+# The files can be read offline, grouped by group_id (one per query or upload):
+#     python -m local_tracing list
+#     python -m local_tracing show <group_id>     # Timelines of the group's traces.
+#     python -m local_tracing folded <group_id>   # Folded stacks, for flamegraph.pl or speedscope.
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, Iterator, List, Optional
+
+from agents.tracing import Span, Trace, TracingProcessor, add_trace_processor, set_trace_processors
+from agents.tracing.span_data import (
+    AgentSpanData,
+    FunctionSpanData,
+    GenerationSpanData,
+    GuardrailSpanData,
+    HandoffSpanData,
+    MCPListToolsSpanData,
+    ResponseSpanData,
+)
+
+from metrics import metrics_processor
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.environ.get("SHINAN_TRACE_FILE", "")
+TRACE_MAX_BYTES = int(os.environ.get("SHINAN_TRACE_MAX_BYTES", str(20 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.environ.get("SHINAN_TRACE_BACKUPS", "5"))
+TRACE_OPENAI = os.environ.get("SHINAN_TRACE_OPENAI", "1") != "0"
+
+def _timestamp(iso: Optional[str]) -> Optional[float]:
+    return round(datetime.fromisoformat(iso).timestamp(), 4) if iso else None
+
+def _span_details(data: Any) -> Dict[str, Any]:
+    """The name of a span, and the few details of its data worth keeping for profiling."""
+    if isinstance(data, ResponseSpanData):
+        response = data.response
+        if response is None:
+            return {"name": "response"}
+        details: Dict[str, Any] = {"name": response.model}
+        if response.usage is not None:
+            details["input_tokens"] = response.usage.input_tokens
+            details["output_tokens"] = response.usage.output_tokens
+        return details
+    if isinstance(data, GenerationSpanData):
+        return {"name": data.model or "generation"}
+    if isinstance(data, HandoffSpanData):
+        return {"name": f"{data.from_agent} -> {data.to_agent}"}
+    if isinstance(data, GuardrailSpanData):
+        return {"name": data.name, "triggered": data.triggered}
+    if isinstance(data, MCPListToolsSpanData):
+        return {"name": data.server or "mcp"}
+    if isinstance(data, (AgentSpanData, FunctionSpanData)):
+        return {"name": data.name}
+    return {"name": getattr(data, "name", None) or data.type}
+
+class LocalTraceProcessor(TracingProcessor):
+    """Writes traces and spans to a rotating JSONL file."""
+
+    def __init__(self, path: str, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # The logging handler rotates the file and serializes writes across threads.
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        self._traces: Dict[str, Dict[str, Any]] = {}  # Open trace ID -> its name, group and start.
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps({k: v for k, v in record.items() if v is not None}, ensure_ascii=False, separators=(",", ":"))
+        self._handler.emit(logging.makeLogRecord({"msg": line}))
+
+    def on_trace_start(self, trace: Trace) -> None:
+        self._traces[trace.trace_id] = {
+            "name": trace.name,
+            "group_id": getattr(trace, "group_id", None),
+            "start": round(time.time(), 4),
+        }
+
+    def on_trace_end(self, trace: Trace) -> None:
+        opened = self._traces.pop(trace.trace_id, None) or {"name": trace.name, "group_id": getattr(trace, "group_id", None)}
+        self._write({"kind": "trace", "trace_id": trace.trace_id, **opened, "end": round(time.time(), 4)})
+
+    def on_span_start(self, span: Span[Any]) -> None:
+        pass
+
+    def on_span_end(self, span: Span[Any]) -> None:
+        trace = self._traces.get(span.trace_id, {})
+        error = span.error
+        self._write({
+            "kind": "span",
+            "trace_id": span.trace_id,
+            # Written on every span, so a group can be followed even when its trace line was rotated away.
+            "group_id": trace.get("group_id"),
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "type": span.span_data.type,
+            **_span_details(span.span_data),
+            "start": _timestamp(span.started_at),
+            "end": _timestamp(span.ended_at),
+            "error": error["message"] if error else None,
+        })
+
+    def shutdown(self) -> None:
+        self._handler.close()
+
+    def force_flush(self) -> None:
+        self._handler.flush()
+
+def create_local_trace_processor() -> Optional[LocalTraceProcessor]:
+    """The local trace processor, registered with the Agents SDK, if SHINAN_TRACE_FILE is set."""
+    if not TRACE_FILE:
+        if not TRACE_OPENAI:
+            logger.warning("SHINAN_TRACE_OPENAI=0 without SHINAN_TRACE_FILE: traces are not kept anywhere.")
+            set_trace_processors([metrics_processor])
+        return None
+    processor = LocalTraceProcessor(TRACE_FILE)
+    if TRACE_OPENAI:
+        add_trace_processor(processor)
+    else:
+        # Replaces the OpenAI exporter; the metrics processor still needs the spans.
+        set_trace_processors([metrics_processor, processor])
+    logger.info(f"Writing traces to {TRACE_FILE} (OpenAI export {'on' if TRACE_OPENAI else 'off'}).")
+    return processor
+
+local_traces = create_local_trace_processor()
+
+# --- Reading traces ---
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Every record in the trace file and its rotated backups, oldest file first."""
+    backups = sorted(glob.glob(f"{glob.escape(path)}.*"), key=lambda p: int(p.rsplit(".", 1)[1]) if p.rsplit(".", 1)[1].isdigit() else 0, reverse=True)
+    for file in [*backups, path]:
+        if not os.path.exists(file):
+            continue
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by a crash.
+
+def load_groups(path: str) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """group_id -> trace_id -> {"trace": its trace record, "spans": its span records}."""
+    groups: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(lambda: defaultdict(lambda: {"trace": None, "spans": []}))
+    for record in read_records(path):
+        trace = groups[record.get("group_id") or "-"][record["trace_id"]]
+        if record["kind"] == "trace":
+            trace["trace"] = record
+        else:
+            trace["spans"].append(record)
+    return groups
+
+def _bounds(trace: Dict[str, Any]) -> tuple:
+    """The start and end of a trace, from its trace record or else its spans."""
+    spans = [span for span in trace["spans"] if span.get("start") is not None]
+    record = trace["trace"] or {}
+    start = record.get("start", min((span["start"] for span in spans), default=0.0))
+    end = record.get("end", max((span.get("end") or span["start"] for span in spans), default=start))
+    return start, end
+
+def _tree(spans: List[Dict[str, Any]]) -> Iterator[tuple]:
+    """(depth, span) in depth-first order, children by start time. Orphaned spans are roots."""
+    ids = {span["span_id"] for span in spans}
+    children: Dict[Optional[str], List[Dict[str, Any]]] = defaultdict(list)
+    for span in spans:
+        children[span.get("parent_id") if span.get("parent_id") in ids else None].append(span)
+
+    def walk(parent: Optional[str], depth: int) -> Iterator[tuple]:
+        for span in sorted(children[parent], key=lambda s: s.get("start") or 0.0):
+            yield depth, span
+            yield from walk(span["span_id"], depth + 1)
+    yield from walk(None, 0)
+
+def _label(span: Dict[str, Any]) -> str:
+    label = f"{span['type']} {span['name']}"
+    if "input_tokens" in span:
+        label += f" ({span['input_tokens']}+{span['output_tokens']} tok)"
+    if span.get("triggered"):
+        label += " TRIGGERED"
+    if span.get("error"):
+        label += " ERROR"
+    return label
+
+def render_timeline(trace_id: str, trace: Dict[str, Any], width: int = 60, min_ms: float = 0.0) -> List[str]:
+    """A trace as a tree of spans, each with its offset, duration and a bar on the trace's timeline."""
+    start, end = _bounds(trace)
+    total = max(end - start, 1e-6)
+    name = (trace["trace"] or {}).get("name", "?")
+    lines = [f"{name}  {trace_id}  {datetime.fromtimestamp(start):%Y-%m-%d %H:%M:%S}  {total:.2f}s"]
+    for depth, span in _tree(trace["spans"]):
+        span_start = span.get("start") or start
+        duration = (span.get("end") or end) - span_start
+        if duration * 1000 < min_ms:
+            continue
+        offset = min(int((span_start - start) / total * width), width - 1)
+        length = max(1, min(round(duration / total * width), width - offset))
+        bar = " " * offset + "█" * length + " " * (width - offset - length)
+        label = ("  " * depth + _label(span))[:56]
+        lines.append(f"  {label:<56} {span_start - start:8.2f}s {duration:8.2f}s |{bar}|")
+    return lines
+
+def folded_stacks(trace: Dict[str, Any]) -> Dict[str, int]:
+    """Self time in ms of each stack of spans, as "root;child;leaf" -> ms."""
+    spans = {span["span_id"]: span for span in trace["spans"]}
+    stacks: Dict[str, int] = defaultdict(int)
+    children_ms: Dict[str, float] = defaultdict(float)
+    for span in spans.values():
+        if span.get("parent_id") in spans and span.get("start") is not None and span.get("end") is not None:
+            children_ms[span["parent_id"]] += span["end"] - span["start"]
+    for span in spans.values():
+        if span.get("start") is None or span.get("end") is None:
+            continue
+        path, parent = [], span
+        while parent is not None:
+            path.append(f"{parent['type']} {parent['name']}".replace(";", ","))
+            parent = spans.get(parent.get("parent_id"))
+        # Concurrent children can overlap their parent's whole duration; self time is then 0.
+        self_ms = max((span["end"] - span["start"] - children_ms[span["span_id"]]) * 1000, 0.0)
+        if self_ms >= 1:
+            stacks[";".join(reversed(path))] += int(self_ms)
+    return stacks
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Profile Shinan's locally written traces.")
+    parser.add_argument("--file", default=TRACE_FILE or "traces/shinan.jsonl", help="Trace file (default SHINAN_TRACE_FILE).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List trace groups, most recent first.")
+    show = commands.add_parser("show", help="Show the timelines of a group's traces.")
+    show.add_argument("group_id")
+    show.add_argument("--width", type=int, default=60)
+    show.add_argument("--min-ms", type=float, default=0.0, help="Hide spans shorter than this.")
+    folded = commands.add_parser("folded", help="Print a group's folded stacks for flamegraph.pl or speedscope.")
+    folded.add_argument("group_id")
+    args = parser.parse_args()
+
+    groups = load_groups(args.file)
+    if args.command == "list":
+        rows = []
+        for group_id, traces in groups.items():
+            bounds = [_bounds(trace) for trace in traces.values()]
+            start, end = min(b[0] for b in bounds), max(b[1] for b in bounds)
+            names = sorted({(trace["trace"] or {}).get("name", "?") for trace in traces.values()})
+            spans = sum(len(trace["spans"]) for trace in traces.values())
+            rows.append((start, f"{group_id:<36} {datetime.fromtimestamp(start):%Y-%m-%d %H:%M:%S} {end - start:8.2f}s {spans:5d} spans  {', '.join(names)}"))
+        for _, row in sorted(rows, reverse=True):
+            print(row)
+        return 0
+
+    traces = groups.get(args.group_id)
+    if not traces:
+        print(f"No traces for group {args.group_id} in {args.file}.", file=sys.stderr)
+        return 1
+    ordered = sorted(traces.items(), key=lambda item: _bounds(item[1])[0])
+    if args.command == "show":
+        for trace_id, trace in ordered:
+            print("\n".join(render_timeline(trace_id, trace, args.width, args.min_ms)) + "\n")
+    else:
+        stacks: Dict[str, int] = defaultdict(int)
+        for _, trace in ordered:
+            for stack, ms in folded_stacks(trace).items():
+                stacks[stack] += ms
+        for stack, ms in stacks.items():
+            print(f"{stack} {ms}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
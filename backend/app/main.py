@@ -1,12 +1,49 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers.root import router as root_router
+from tools.blog_feed import blog_feed
+from sessions import SESSION_HEADER, session_store
+from upload_cache import upload_cache
+from guardrails import verdict_cache
+from mcp_pool import mcp_pool
+from deep_research import deep_research, job_store
+from materials import shutdown_pool
+from ocr import ocr_engine
+from streaming import STREAM_HEADER, event_logs
+from context_window import context_manager
+from readiness import readiness
+from local_tracing import local_traces
 from pydantic import BaseModel
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the SoftBank blog feed in the background; startup never waits on sbnews.
+    blog_feed.warm()
+    # Open warm connections to the MCP vector store, which supervisord may still be starting.
+    await mcp_pool.start()
+    # Prebuild agents and wait for the pooled connections before /health/ready reports ready.
+    readiness.start()
+    yield
+    await readiness.close()
+    await event_logs.close()
+    await context_manager.close()
+    await deep_research.close()
+    await mcp_pool.close()
+    await job_store.close()
+    shutdown_pool()
+    ocr_engine.shutdown()
+    await session_store.close()
+    await upload_cache.close()
+    await verdict_cache.close()
+    if local_traces is not None:
+        local_traces.shutdown()
+
 app = FastAPI(
     title="Shinan",
     description="Shinan is a platform for AI agents to conduct relevant research.",
     version="2.0.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -16,6 +53,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=[SESSION_HEADER, STREAM_HEADER],  # Lets the frontend read the session and stream IDs
 )
 
 app.include_router(root_router)
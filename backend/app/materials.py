@@ -0,0 +1,219 @@
+# Shinan Material Processing
+#
+# Turns uploaded PDFs into Responses API content parts (page text plus a rendered image of each
+# page). PyMuPDF text extraction and rasterization are CPU-bound, so they run in a process pool,
+# one page per task, rather than in the request coroutine. Pages are yielded in order as soon as
+# they are rendered, so callers can start work before the whole document is done.
+#
+# SHINAN_PDF_MAX_PAGES caps how many pages of a document are processed, SHINAN_PDF_DPI sets the
+# render resolution, and SHINAN_PDF_WORKERS sizes the process pool. Rendered pages go through the
+# image preparation in images.py, which may downscale and re-encode them, and pages without a
+# text layer are OCR'd (ocr.py).
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from ocr import OCRJob, ocr_engine, ocr_regions
+from images import IMAGE_MAX_EDGE, IMAGE_TOKEN_BUDGET, PreparedImage, fit_size, prepare_image, report_savings
+
+if TYPE_CHECKING:
+    import fitz
+
+logger = logging.getLogger(__name__)
+
+PDF_MAX_PAGES = int(os.environ.get("SHINAN_PDF_MAX_PAGES", "10"))
+PDF_DPI = int(os.environ.get("SHINAN_PDF_DPI", "108"))  # 1.5x PDF's 72 points per inch.
+PDF_MAX_DPI = 300
+PDF_WORKERS = int(os.environ.get("SHINAN_PDF_WORKERS", str(min(os.cpu_count() or 1, 4))))
+
+@dataclass
+class RenderedPage:
+    """A PDF page's extracted text and rendered image, and the regions to OCR (see ocr.py)."""
+    number: int  # 1-based
+    text: str
+    image: PreparedImage
+    ocr_images: List[bytes] = field(default_factory=list)
+    ocr_text: str = ""
+
+    def content_parts(self) -> List[Dict[str, Any]]:
+        """The Responses API content parts for this page."""
+        parts: List[Dict[str, Any]] = []
+        if self.text.strip():
+            parts.append({
+                "type": "input_text",
+                "text": f"**Slide {self.number} Text:**\n{self.text.strip()}\n"
+            })
+        if self.ocr_text.strip():
+            parts.append({
+                "type": "input_text",
+                "text": f"**Slide {self.number} Text (OCR):**\n{self.ocr_text.strip()}\n"
+            })
+        parts.append({
+            "type": "input_image",
+            "image_url": self.image.data_url()
+        })
+        parts.append({
+            "type": "input_text",
+            "text": f"↑ Slide {self.number} Visual\n---\n"
+        })
+        return parts
+
+# --- Worker side ---
+# Each worker keeps the document it last opened, so the pages of one upload (usually handled by
+# the same few workers) do not reopen and reparse the file for every page. PyMuPDF is imported
+# where it is used, so the server does not load it until the first upload.
+_open_document: Optional[Tuple[str, "fitz.Document"]] = None
+
+def _document(path: str) -> "fitz.Document":
+    global _open_document
+    import fitz
+    if _open_document is not None and _open_document[0] == path:
+        return _open_document[1]
+    if _open_document is not None:
+        _open_document[1].close()
+    _open_document = (path, fitz.open(path))
+    return _open_document[1]
+
+def _render_page(path: str, index: int, dpi: int, max_edge: int, max_tokens: int) -> RenderedPage:
+    """Extract the text of a page, render it and prepare the image (see images.py). Runs in a worker process."""
+    import fitz
+    page = _document(path)[index]
+    text = page.get_text()  # type: ignore
+    # Render straight at the size the image budget allows, rather than rendering large and resampling.
+    width, height = page.rect.width * dpi / 72, page.rect.height * dpi / 72
+    fitted_width, _ = fit_size(math.ceil(width), math.ceil(height), max_edge, max_tokens)
+    zoom = min(1.0, fitted_width / width) * dpi / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))  # type: ignore
+    image = prepare_image(
+        pix.tobytes("png"), max_edge=max_edge, max_tokens=max_tokens, original_size=(round(width), round(height))
+    )
+    return RenderedPage(number=index + 1, text=text, image=image, ocr_images=ocr_regions(page, text))
+
+def _count_pages(path: str) -> int:
+    import fitz
+    with fitz.open(path) as document:
+        return len(document)
+
+# --- Pool ---
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_pool() -> ProcessPoolExecutor:
+    """The shared rendering pool, created on first use. Workers are spawned, not forked, since the server runs threads."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def _with_ocr(rendering: "asyncio.Future[RenderedPage]", job: OCRJob) -> RenderedPage:
+    page = await rendering
+    if page.ocr_images:
+        page.ocr_text = await job.recognize_all(page.ocr_images)
+        page.ocr_images = []
+    return page
+
+class PDFDocument:
+    """
+    An uploaded PDF staged in a temporary file for the rendering workers. Use as an async context
+    manager so the file is always removed.
+    """
+
+    def __init__(self, data: bytes, name: str | None = None) -> None:
+        self.data = data
+        self.name = name
+        self.path = ""
+        self.page_count = 0
+
+    async def __aenter__(self) -> "PDFDocument":
+        with tempfile.NamedTemporaryFile(prefix="shinan-", suffix=".pdf", delete=False) as file:
+            self.path = file.name
+        try:
+            await asyncio.to_thread(self._stage)
+        except Exception:
+            self._remove()
+            raise
+        return self
+
+    def _stage(self) -> None:
+        with open(self.path, "wb") as file:
+            file.write(self.data)
+        self.page_count = _count_pages(self.path)
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self._remove()
+
+    def _remove(self) -> None:
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    async def render(
+        self,
+        max_pages: int = PDF_MAX_PAGES,
+        dpi: int = PDF_DPI,
+        max_edge: int = IMAGE_MAX_EDGE,
+        token_budget: int = IMAGE_TOKEN_BUDGET,
+    ) -> AsyncIterator[RenderedPage]:
+        """
+        Render up to `max_pages` pages in the pool, yielding them in page order as they finish.
+        The image token budget is split evenly between the pages. Pages or regions without a text
+        layer are OCR'd as soon as they are rendered.
+        """
+        dpi = max(1, min(dpi, PDF_MAX_DPI))
+        pages = min(self.page_count, max_pages)
+        max_tokens = token_budget // max(pages, 1)
+        pool = get_pool()
+        loop = asyncio.get_running_loop()
+        job = ocr_engine.job(self.name)
+        futures = [
+            asyncio.ensure_future(_with_ocr(
+                loop.run_in_executor(pool, _render_page, self.path, index, dpi, max_edge, max_tokens), job
+            ))
+            for index in range(pages)
+        ]
+        try:
+            for future in futures:
+                yield await future
+            job.finish()
+        finally:
+            for future in futures:
+                future.cancel()
+            # Pages still queued are dropped; retrieve any errors so they are not reported as unhandled.
+            await asyncio.gather(*futures, return_exceptions=True)
+
+async def stream_pdf_parts(
+    data: bytes,
+    filename: str | None,
+    max_pages: int = PDF_MAX_PAGES,
+    dpi: int = PDF_DPI,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield a PDF's content parts (an introduction, then each page's text and image) as pages finish rendering."""
+    async with PDFDocument(data, filename) as document:
+        pages = min(document.page_count, max_pages)
+        described = f"{document.page_count} pages"
+        if pages < document.page_count:
+            described = f"first {pages} of {document.page_count} pages"
+            logger.info(f"{filename} has {document.page_count} pages; processing the first {pages}.")
+        yield {
+            "type": "input_text",
+            "text": f"I'm providing a slide deck. {filename} ({described})\n\n"
+        }
+        images: List[PreparedImage] = []
+        async for page in document.render(max_pages=max_pages, dpi=dpi):
+            images.append(page.image)
+            for part in page.content_parts():
+                yield part
+        report_savings(filename, images)
@@ -0,0 +1,257 @@
+# Shinan MCP Connection Pool
+#
+# Long-lived SSE connections to the Shinan MCP vector-store server (shinan_mcp.py), opened once
+# for the application lifespan instead of once per search or report. Each connection is owned
+# by its own task, which is what the MCP SSE client's task groups require, and is reconnected
+# with backoff whenever a health check or tool call finds it broken (for example after
+# supervisord restarts the MCP server).
+
+import asyncio
+import itertools
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from agents.mcp import MCPServer, MCPServerSse
+from mcp import Tool as MCPTool
+from mcp.shared.exceptions import McpError
+from mcp.types import CallToolResult
+
+logger = logging.getLogger(__name__)
+
+MCP_SERVER_NAME = "Shinan MCP Vector Store"
+MCP_SERVER_URL = os.environ.get("SHINAN_MCP_URL", "http://localhost:8080/sse")
+MCP_POOL_SIZE = int(os.environ.get("SHINAN_MCP_POOL_SIZE", "2"))
+MCP_HEALTH_INTERVAL = float(os.environ.get("SHINAN_MCP_HEALTH_INTERVAL", "15"))
+MCP_ACQUIRE_TIMEOUT = float(os.environ.get("SHINAN_MCP_ACQUIRE_TIMEOUT", "10"))
+MCP_SESSION_TIMEOUT = float(os.environ.get("SHINAN_MCP_SESSION_TIMEOUT", "30"))
+MCP_MAX_BACKOFF = 30.0
+MCP_REQUEST_TIMEOUT_CODE = 408  # The error code the MCP client session uses for read timeouts.
+
+def _is_connection_failure(error: Exception) -> bool:
+    """Whether an error means the connection is unusable, rather than the tool call itself failing."""
+    if isinstance(error, McpError):
+        return error.error.code == MCP_REQUEST_TIMEOUT_CODE
+    return True
+
+class MCPConnection:
+    """A single pooled connection, kept open by its owner task until it is marked broken."""
+
+    def __init__(self, index: int, name: str, url: str, session_timeout: float) -> None:
+        self.index = index
+        self.name = name
+        self.url = url
+        self.session_timeout = session_timeout
+        self.server: Optional[MCPServerSse] = None
+        self.ready = asyncio.Event()
+        self.reconnects = 0
+        self._broken = asyncio.Event()
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name=f"mcp-connection-{self.index}")
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            server = MCPServerSse(
+                name=self.name,
+                params={"url": self.url},
+                cache_tools_list=True,
+                client_session_timeout_seconds=self.session_timeout,
+            )
+            try:
+                await server.connect()
+            except Exception as e:
+                logger.warning(f"MCP connection {self.index} failed, retrying in {backoff:.0f}s: {e!r}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MCP_MAX_BACKOFF)
+                continue
+
+            logger.info(f"MCP connection {self.index} established to {self.url}.")
+            backoff = 1.0
+            self.server = server
+            self.ready.set()
+            try:
+                await self._broken.wait()
+            finally:
+                self.ready.clear()
+                self.server = None
+                self._broken.clear()
+                await server.cleanup()
+            self.reconnects += 1
+            logger.info(f"MCP connection {self.index} reconnecting.")
+
+    def mark_broken(self) -> None:
+        """Ask the owner task to tear down and reopen this connection."""
+        if self.ready.is_set():
+            self._broken.set()
+
+    async def ping(self, timeout: float) -> bool:
+        """Check the connection is alive, marking it broken if not."""
+        server = self.server
+        if server is None or server.session is None:
+            return False
+        try:
+            await asyncio.wait_for(server.session.send_ping(), timeout=timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"MCP connection {self.index} failed its health check: {e!r}")
+            self.mark_broken()
+            return False
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+class MCPConnectionPool:
+    """A pool of warm connections to one MCP server, with a shared tool-list cache."""
+
+    def __init__(
+        self,
+        name: str = MCP_SERVER_NAME,
+        url: str = MCP_SERVER_URL,
+        size: int = MCP_POOL_SIZE,
+        health_interval: float = MCP_HEALTH_INTERVAL,
+        acquire_timeout: float = MCP_ACQUIRE_TIMEOUT,
+        session_timeout: float = MCP_SESSION_TIMEOUT,
+    ) -> None:
+        self.name = name
+        self.url = url
+        self.size = max(size, 1)
+        self.health_interval = health_interval
+        self.acquire_timeout = acquire_timeout
+        self.session_timeout = session_timeout
+        self.connections: List[MCPConnection] = []
+        self._round_robin = itertools.count()
+        self._tools: Optional[List[MCPTool]] = None
+        self._health_task: Optional[asyncio.Task[None]] = None
+
+    # --- Lifecycle ---
+    async def start(self) -> None:
+        """Open the connections in the background. Does not wait for the MCP server to be up."""
+        if self.connections:
+            return
+        self.connections = [
+            MCPConnection(i, self.name, self.url, self.session_timeout) for i in range(self.size)
+        ]
+        for connection in self.connections:
+            connection.start()
+        self._health_task = asyncio.create_task(self._check_health(), name="mcp-pool-health")
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        await asyncio.gather(*(connection.close() for connection in self.connections))
+        self.connections = []
+        self._tools = None
+
+    async def _check_health(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(c.ping(self.session_timeout) for c in self.connections if c.ready.is_set()))
+
+    # --- Connections ---
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for a connection to be ready. Whether one is."""
+        if any(c.ready.is_set() for c in self.connections):
+            return True
+        if not self.connections:
+            return False
+        waiters = [asyncio.create_task(c.ready.wait()) for c in self.connections]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        return any(c.ready.is_set() for c in self.connections)
+
+    async def acquire(self) -> MCPConnection:
+        """Get a ready connection, round-robin, waiting up to `acquire_timeout` for one."""
+        if not self.connections:
+            raise ConnectionError("MCP connection pool has not been started.")
+        if not await self.wait_ready(self.acquire_timeout):
+            raise ConnectionError(f"No MCP connection to {self.url} within {self.acquire_timeout}s.")
+        ready = [c for c in self.connections if c.ready.is_set()]
+        return ready[next(self._round_robin) % len(ready)]
+
+    async def probe(self, timeout: float) -> bool:
+        """Whether the server answers a ping on one of the ready connections."""
+        ready = [c for c in self.connections if c.ready.is_set()]
+        return bool(ready) and await ready[next(self._round_robin) % len(ready)].ping(timeout)
+
+    async def list_tools(self) -> List[MCPTool]:
+        """The server's tools, fetched once and shared by every connection."""
+        if self._tools is None:
+            connection = await self.acquire()
+            try:
+                self._tools = await connection.server.list_tools()  # type: ignore[union-attr]
+            except Exception as e:
+                if _is_connection_failure(e):
+                    connection.mark_broken()
+                raise
+        return self._tools
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any] | None) -> CallToolResult:
+        """Call a tool, retrying once on a fresh connection if the connection itself fails."""
+        for attempt in range(2):
+            connection = await self.acquire()
+            server = connection.server
+            try:
+                if server is None:
+                    raise ConnectionError(f"MCP connection {connection.index} closed.")
+                return await server.call_tool(tool_name, arguments)
+            except Exception as e:
+                if not _is_connection_failure(e):
+                    raise
+                connection.mark_broken()
+                self._tools = None
+                if attempt:
+                    raise
+                logger.warning(f"MCP call {tool_name} failed on connection {connection.index}, retrying: {e!r}")
+        raise AssertionError("unreachable")
+
+    def server(self) -> "PooledMCPServer":
+        """An MCPServer for `Agent(mcp_servers=[...])` backed by this pool."""
+        return PooledMCPServer(self)
+
+    def status(self) -> Dict[str, Any]:
+        """A summary of the pool's connections."""
+        return {
+            "url": self.url,
+            "size": self.size,
+            "ready": sum(c.ready.is_set() for c in self.connections),
+            "reconnects": sum(c.reconnects for c in self.connections),
+            "tools_cached": self._tools is not None,
+        }
+
+class PooledMCPServer(MCPServer):
+    """
+    An MCPServer whose connections belong to an MCPConnectionPool. connect() and cleanup() are
+    no-ops because the pool's lifecycle is tied to the application, not to an agent run.
+    """
+
+    def __init__(self, pool: MCPConnectionPool) -> None:
+        self.pool = pool
+
+    @property
+    def name(self) -> str:
+        return self.pool.name
+
+    async def connect(self) -> None:
+        pass
+
+    async def cleanup(self) -> None:
+        pass
+
+    async def list_tools(self) -> list[MCPTool]:
+        return await self.pool.list_tools()
+
+    async def call_tool(self, tool_name: str, arguments: dict[str, Any] | None) -> CallToolResult:
+        return await self.pool.call_tool(tool_name, arguments)
+
+mcp_pool = MCPConnectionPool()
@@ -0,0 +1,307 @@
+# Shinan Metrics
+#
+# Local visibility into the agent pipeline, served at /metrics in the Prometheus text format. The
+# format is simple enough to write here, so nothing outside the process is needed: any Prometheus
+# (or a curl) can read it.
+# - Stage latency (time_stage) for idea generation, each search, ranking, report writing and the
+#   material steps, with errors counted by stage and exception type.
+# - Time from the start of a stream to its first event (streaming.EventLog).
+# - Tool calls by type (web_search_call, MCP function_call, ...) and token usage per agent and
+#   model, from the Agents SDK's spans (MetricsProcessor), so every run is covered wherever it
+#   happens. Spans are only produced while tracing is enabled.
+# - The depth of the search event queue in _overall_search.
+# - Estimated cost, tokens by stage and over-budget actions, recorded by usage.py.
+# The snapshot() stats of the caches, scheduler and pools are exported alongside: cumulative ones
+# as counters, the rest (sizes, ready flags, settings) as gauges (see routers/metrics.py).
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Collection, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from agents.tracing import Span, Trace, TracingProcessor, add_trace_processor
+from agents.tracing.span_data import AgentSpanData, FunctionSpanData, ResponseSpanData
+
+logger = logging.getLogger(__name__)
+
+# Seconds. Agent stages run from under a second (ranking) to minutes (reports).
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+T = TypeVar("T")
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    """A metric family with a fixed set of label names."""
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(Metric):
+    """A value that only goes up."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values]
+
+class Gauge(Metric):
+    """A value that goes up and down."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values]
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}  # Bucket counts, [sum, count].
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, totals = self._series.setdefault(key, ([0] * len(self.buckets), [0.0, 0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def samples(self) -> List[str]:
+        lines: List[str] = []
+        with self._lock:
+            series = [(key, list(counts), list(totals)) for key, (counts, totals) in self._series.items()]
+        for key, counts, (total, count) in series:
+            for bound, bucket_count in zip((*self.buckets, math.inf), (*counts, int(count))):
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {bucket_count}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {int(count)}")
+        return lines
+
+class MetricsRegistry:
+    """The process's metrics, rendered together in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(
+        self,
+        components: Optional[Dict[str, Callable[[], Dict[str, Any]]]] = None,
+        counters: Optional[Dict[str, Collection[str]]] = None,
+    ) -> str:
+        """
+        Every metric, followed by the numeric stats of each component's snapshot: those listed in
+        `counters` for the component as shinan_<component>_<stat>_total counters, the others as
+        shinan_<component>_<stat> gauges. Nested stats are joined with underscores.
+        """
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            samples = metric.samples()
+            if samples:
+                lines += metric.header() + samples
+        for component, snapshot in (components or {}).items():
+            try:
+                stats = snapshot()
+            except Exception as e:
+                logger.warning(f"Could not collect {component} stats: {e!r}")
+                continue
+            cumulative = (counters or {}).get(component, ())
+            for stat, value in _flatten(stats):
+                if stat in cumulative:
+                    name = f"shinan_{component}_{stat}_total"
+                    lines += [f"# TYPE {name} counter", f"{name} {_number(value)}"]
+                else:
+                    name = f"shinan_{component}_{stat}"
+                    lines += [f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+        return "\n".join(lines) + "\n"
+
+def _flatten(stats: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in stats.items():
+        name = "".join(c if c.isalnum() else "_" for c in f"{prefix}{key}").lower()
+        if isinstance(value, bool):
+            yield name, float(value)
+        elif isinstance(value, (int, float)):
+            yield name, float(value)
+        elif isinstance(value, dict):
+            yield from _flatten(value, f"{name}_")
+
+registry = MetricsRegistry()
+
+# --- Pipeline metrics ---
+STAGE_SECONDS = registry.histogram(
+    "shinan_stage_seconds", "Duration of completed workflow stages.", ["workflow", "stage"]
+)
+FIRST_EVENT_SECONDS = registry.histogram(
+    "shinan_time_to_first_event_seconds", "Time from the start of a stream to its first event.", ["workflow"]
+)
+STREAM_SECONDS = registry.histogram(
+    "shinan_stream_seconds", "Duration of whole streamed workflows.", ["workflow", "outcome"]
+)
+ERRORS = registry.counter(
+    "shinan_errors_total", "Errors by workflow, stage and exception type.", ["workflow", "stage", "error"]
+)
+TOOL_CALLS = registry.counter(
+    "shinan_tool_calls_total", "Tool calls made by agents, by call type and tool.", ["agent", "type", "tool"]
+)
+TOKENS = registry.counter(
+    "shinan_tokens_total", "Tokens used by agents, by model and kind (input, output, cached, reasoning).", ["agent", "model", "kind"]
+)
+MODEL_REQUESTS = registry.counter(
+    "shinan_model_requests_total", "Model responses received, by agent and model.", ["agent", "model"]
+)
+COST_USD = registry.counter(
+    "shinan_cost_usd_total", "Estimated cost of model usage in USD, by agent, model and stage.", ["agent", "model", "stage"]
+)
+STAGE_TOKENS = registry.counter(
+    "shinan_stage_tokens_total", "Tokens used by workflow stage and kind (input, output).", ["stage", "kind"]
+)
+BUDGET_ACTIONS = registry.counter(
+    "shinan_budget_actions_total", "Agent runs refused or downgraded because a session was over budget.", ["action"]
+)
+SEARCH_QUEUE_DEPTH = registry.histogram(
+    "shinan_search_queue_depth", "Events waiting in a query's search queue when one is taken.", ["workflow"], DEPTH_BUCKETS
+)
+
+@contextmanager
+def time_stage(workflow: str, stage: str) -> Iterator[None]:
+    """Time a stage into shinan_stage_seconds, counting it in shinan_errors_total if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        ERRORS.inc(workflow=workflow, stage=stage, error=type(e).__name__)
+        raise
+    STAGE_SECONDS.observe(time.perf_counter() - started, workflow=workflow, stage=stage)
+
+async def timed(events: AsyncIterator[T], workflow: str, stage: str) -> AsyncIterator[T]:
+    """Pass a stage's events through, timing the stage until its last event (see time_stage)."""
+    with time_stage(workflow, stage):
+        async for event in events:
+            yield event
+
+# --- Agents SDK spans ---
+class MetricsProcessor(TracingProcessor):
+    """Counts tool calls and token usage from the spans of every agent run."""
+
+    def __init__(self) -> None:
+        self._agents: Dict[str, str] = {}  # Open agent span ID -> agent name.
+
+    def on_trace_start(self, trace: Trace) -> None:
+        pass
+
+    def on_trace_end(self, trace: Trace) -> None:
+        pass
+
+    def on_span_start(self, span: Span[Any]) -> None:
+        if isinstance(span.span_data, AgentSpanData):
+            self._agents[span.span_id] = span.span_data.name
+
+    def on_span_end(self, span: Span[Any]) -> None:
+        data = span.span_data
+        if isinstance(data, AgentSpanData):
+            self._agents.pop(span.span_id, None)
+        elif isinstance(data, FunctionSpanData):
+            # Function tools, including the MCP vector store's tools.
+            agent = self._agents.get(span.parent_id or "", "unknown")
+            TOOL_CALLS.inc(agent=agent, type="function_call", tool=data.name)
+        elif isinstance(data, ResponseSpanData) and data.response is not None:
+            self._record_response(self._agents.get(span.parent_id or "", "unknown"), data.response)
+
+    def _record_response(self, agent: str, response: Any) -> None:
+        model = response.model or "unknown"
+        MODEL_REQUESTS.inc(agent=agent, model=model)
+        # Hosted tools (web search, file search, hosted MCP) only appear in the response output.
+        for item in response.output or []:
+            if item.type in ("web_search_call", "file_search_call", "mcp_call", "code_interpreter_call"):
+                TOOL_CALLS.inc(agent=agent, type=item.type, tool=getattr(item, "name", None) or item.type)
+        usage = response.usage
+        if usage is None:
+            return
+        TOKENS.inc(usage.input_tokens, agent=agent, model=model, kind="input")
+        TOKENS.inc(usage.output_tokens, agent=agent, model=model, kind="output")
+        cached = getattr(usage.input_tokens_details, "cached_tokens", 0) or 0
+        reasoning = getattr(usage.output_tokens_details, "reasoning_tokens", 0) or 0
+        if cached:
+            TOKENS.inc(cached, agent=agent, model=model, kind="cached")
+        if reasoning:
+            TOKENS.inc(reasoning, agent=agent, model=model, kind="reasoning")
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self) -> None:
+        pass
+
+metrics_processor = MetricsProcessor()
+add_trace_processor(metrics_processor)
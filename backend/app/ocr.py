@@ -0,0 +1,196 @@
+# Shinan OCR
+#
+# Tesseract OCR for uploads, run in a bounded thread pool so it never blocks the event loop
+# (pytesseract runs the tesseract binary as a subprocess, so threads are enough). OCR is
+# selective: PDF pages are only OCR'd where their native text layer is empty or sparse, either
+# the whole page (scans) or individual image regions (e.g. a pasted screenshot of a table).
+#
+# SHINAN_OCR_LANGUAGES sets the Tesseract language packs (default jpn+eng), SHINAN_OCR_WORKERS
+# caps concurrent OCR processes, and each upload's OCR is limited to SHINAN_OCR_JOB_CONCURRENCY
+# images at once and SHINAN_OCR_JOB_TIMEOUT seconds in total. SHINAN_OCR_ENABLED=false disables it.
+
+import asyncio
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    import fitz
+
+logger = logging.getLogger(__name__)
+
+OCR_ENABLED = os.environ.get("SHINAN_OCR_ENABLED", "true").lower() not in ("0", "false", "no")
+OCR_LANGUAGES = os.environ.get("SHINAN_OCR_LANGUAGES", "jpn+eng")
+OCR_WORKERS = int(os.environ.get("SHINAN_OCR_WORKERS", str(min(os.cpu_count() or 1, 4))))
+OCR_JOB_CONCURRENCY = int(os.environ.get("SHINAN_OCR_JOB_CONCURRENCY", "2"))
+OCR_PAGE_TIMEOUT = float(os.environ.get("SHINAN_OCR_PAGE_TIMEOUT", "20"))
+OCR_JOB_TIMEOUT = float(os.environ.get("SHINAN_OCR_JOB_TIMEOUT", "60"))
+OCR_DPI = int(os.environ.get("SHINAN_OCR_DPI", "200"))
+
+# A page or region with fewer native text characters than this is OCR'd.
+OCR_MIN_TEXT_CHARS = int(os.environ.get("SHINAN_OCR_MIN_TEXT_CHARS", "20"))
+# Image regions smaller than this fraction of the page are not worth OCR'ing.
+OCR_MIN_REGION_AREA = 0.05
+OCR_MAX_REGIONS = 4
+
+# Tesseract parallelizes each process with OpenMP, which only oversubscribes the CPUs when
+# several processes already run side by side.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# --- Region selection (runs in the PDF rendering workers, see materials.py) ---
+def ocr_regions(page: "fitz.Page", text: str) -> List[bytes]:
+    """Grayscale PNG renders of the parts of a page that need OCR: the whole page if its text layer is sparse, otherwise large image regions without text."""
+    import fitz
+    if not OCR_ENABLED:
+        return []
+    if len(text.strip()) < OCR_MIN_TEXT_CHARS:
+        return [page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY).tobytes("png")]  # type: ignore
+
+    page_area = page.rect.width * page.rect.height
+    regions: List[bytes] = []
+    for info in page.get_image_info():  # type: ignore
+        rect = fitz.Rect(info["bbox"]) & page.rect
+        if rect.is_empty or rect.width * rect.height < OCR_MIN_REGION_AREA * page_area:
+            continue
+        if len(page.get_textbox(rect).strip()) >= OCR_MIN_TEXT_CHARS:  # type: ignore
+            continue
+        regions.append(page.get_pixmap(dpi=OCR_DPI, clip=rect, colorspace=fitz.csGRAY).tobytes("png"))  # type: ignore
+        if len(regions) == OCR_MAX_REGIONS:
+            break
+    return regions
+
+# --- Engine ---
+class OCRStats(BaseModel):
+    """Counters for the OCR engine."""
+    pages: int = 0  # Whole pages or page regions.
+    failures: int = 0
+    timeouts: int = 0
+    skipped: int = 0
+    characters: int = 0
+    seconds: float = 0.0  # Summed Tesseract time across workers.
+
+    @property
+    def pages_per_second(self) -> float:
+        """Throughput of one worker."""
+        return self.pages / self.seconds if self.seconds else 0.0
+
+class OCREngine:
+    """Runs Tesseract on a bounded thread pool."""
+
+    def __init__(self, languages: str = OCR_LANGUAGES, workers: int = OCR_WORKERS) -> None:
+        self.languages = languages
+        self.workers = max(workers, 1)
+        self.stats = OCRStats()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._available: Optional[bool] = None
+
+    async def is_available(self) -> bool:
+        """Whether OCR is enabled and the tesseract binary can be run. Checked once."""
+        if self._available is None:
+            self._available = OCR_ENABLED and await asyncio.to_thread(self._check_tesseract)
+        return self._available
+
+    def _check_tesseract(self) -> bool:
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            return True
+        except Exception as e:
+            logger.warning(f"OCR is unavailable: {e!r}")
+            return False
+
+    def _recognize(self, image: bytes, timeout: float) -> str:
+        import pytesseract
+        from PIL import Image
+        with Image.open(io.BytesIO(image)) as img:
+            return pytesseract.image_to_string(img, lang=self.languages, timeout=timeout)
+
+    async def recognize(self, image: bytes, timeout: float = OCR_PAGE_TIMEOUT) -> str:
+        """OCR one encoded image. Failures and timeouts are logged and return an empty string."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            text = await loop.run_in_executor(self._executor, self._recognize, image, timeout)
+        except RuntimeError as e:
+            # pytesseract signals its timeout as RuntimeError("Tesseract process timeout").
+            if "timeout" in str(e).lower():
+                self.stats.timeouts += 1
+                logger.warning(f"OCR timed out after {timeout:.0f}s.")
+            else:
+                self.stats.failures += 1
+                logger.warning(f"OCR failed: {e!r}")
+            return ""
+        except Exception as e:
+            self.stats.failures += 1
+            logger.warning(f"OCR failed: {e!r}")
+            return ""
+        finally:
+            self.stats.seconds += time.perf_counter() - started
+        self.stats.pages += 1
+        self.stats.characters += len(text)
+        return text
+
+    def job(self, name: str | None, concurrency: int = OCR_JOB_CONCURRENCY, timeout: float = OCR_JOB_TIMEOUT) -> "OCRJob":
+        """Start the OCR of one upload."""
+        return OCRJob(self, name, concurrency, timeout)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging."""
+        return {
+            **self.stats.model_dump(),
+            "pages_per_second": round(self.stats.pages_per_second, 3),
+            "languages": self.languages,
+            "workers": self.workers,
+        }
+
+class OCRJob:
+    """
+    The OCR of one upload: at most `concurrency` images at once, so one long scan cannot take
+    every worker, and at most `timeout` seconds in total, after which remaining images are skipped.
+    """
+
+    def __init__(self, engine: OCREngine, name: str | None, concurrency: int, timeout: float) -> None:
+        self.engine = engine
+        self.name = name
+        self.deadline = time.monotonic() + timeout
+        self.pages = 0
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self._started = time.perf_counter()
+
+    async def recognize(self, image: bytes) -> str:
+        if not await self.engine.is_available():
+            return ""
+        async with self._semaphore:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 1:
+                self.engine.stats.skipped += 1
+                logger.warning(f"OCR budget of {self.name} exhausted; skipping an image.")
+                return ""
+            text = await self.engine.recognize(image, timeout=min(OCR_PAGE_TIMEOUT, remaining))
+            self.pages += 1
+            return text
+
+    async def recognize_all(self, images: List[bytes]) -> str:
+        """OCR several images of one page, joined in order."""
+        texts = await asyncio.gather(*(self.recognize(image) for image in images))
+        return "\n\n".join(text.strip() for text in texts if text.strip())
+
+    def finish(self) -> None:
+        """Log the job's throughput."""
+        if self.pages:
+            elapsed = time.perf_counter() - self._started
+            logger.info(f"OCR'd {self.pages} pages or regions of {self.name} in {elapsed:.2f}s ({self.pages / elapsed:.2f} pages/s).")
+
+ocr_engine = OCREngine()
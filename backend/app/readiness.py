@@ -0,0 +1,188 @@
+# Shinan Readiness
+#
+# An instance should only take traffic once it can serve it. At startup a warmup phase prebuilds
+# the agents and their prompts (tools/registry.py), loads the token encoder, checks for Tesseract
+# and waits up to SHINAN_WARMUP_TIMEOUT seconds for the pooled MCP connections to open. After
+# that, /health/ready reports ready only while the dependency probes pass:
+# - mcp: a ping over a pooled connection to the MCP vector store (shinan_mcp.py).
+# - openai: a model listing through the OpenAI client (OPENAI_BASE_URL can point it at a stub).
+#   It is repeated at most every SHINAN_READY_OPENAI_INTERVAL seconds, as every instance's
+#   load balancer checks would otherwise add up.
+# - sessions: a session store read, which must answer within SHINAN_READY_SESSION_MAX_MS.
+# Probe results are reused for SHINAN_READY_CACHE_SECONDS. SHINAN_READY_REQUIRED lists the probes
+# that must pass (default all); the others are only reported. /health/live does not probe anything.
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+from context_window import count_text_tokens
+from mcp_pool import mcp_pool
+from ocr import ocr_engine
+from sessions import session_store
+from tools.registry import agent_registry
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TIMEOUT = float(os.environ.get("SHINAN_WARMUP_TIMEOUT", "30"))
+READY_PROBE_TIMEOUT = float(os.environ.get("SHINAN_READY_PROBE_TIMEOUT", "2"))
+READY_CACHE_SECONDS = float(os.environ.get("SHINAN_READY_CACHE_SECONDS", "5"))
+READY_OPENAI_INTERVAL = float(os.environ.get("SHINAN_READY_OPENAI_INTERVAL", "60"))
+READY_SESSION_MAX_MS = float(os.environ.get("SHINAN_READY_SESSION_MAX_MS", "250"))
+READY_REQUIRED = {
+    name.strip() for name in os.environ.get("SHINAN_READY_REQUIRED", "mcp,openai,sessions").split(",") if name.strip()
+}
+
+# The session the session store probe reads. Minted IDs are hex (see sessions.get_session_id), so
+# it is never a real session, and the probe never saves it.
+PROBE_SESSION_ID = "readiness-probe"
+
+class ProbeResult(BaseModel):
+    """The outcome of one dependency probe."""
+    name: str
+    ok: bool
+    required: bool
+    latency_ms: float
+    detail: str = ""
+    checked_at: float = 0.0
+
+class ReadinessReport(BaseModel):
+    """Whether the instance is ready, and why not."""
+    ready: bool
+    warmed_up: bool
+    warmup_seconds: Optional[float] = None
+    warmup_error: Optional[str] = None
+    probes: List[ProbeResult] = []
+
+class Readiness:
+    """Warms the instance up at startup and probes its dependencies for /health/ready."""
+
+    def __init__(self, required: set = READY_REQUIRED) -> None:
+        self.required = required
+        self.warmed_up = False
+        self.warmup_seconds: Optional[float] = None
+        self.warmup_error: Optional[str] = None  # Why warmup failed; the instance then never becomes ready.
+        self._started = time.monotonic()
+        self._warmup: Optional[asyncio.Task[None]] = None
+        self._report: Optional[ReadinessReport] = None
+        self._checked_at = 0.0
+        self._check_lock = asyncio.Lock()
+        self._openai: Optional[ProbeResult] = None
+        self._client: Optional[AsyncOpenAI] = None
+
+    # --- Warmup ---
+    def start(self) -> None:
+        """Start warming up in the background; the instance is live but not ready meanwhile."""
+        self._started = time.monotonic()
+        self._warmup = asyncio.create_task(self._warm_up(), name="warmup")
+
+    async def _warm_up(self) -> None:
+        try:
+            # Imports the agent modules and renders their static prompts.
+            await asyncio.to_thread(agent_registry.warm)
+            # Loads (and may download) the token encoder.
+            await asyncio.to_thread(count_text_tokens, "warmup")
+            await ocr_engine.is_available()
+            if not await mcp_pool.wait_ready(WARMUP_TIMEOUT):
+                logger.warning(f"No MCP connection within the {WARMUP_TIMEOUT:.0f}s warmup; readiness will keep probing.")
+        except Exception as e:
+            self.warmup_error = repr(e)
+            logger.exception("Warmup failed; the instance will not report ready.")
+            return
+        self.warmed_up = True
+        self.warmup_seconds = time.monotonic() - self._started
+        logger.info(f"Warmed up in {self.warmup_seconds:.1f}s.")
+
+    async def close(self) -> None:
+        if self._warmup is not None:
+            self._warmup.cancel()
+            await asyncio.gather(self._warmup, return_exceptions=True)
+            self._warmup = None
+
+    # --- Probes ---
+    async def _probe(self, name: str, check: Callable[[], Awaitable[str]]) -> ProbeResult:
+        """Run a check, which returns a detail or raises. Failing and timing out fail the probe."""
+        started = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(check(), timeout=READY_PROBE_TIMEOUT)
+            ok = True
+        except asyncio.TimeoutError:
+            ok, detail = False, f"timed out after {READY_PROBE_TIMEOUT:.1f}s"
+        except Exception as e:
+            ok, detail = False, repr(e)
+        return ProbeResult(
+            name=name,
+            ok=ok,
+            required=name in self.required,
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            detail=detail,
+            checked_at=time.time(),
+        )
+
+    async def _check_mcp(self) -> str:
+        if not await mcp_pool.probe(READY_PROBE_TIMEOUT):
+            status = mcp_pool.status()
+            raise ConnectionError(f"{status['ready']}/{status['size']} connections to {status['url']} ready")
+        return f"{mcp_pool.status()['ready']}/{mcp_pool.size} connections ready"
+
+    async def _check_openai(self) -> str:
+        if self._client is None:
+            self._client = AsyncOpenAI(max_retries=0)
+        await self._client.models.list()
+        return str(self._client.base_url)
+
+    async def _check_sessions(self) -> str:
+        started = time.perf_counter()
+        await session_store.get(PROBE_SESSION_ID)
+        elapsed = (time.perf_counter() - started) * 1000
+        if elapsed > READY_SESSION_MAX_MS:
+            raise TimeoutError(f"session store read took {elapsed:.0f} ms (limit {READY_SESSION_MAX_MS:.0f} ms)")
+        return type(session_store).__name__
+
+    async def _openai_probe(self) -> ProbeResult:
+        # A passing result is reused for the interval; a failing one is retried on the next check.
+        if self._openai is None or not self._openai.ok or time.time() - self._openai.checked_at >= READY_OPENAI_INTERVAL:
+            self._openai = await self._probe("openai", self._check_openai)
+        return self._openai
+
+    async def check(self) -> ReadinessReport:
+        """Probe the dependencies, reusing recent results so frequent checks stay cheap."""
+        async with self._check_lock:
+            if self._report is not None and time.monotonic() - self._checked_at < READY_CACHE_SECONDS:
+                return self._report
+            probes = list(await asyncio.gather(
+                self._probe("mcp", self._check_mcp),
+                self._openai_probe(),
+                self._probe("sessions", self._check_sessions),
+            ))
+            self._report = ReadinessReport(
+                ready=self.warmed_up and all(probe.ok for probe in probes if probe.required),
+                warmed_up=self.warmed_up,
+                warmup_seconds=round(self.warmup_seconds, 2) if self.warmup_seconds is not None else None,
+                warmup_error=self.warmup_error,
+                probes=probes,
+            )
+            self._checked_at = time.monotonic()
+            if not self._report.ready:
+                failing = [probe.name for probe in probes if probe.required and not probe.ok]
+                logger.info(f"Not ready: warmed up={self.warmed_up} ({self.warmup_error or 'no error'}), failing probes={failing}.")
+            return self._report
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging, from the latest check."""
+        report = self._report
+        return {
+            "ready": bool(report and report.ready),
+            "warmed_up": self.warmed_up,
+            "warmup_seconds": self.warmup_seconds,
+            "warmup_failed": self.warmup_error is not None,
+            "warmup_error": self.warmup_error,
+            "probes": {probe.name: {"ok": probe.ok, "latency_ms": probe.latency_ms} for probe in report.probes} if report else {},
+        }
+
+readiness = Readiness()
@@ -6,26 +6,17 @@
 # Author: Kushal Chattopadhyay
 
 import asyncio
-import base64
-import io
 import json
 import logging
-import os
 import random
-from re import search
-from token import OP
 import uuid
-from typing import Any, AsyncIterator, Dict, List, Sequence
+from typing import Any, AsyncIterator, Dict, List
 
 from agents.tracing.util import gen_group_id
 
-import fitz
-from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Request, UploadFile
 from fastapi.responses import StreamingResponse, PlainTextResponse
-from PIL import Image
-import pytesseract
-from pydantic import BaseModel
-from redis.asyncio import Redis
+from pydantic import BaseModel, Field, ValidationError
 from starlette.status import HTTP_400_BAD_REQUEST
 
 from agents import (
@@ -38,32 +29,57 @@ from agents import (
     custom_span,
     trace,
 )
-from agents.extensions.visualization import draw_graph
 from agents.items import ItemHelpers
-from agents.mcp import MCPServerSse
 from context import ShinanContext
+from context_window import context_manager
+from deep_research import DeepResearchJob, deep_research, job_store
+from guardrails import run_guarded
+from images import IMAGE_TOKEN_BUDGET, prepare_image, report_savings
+from ocr import ocr_engine
+from materials import PDF_DPI, PDF_MAX_PAGES, stream_pdf_parts
+from upload_cache import upload_cache, upload_key
+from usage import BudgetExceeded, UsageReport, usage_accountant
+from streaming import (
+    UI_PACING_INTERVAL,
+    UI_PACING_MAX_INTERVAL,
+    Progress,
+    StreamEvent,
+    event_logs,
+    merge,
+    message,
+    pace_updates,
+    report,
+    report_delta,
+    stream_response,
+    update,
+)
+from mcp_pool import mcp_pool
+from metrics import ERRORS, SEARCH_QUEUE_DEPTH, time_stage, timed
+from search_cache import search_cache
+from search_ranking import SearchResult, search_ranker
+from search_scheduler import SEARCH_QUEUE_SIZE, search_scheduler
+from structured_stream import ArrayItemParser
+from sessions import (
+    ShinanSessionManager,
+    attach_session,
+    get_session,
+    save_on_completion,
+    session_store,
+)
+from openai import RateLimitError
 from openai.types.responses import (
     ResponseTextDeltaEvent,
 )
-from tools.idea_generation.material_idea_agent import (
+# Agents are built on first use (see tools/registry.py).
+from tools.registry import agent_registry
+from tools.schemas import (
+    Analysis,
     MaterialSearchIdea,
     MaterialSearchIdeas,
-    MaterialInsightPoint,
-    MaterialInsights,
-    Analysis,
-    material_agent
-)
-from tools.idea_generation.text_idea_agent import (
+    Report,
     TextSearchIdea,
     TextSearchIdeas,
-    text_agent,
 )
-from tools.report_generation.verifier_agent import verifier_agent
-from tools.report_generation.writer_agent import Report, writer_agent
-from tools.research.search_agent import search_agent
-from tools.messages.messages_agent import messages_agent
-
-from openai import OpenAI
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -85,167 +101,101 @@ async def _context_relevance(run_result: RunResult) -> str:
 class ShinanQuery(BaseModel):
     """A query to the Shinan client."""
     query: str
+    pacing: float | None = Field(
+        default=None,
+        ge=0,
+        le=UI_PACING_MAX_INTERVAL,
+        description="Opt-in minimum seconds between streamed status updates. Never delays the report.",
+    )
 
-# Creating the Shinan Session Manager for data handling.
-# NOTE OpenAI has an implementation of this as well @ https://github.com/openai/openai-agents-python/blob/main/src/agents/memory/session.py
-class ShinanSessionManager:
-    def __init__(self) -> None:
-        self.context : ShinanContext = ShinanContext(company="SoftBank", role="Intern", interests=["AI", "Strategy"])   # If reset
-        self.input_items : list[TResponseInputItem] = []    # The input items helps agents understand history
-        self.group_id: str = ""
-        self.text_ideas: TextSearchIdeas = TextSearchIdeas(ideas=[])
-        self.analysis: Analysis = Analysis(
-            ideas=MaterialSearchIdeas(ideas=[]), 
-            insights=MaterialInsights(insights=[]) 
-        )
-
-        self.report: Report = Report(report="")
-
-    # --- Context management ---
-    def get_context(self) -> ShinanContext:
-        """Get the current session context."""
-        return self.context
-    
-    def set_context(self, context : ShinanContext):
-        """Set the session context."""
-        self.context = context
-
-    # --- Input item management ---
-    def get_input_items(self) -> List[TResponseInputItem]:
-        """Get the list of input items for the session."""
-        return self.input_items
-
-    def set_input_items(self, input_items : List[TResponseInputItem]) -> None:
-        """Set the list of input items for the session."""
-        self.input_items = input_items
-
-    def add_input_items(self, input_item : TResponseInputItem) -> None:
-        """Add a single input item to the session."""
-        self.input_items.append(input_item)
-
-    # --- Search ideas and analysis management ---
-    def set_text_ideas(self, text_ideas : TextSearchIdeas) -> None:
-        """Set the text search ideas for the session."""
-        self.text_ideas = text_ideas
-
-    def set_analysis(self, analysis : Analysis) -> None:
-        """Set the material analysis for the session."""
-        self.analysis = analysis
-    
-    # --- Report management ---
-    def set_report(self, report: Report) -> None:
-        """Set the generated report for the session."""
-        self.report = report
-
-    def get_report(self) -> Report:
-        """Get the generated report for the session."""
-        return self.report
-            
 class ShinanTextIntelligence:
     """A class that orchestrates the text-based flow of Shinan Intelligence."""
     
     def __init__(self, session: ShinanSessionManager) -> None:
         self.session = session
+        self.search_results: List[SearchResult] = []    # Ranked before they are added to the session.
+        self.usage = UsageReport()    # Of this request; the session's is in session.usage.
 
     @property
     def context(self) -> ShinanContext:
         return self.session.get_context()
 
-    async def run_deep_research(self, request: ShinanQuery):
-        system_message = """
-            You are a professional researcher preparing a helpful, data-driven note on a company's current events in line with the user's queries.
-
-            Do:
-            - Focus on data-rich insights.
-            - When appropriate, summarize data in a way that could be turned into charts or tables, and call this out in the response.
-            - Prioritize reliable, up-to-date sources: blogs, articles, etc.
-            - Include inline citations and return all source metadata.
-
-            Be analytical, avoid generalities, and ensure that each section is helpful to the user's queries.
-        """
-
-        client = OpenAI(api_key = os.environ.get("OPENAI_API_KEY"))
-        response = client.responses.create(
-            model="o3-deep-research",
-            input=[
-                {
-                "role": "developer",
-                "content": [
-                    {
-                    "type": "input_text",
-                    "text": system_message,
-                    }
-                ]
-                },
-                {
-                "role": "user",
-                "content": [
-                    {
-                    "type": "input_text",
-                    "text": request.query,
-                    }
-                ]
-                }
-            ],
-            reasoning={
-                "summary": "auto"
-            },
-            tools=[
-                {
-                    "type": "web_search_preview"
-                },
-            ]
-        )
-        if response.output[-1].type == "message":
-            for content in response.output[-1].content:
-                if content.type == "text":
-                    return content
+    def _agent(self, name: str) -> Agent:
+        """The named agent, as the session's budget allows (see usage.py)."""
+        return usage_accountant.agent_for(agent_registry.get(name), self.session.usage)
 
     async def run_messages(self, request: ShinanQuery) -> str:
-        with trace("Shinan Intelligence Messaging", group_id=self.session.group_id):
+        with trace("Shinan Intelligence Messaging", group_id=self.session.group_id), time_stage("messages", "messages"), \
+                usage_accountant.scope(self.usage, self.session.usage):
             
             messages_input : list[TResponseInputItem] = [{"content": self.session.get_report().report, "role": "assistant"}, {"content": request.query, "role": "user"}]
             
-            # TODO: Input is NOT a list of TResponseInputItems in this case. Need to take a look.
-            result = await Runner.run(messages_agent, input=f"{messages_input}", context=self.session.get_context())
+            # Earlier conversation within the agent's token budget (see context_window.py), then the report and the question.
+            messages_agent = self._agent("messages")
+            result = await Runner.run(
+                messages_agent,
+                input=context_manager.input_for(self.session, messages_agent.name, tail=messages_input),
+                context=self.session.get_context(),
+            )
+            usage_accountant.record_run(result, messages_agent, "messages", self.usage, self.session.usage)
         
         self.session.add_input_items({"content": result.final_output, "role": "assistant"})   # type: ignore
         return str(result.final_output)
 
-    async def run_query(self, request: ShinanQuery) -> AsyncIterator[str]:
-        with trace("Shinan Intelligence Text Workflow", group_id=self.session.group_id):
+    async def run_query(self, request: ShinanQuery) -> AsyncIterator[StreamEvent]:
+        with trace("Shinan Intelligence Text Workflow", group_id=self.session.group_id), \
+                usage_accountant.scope(self.usage, self.session.usage):
             
-            # Generating search ideas 
-            ideas_generator = self._generate_search_ideas(request.query, text_agent)
-            async for ev in ideas_generator:
+            # Generating search ideas and searching them. Each idea is searched as soon as the idea
+            # agent has written it, while it is still writing the rest.
+            ideas: asyncio.Queue[TextSearchIdea | None] = asyncio.Queue()
+            ideas_generator = timed(self._generate_search_ideas(request.query, self._agent("text"), ideas), "query", "ideas")
+            research_generator = timed(self._overall_search(ideas), "query", "search")
+            async for ev in merge(ideas_generator, research_generator):
                 yield ev
-            ideas : TextSearchIdeas = self.session.text_ideas
 
-            # Performing overall search with a streaming implementation
-            research_generator = self._overall_search(ideas)
-            async for ev in research_generator:
+            # Only the best, deduplicated search results go to the writer (see search_ranking.py).
+            async for ev in timed(self._rank_search_results(request.query), "query", "ranking"):
                 yield ev
 
             # Input into the report generator.
             logger.info(self.session.get_input_items())
 
             # Generating report
-            report_generator = self._generate_report(request)
+            report_generator = timed(self._generate_report(request), "query", "report")
             async for ev in report_generator:
                 yield ev
 
-    async def _generate_search_ideas(self, query: str, idea_agent: Agent) -> AsyncIterator[str]:
+    async def _generate_search_ideas(
+        self, query: str, idea_agent: Agent, ideas_queue: asyncio.Queue[TextSearchIdea | None]
+    ) -> AsyncIterator[StreamEvent]:
         """
         Generate search ideas from the given query using the specified idea agent.
         
         Args:
             query: The user's search query
             idea_agent: The agent responsible for generating search ideas
+            ideas_queue: Receives each idea as soon as it is complete, then None
             
         Yields:
             JSON strings containing search ideas and context information
         """
         ideas_generation_logger = logger.getChild("idea_generation")
+        try:
+            async for ev in self._stream_search_ideas(query, idea_agent, ideas_queue, ideas_generation_logger):
+                yield ev
+        finally:
+            await ideas_queue.put(None)
+
+    async def _stream_search_ideas(
+        self,
+        query: str,
+        idea_agent: Agent,
+        ideas_queue: asyncio.Queue[TextSearchIdea | None],
+        ideas_generation_logger: logging.Logger,
+    ) -> AsyncIterator[StreamEvent]:
+        # Search results added while the ideas are still being generated are kept (see below).
+        history_length = len(self.session.get_input_items())
 
         try:
             result: RunResultStreaming = Runner.run_streamed(
@@ -258,16 +208,46 @@ class ShinanTextIntelligence:
             ideas_generation_logger.error(f"Failed to initialize Runner: {e}")
             raise 
 
+        # Ideas are parsed out of the streamed output as they complete (see structured_stream.py), but
+        # only dispatched once the input guardrails have passed, so nothing is searched for input
+        # the guardrails reject.
+        parser = ArrayItemParser("ideas")
+        output_item_id: str | None = None
+        parsed: List[TextSearchIdea] = []
+        dispatched = 0
+
+        def guardrails_passed() -> bool:
+            results = result.input_guardrail_results
+            return len(results) >= len(idea_agent.input_guardrails) and not any(
+                r.output.tripwire_triggered for r in results
+            )
+
+        async def dispatch() -> None:
+            nonlocal dispatched
+            while dispatched < len(parsed):
+                ideas_generation_logger.info(f"Dispatching idea {dispatched}: {parsed[dispatched].query}")
+                await ideas_queue.put(parsed[dispatched])
+                dispatched += 1
+
         context_message : str = ""
-        async for ev in result.stream_events():
+        async for ev in usage_accountant.stream_events(result, idea_agent, "ideas", self.usage, self.session.usage):
 
             if ev.type == "raw_response_event" and isinstance(ev.data, ResponseTextDeltaEvent):
+                if ev.data.item_id != output_item_id:
+                    output_item_id = ev.data.item_id
+                    parser.reset()
+                for item in parser.feed(ev.data.delta):
+                    try:
+                        parsed.append(TextSearchIdea.model_validate(item))
+                    except ValidationError as e:
+                        ideas_generation_logger.debug(f"Skipping a malformed streamed idea: {e}")
+                if guardrails_passed():
+                    await dispatch()
                 continue
 
             elif ev.type == "run_item_stream_event":
                 if ev.item.type == "tool_call_item":
-                    yield f"UPDATE 背景を確認させていただきます。"
-                    await asyncio.sleep(1.0)
+                    yield update("背景を確認させていただきます。", stage="context")
 
                 elif ev.item.type == "tool_call_output_item":
                     """ 
@@ -285,107 +265,129 @@ class ShinanTextIntelligence:
                         interests_formatted = ", ".join(interests_str[:-1]) + f", and {interests_str[-1]}"
 
                     context_message = (
-                        f"UPDATE {company}で{role}としてお勤めで、{interests_formatted}にご興味があるのですね。承知しました!"
+                        f"{company}で{role}としてお勤めで、{interests_formatted}にご興味があるのですね。承知しました!"
                     )
-                    yield f"{context_message}"
+                    yield update(context_message, stage="context")
                     ideas_generation_logger.info(context_message)
 
-        await asyncio.sleep(1.0)
-        yield "ご利用ありがとうございます。いくつかの検索アプローチを洗い出しました。"
-        await asyncio.sleep(1.0)
+        yield message("ご利用ありがとうございます。いくつかの検索アプローチを洗い出しました。", stage="ideas")
 
         search_ideas = result.final_output_as(TextSearchIdeas)
         self.session.set_text_ideas(search_ideas)
 
+        # The final output is authoritative: dispatch any ideas that were not parsed from the stream.
+        parsed[dispatched:] = list(search_ideas.ideas)[dispatched:]
+        await dispatch()
+
         ideas = search_ideas.model_dump()
 
         # Format for sending as HTML bullet points
-        message = "以下はアイデアをご提案いたします。\n\n"
+        ideas_message = "以下はアイデアをご提案いたします。\n\n"
         for idea in ideas['ideas']:
-            message += (
+            ideas_message += (
                 f"検索: {idea['query']}\n"
                 f"理由: {idea['reasoning']}\n\n"
             )
 
-        yield message
-        self.session.set_input_items(result.to_input_list())
+        yield message(ideas_message, stage="ideas")
+        self.session.set_input_items(result.to_input_list() + self.session.get_input_items()[history_length:])
 
-    async def _search(self, idea: TextSearchIdea, search_logger: logging.Logger) -> AsyncIterator[str]:
+    async def _search(self, idea: TextSearchIdea, idea_id: int, search_logger: logging.Logger) -> AsyncIterator[StreamEvent]:
         """
-        Search the web for a single given idea.
+        Search the web for a single given idea, the `idea_id`th of the session's ideas.
         """
         input_data = f"Search term: {idea.query}\nReason: {idea.reasoning}"
         search_logger.info(f"Starting search for idea: {idea.query}")
 
-        try:
-            async with MCPServerSse(
-                name="Shinan MCP Vector Store",
-                params={"url": "http://localhost:8080/sse"}
-            ) as mcp_server:
-                search_mcp_agent = search_agent.clone(mcp_servers=[mcp_server])
-                result = Runner.run_streamed(
-                    search_agent,   # For now, I am not allowing search to use MCP servers out of token usage concerns.
-                    input_data,
-                    context=self.context,
-                    max_turns=5
-                )
-                search_logger.debug(f"Search agent initialized for query: {idea.query}")
-
-                async for ev in result.stream_events():
-                    if ev.type != "run_item_stream_event":
-                        continue
-
-                    if ev.item.type == "tool_call_item":
-                        search_logger.info(f"Processing run_item_stream_event: {ev.item.raw_item.type}")
-
-                        if getattr(ev.item.raw_item, "type", None) == "web_search_call":
-                            action = getattr(ev.item.raw_item, "action", None)
-                            if action and getattr(action, "type", None) == "search":
-                                search_logger.info(f"Searching the web for: {getattr(action, 'query', '')}")
-                                if idea.query != "None":
-                                    yield f"UPDATE {idea.query}をWEBで検索中..."
-                                await asyncio.sleep(1.0)
-
-                        elif getattr(ev.item.raw_item, "type", None) == "function_call":
-                            update_messages = [
-                                "UPDATE MCPを介してソフトバンクに関連する公開資料を検索します...",
-                                "UPDATE ソフトバンクの公開資料をMCP経由で調査中です...",
-                                "UPDATE MCPを使って関連するレポートを検索しています...",
-                                "UPDATE MCP経由で最新のソフトバンク資料を取得中です..."
-                            ]
-                            if not hasattr(self, '_mcp_update_idx'):
-                                self._mcp_update_idx = 0
-                            msg = update_messages[self._mcp_update_idx % len(update_messages)]
-                            self._mcp_update_idx += 1
-                            yield msg
-                            await asyncio.sleep(1.0)
-
-                    elif ev.item.type == "message_output_item":
-                        search_logger.info(f"Found {ev.item.raw_item}")
-
-            search_result = result.final_output_as(str)
-
-            # Add to input items.
-            search_logger.info({"content": search_result, "role": "assistant"})
-            self.session.add_input_items({"content": search_result, "role": "assistant"})
-
-        except Exception as e:
-            search_logger.error(f"Search failed for '{idea.query}': {e}.", exc_info=True)
-
-    async def _overall_search(self, search_ideas: TextSearchIdeas) -> AsyncIterator[str]:
-        """Search the web and the vector store sources for a given idea."""
+        # A similar search may have been run recently, by any session (see search_cache.py).
+        cached = await search_cache.get(idea.query)
+        if cached is not None:
+            yield update(f"{idea.query}の最近の検索結果を利用します", stage="search", idea_id=idea_id)
+            self.search_results.append(SearchResult(idea_id, idea.query, cached.result))
+            return
+
+        # Searches run in a slot of the shared scheduler (see search_scheduler.py), and are retried
+        # if the API rate limits them anyway, unless they have already streamed progress, which a
+        # retry would repeat. Failures propagate to _overall_search, which reports them.
+        attempt = 0
+        streamed = False
+        while True:
+            try:
+                async with search_scheduler.slot(self.session.session_id) as slot:
+                    search_agent = self._agent("search")
+                    result = Runner.run_streamed(
+                        search_agent,   # For now, I am not allowing search to use MCP servers out of token usage concerns.
+                        input_data,
+                        context=self.context,
+                        max_turns=5
+                    )
+                    search_logger.debug(f"Search agent initialized for query: {idea.query}")
+
+                    async for ev in usage_accountant.stream_events(result, search_agent, "search", self.usage, self.session.usage):
+                        if ev.type != "run_item_stream_event":
+                            continue
+
+                        if ev.item.type == "tool_call_item":
+                            search_logger.info(f"Processing run_item_stream_event: {ev.item.raw_item.type}")
+
+                            if getattr(ev.item.raw_item, "type", None) == "web_search_call":
+                                action = getattr(ev.item.raw_item, "action", None)
+                                if action and getattr(action, "type", None) == "search":
+                                    search_logger.info(f"Searching the web for: {getattr(action, 'query', '')}")
+                                    if idea.query != "None":
+                                        streamed = True
+                                        yield update(f"{idea.query}をWEBで検索中...", stage="search", idea_id=idea_id)
+
+                            elif getattr(ev.item.raw_item, "type", None) == "function_call":
+                                update_messages = [
+                                    "MCPを介してソフトバンクに関連する公開資料を検索します...",
+                                    "ソフトバンクの公開資料をMCP経由で調査中です...",
+                                    "MCPを使って関連するレポートを検索しています...",
+                                    "MCP経由で最新のソフトバンク資料を取得中です..."
+                                ]
+                                if not hasattr(self, '_mcp_update_idx'):
+                                    self._mcp_update_idx = 0
+                                msg = update_messages[self._mcp_update_idx % len(update_messages)]
+                                self._mcp_update_idx += 1
+                                streamed = True
+                                yield update(msg, stage="search", idea_id=idea_id)
+
+                        elif ev.item.type == "message_output_item":
+                            search_logger.info(f"Found {ev.item.raw_item}")
+
+                    slot.record(result)
+                break
+            except RateLimitError as e:
+                if streamed:
+                    raise
+                # The rejected attempt's recorded usage only covers responses completed (and
+                # billed) before the 429; usually none, as nothing was streamed yet.
+                await search_scheduler.backoff(attempt, e)
+                attempt += 1
+
+        search_result = result.final_output_as(str)
+        await search_cache.set(idea.query, search_result)
+
+        search_logger.info({"content": search_result, "role": "assistant"})
+        self.search_results.append(SearchResult(idea_id, idea.query, search_result))
+
+    async def _overall_search(self, ideas_queue: asyncio.Queue[TextSearchIdea | None]) -> AsyncIterator[StreamEvent]:
+        """Search the web and the vector store sources for each idea, as the ideas arrive on `ideas_queue`."""
 
         search_logger = logger.getChild("search")
-        search_logger.info(f"Starting overall search with {len(search_ideas.ideas)} ideas")
+        search_logger.info("Starting overall search")
 
         with custom_span("Search"):
             """ 
             Utilizing asyncio's Queue for rapid streaming capabilities and scalability. 
             """
 
-            # Create async generators for each idea
-            generators = [self._search(idea, search_logger) for idea in search_ideas.ideas]
-            queue: asyncio.Queue[str | None] = asyncio.Queue()
+            # One task per idea, started as the idea arrives. The queue is bounded, so searches wait
+            # for the stream to catch up instead of buffering without limit. None marks that every
+            # idea has been dispatched.
+            search_ideas: List[TextSearchIdea] = []
+            tasks: List[asyncio.Task] = []
+            queue: asyncio.Queue[StreamEvent | tuple[int, bool] | None] = asyncio.Queue(maxsize=SEARCH_QUEUE_SIZE)
             
             async def consume_generator(gen, gen_id: int):
                 """
@@ -393,30 +395,50 @@ class ShinanTextIntelligence:
                 Puts in asyncio Queue.
                 """
                 search_logger.debug(f"Starting generator {gen_id}")
+                succeeded = False
                 try:
                     async for item in gen:
                         search_logger.info(f"Generator {gen_id} yielded item: {item}")
                         await queue.put(item)
                     search_logger.info(f"Generator {gen_id} completed successfully")
+                    succeeded = True
                 except Exception as e:
-                    search_logger.error(f"Error in generator {gen_id}: {e}", exc_info=True)
+                    search_logger.error(f"Search failed for '{search_ideas[gen_id].query}': {e}", exc_info=True)
                 finally:
-                    search_logger.info(f"Generator {gen_id} finishing, putting None in queue")
-                    await queue.put(None)
-
-            tasks = [
-                asyncio.create_task(consume_generator(gen, i)) 
-                for i, gen in enumerate(generators)
-            ]
-            search_logger.info(f"Created {len(tasks)} search tasks")
+                    search_logger.info(f"Generator {gen_id} finishing, putting its ID in queue")
+                    await queue.put((gen_id, succeeded))
+
+            async def dispatch_ideas():
+                while (idea := await ideas_queue.get()) is not None:
+                    gen_id = len(search_ideas)
+                    search_ideas.append(idea)
+                    search = timed(self._search(idea, gen_id, search_logger), "query", "search_idea")
+                    tasks.append(asyncio.create_task(consume_generator(search, gen_id)))
+                    search_logger.info(f"Created search task {gen_id} for {idea.query}")
+                await queue.put(None)
+
+            dispatcher = asyncio.create_task(dispatch_ideas())
             
             try:
                 finished = 0
-                while finished < len(tasks):
+                all_dispatched = False
+                while not all_dispatched or finished < len(tasks):
                     item = await queue.get()
+                    SEARCH_QUEUE_DEPTH.observe(queue.qsize(), workflow="query")
                     if item is None:
+                        all_dispatched = True
+                        search_logger.info(f"All {len(tasks)} ideas dispatched")
+                    elif isinstance(item, tuple):
+                        gen_id, succeeded = item
                         finished += 1
                         search_logger.debug(f"Generator finished, {finished}/{len(tasks)} complete")
+                        status = "完了しました" if succeeded else "失敗しました"
+                        yield update(
+                            f"{search_ideas[gen_id].query}の検索が{status} ({finished}/{len(tasks)})",
+                            stage="search",
+                            idea_id=gen_id,
+                            progress=Progress(completed=finished, total=len(tasks)),
+                        )
                     else:
                         search_logger.debug(f"Yielding search result: {item}")
                         yield item
@@ -424,136 +446,247 @@ class ShinanTextIntelligence:
 
             finally:
                 search_logger.debug("Cleaning up search tasks")
-                for task in tasks:
+                for task in [dispatcher, *tasks]:
                     if not task.done():
                         search_logger.debug(f"Cancelling task {id(task)}")
                         task.cancel()
-                await asyncio.gather(*tasks, return_exceptions=True)
+                await asyncio.gather(dispatcher, *tasks, return_exceptions=True)
                 search_logger.info("All tasks gathered. Search workflow completed.")
 
-        yield "検索を完了しました！今からリポートを作成いたします。"
+        yield message("検索を完了しました！今からリポートを作成いたします。", stage="search")
 
-    async def _generate_report(self, request) -> AsyncIterator[str]:
+    async def _rank_search_results(self, query: str) -> AsyncIterator[StreamEvent]:
+        """Add the deduplicated, most relevant passages of the search results to the session."""
+        if not self.search_results:
+            return
+        yield update("検索結果を整理しています...", stage="report")
+        with custom_span("Rank search results"):
+            items = await search_ranker.rank(self.search_results, query, self.context)
+        for item in items:
+            self.session.add_input_items(item)
+
+    async def _generate_report(self, request) -> AsyncIterator[StreamEvent]:
         """Generate a report from a query and search results."""
 
         report_logger = logger.getChild("report")
         logger.setLevel(logging.INFO)
 
-        async with MCPServerSse(name="Shinan MCP Vector Store", params={"url": "http://localhost:8080/sse"}, cache_tools_list=True) as mcp_server:
-            writer_mcp_agent = writer_agent.clone(mcp_servers=[mcp_server])
+        # Pooled, already-connected MCP server (see mcp_pool.py); nothing to open or close per report.
+        writer_mcp_agent = self._agent("writer").clone(mcp_servers=[mcp_pool.server()])
 
-            # NOTE: Input is NOT a list of TResponseInputItems in this case. Need to take a look.
-            result = Runner.run_streamed(writer_mcp_agent, input=f"{self.session.get_input_items()} Query: {request.query}", context=self.context)
-        
-            async for ev in result.stream_events():
-                if ev.type == "run_item_stream_event":
-                    await asyncio.sleep(1.0)
+        # The search results within the writer's token budget (see context_window.py), then the query.
+        writer_input = context_manager.input_for(
+            self.session, writer_mcp_agent.name, tail=[{"content": f"Query: {request.query}", "role": "user"}]
+        )
+        result = Runner.run_streamed(writer_mcp_agent, input=writer_input, context=self.context)
+    
+        async for ev in usage_accountant.stream_events(result, writer_mcp_agent, "report", self.usage, self.session.usage):
+            # Report text as it is generated; the complete report follows as a `report` event.
+            if ev.type == "raw_response_event" and isinstance(ev.data, ResponseTextDeltaEvent):
+                yield report_delta(ev.data.delta)
 
-                    if ev.item.type == "tool_call_item":
-                        report_logger.info(f"Processing run_item_stream_event: {ev.item.raw_item.type}")
+            elif ev.type == "run_item_stream_event":
+                if ev.item.type == "tool_call_item":
+                    report_logger.info(f"Processing run_item_stream_event: {ev.item.raw_item.type}")
 
-                        if ev.item.raw_item.type == "web_search_call":
-                            report_logger.info(f"Web search call action: {ev.item.raw_item.action.type}")
+                    if ev.item.raw_item.type == "web_search_call":
+                        report_logger.info(f"Web search call action: {ev.item.raw_item.action.type}")
 
-                            if ev.item.raw_item.action.type == "search":
-                                report_logger.info(f"Searching the web for: {ev.item.raw_item.action.query}")
-                                yield f"UPDATE {ev.item.raw_item.action.query}をWEBで検索中..." 
+                        if ev.item.raw_item.action.type == "search":
+                            report_logger.info(f"Searching the web for: {ev.item.raw_item.action.query}")
+                            yield update(f"{ev.item.raw_item.action.query}をWEBで検索中...", stage="report")
 
-                        elif ev.item.raw_item.type == "function_call":
-                            report_logger.info("MCP to access a vector store of SoftBank reports", dir(ev.item.raw_item))
-                            update_messages = [
-                                "UPDATE MCPを介してソフトバンクに関連する公開資料を検索します...",
-                                "UPDATE ソフトバンクの公開資料をMCP経由で調査中です...",
-                                "UPDATE MCPを使って関連するレポートを検索しています...",
-                                "UPDATE MCP経由で最新のソフトバンク資料を取得中です..."
-                            ]
-                            if not hasattr(self, '_mcp_update_idx'):
-                                self._mcp_update_idx = 0
+                    elif ev.item.raw_item.type == "function_call":
+                        report_logger.info("MCP to access a vector store of SoftBank reports", dir(ev.item.raw_item))
+                        update_messages = [
+                            "MCPを介してソフトバンクに関連する公開資料を検索します...",
+                            "ソフトバンクの公開資料をMCP経由で調査中です...",
+                            "MCPを使って関連するレポートを検索しています...",
+                            "MCP経由で最新のソフトバンク資料を取得中です..."
+                        ]
+                        if not hasattr(self, '_mcp_update_idx'):
+                            self._mcp_update_idx = 0
 
-                            msg = update_messages[self._mcp_update_idx % len(update_messages)]
-                            self._mcp_update_idx += 1
-                            await asyncio.sleep(1.0)
-                            yield msg
+                        msg = update_messages[self._mcp_update_idx % len(update_messages)]
+                        self._mcp_update_idx += 1
+                        yield update(msg, stage="report")
 
 
-                    elif ev.item.type == "message_output_item":
-                        yield ("UPDATE リポートを完成しました！")
-                        await asyncio.sleep(2.0)
+                elif ev.item.type == "message_output_item":
+                    yield update("リポートを完成しました！", stage="report")
 
-                        final_report = Report(report=ItemHelpers.text_message_output(ev.item))
-                        self.session.set_report(final_report)
-                        yield final_report.report
+                    final_report = Report(report=ItemHelpers.text_message_output(ev.item))
+                    self.session.set_report(final_report)
+                    yield report(final_report.report)
 
 class ShinanMaterialIntelligence:
     """A class that orchestrates the material-based flow of Shinan Intelligence."""
     
     def __init__(self, session: ShinanSessionManager) -> None:
         self.session = session
+        self.search_results: List[SearchResult] = []    # Ranked before they are added to the session.
+        self.usage = UsageReport()    # Of this request; the session's is in session.usage.
 
     @property
     def context(self) -> ShinanContext:
         return self.session.get_context()
 
-    async def run_upload(self, material: list[TResponseInputItem]) -> str:
-        with trace("Shinan Intelligence Material Workflow", group_id=self.session.group_id):
-            # Generate search ideas and material analysis
-            analysis: Analysis = await self._generate_search_ideas_material(material, material_agent)
+    def _agent(self, name: str) -> Agent:
+        """The named agent, as the session's budget allows (see usage.py)."""
+        return usage_accountant.agent_for(agent_registry.get(name), self.session.usage)
+
+    async def run_upload(self, data: bytes, filename: str | None, content_type: str) -> AsyncIterator[StreamEvent]:
+        with trace("Shinan Intelligence Material Workflow", group_id=self.session.group_id), \
+                usage_accountant.scope(self.usage, self.session.usage):
+
+            # Reading the material; repeat uploads of the same file reuse it (see upload_cache.py)
+            key = await upload_key(data, content_type)
+            material = await upload_cache.get_material(key)
+            if material is None:
+                yield update(f"{filename}を読み込んでいます...", stage="material")
+                with time_stage("upload", "material"):
+                    material = await ALLOWED_TYPES[content_type](data, filename)
+                await upload_cache.set_material(key, material)
+            else:
+                logger.info(f"Reusing the cached material of {filename} ({key}).")
+
+            # Generating search ideas and material analysis
+            yield update("資料を分析しています...", stage="analysis")
+            try:
+                with time_stage("upload", "analysis"):
+                    analysis: Analysis = await self._generate_search_ideas_material(material, self._agent("material"), key)
+            except HTTPException as e:
+                yield message(str(e.detail), stage="analysis")
+                return
+            yield message(self._format_analysis(analysis), stage="analysis")
+
+            # Researching the web for search ideas, streaming each search as it completes
+            async for ev in timed(self._research_web(analysis.ideas), "upload", "search"):
+                yield ev
 
-            # Research web for search ideas
-            articles: List[str] = await self._research_web(analysis.ideas)
+            # Only the best, deduplicated search results go to the writer (see search_ranking.py).
+            queries = "\n".join(idea.query for idea in analysis.ideas.ideas)
+            async for ev in timed(self._rank_search_results(queries), "upload", "ranking"):
+                yield ev
 
-            # Generate report
-            report: str = await self._generate_report(search_results=articles, material_analysis=analysis.insights)
+            # Generating report
+            async for ev in timed(self._generate_report(), "upload", "report"):
+                yield ev
 
-        return report
+    def _format_analysis(self, analysis: Analysis) -> str:
+        """Format the material insights and search ideas as a message."""
+        message = "資料から以下のポイントを抽出しました。\n\n"
+        for insight in analysis.insights.insights:
+            message += (
+                f"{insight.point_of_interest}: {insight.material_analysis}\n"
+                f"理由: {insight.reasoning}\n\n"
+            )
+        message += "以下の検索を行います。\n\n"
+        for idea in analysis.ideas.ideas:
+            message += (
+                f"検索: {idea.query}\n"
+                f"理由: {idea.reasoning}\n\n"
+            )
+        return message
+
+    async def _generate_search_ideas_material(
+        self, material: list[TResponseInputItem], idea_agent: Agent, upload_key: str | None = None
+    ) -> Analysis:
+        # The same upload in the same context has been analyzed before (see upload_cache.py).
+        if upload_key is not None:
+            cached = await upload_cache.get_analysis(upload_key, self.context)
+            if cached is not None:
+                logger.info(f"Reusing the cached analysis of upload {upload_key}.")
+                analysis = Analysis.model_validate(cached["analysis"])
+                self.session.set_analysis(analysis)
+                self.session.set_input_items(material + cached["items"])
+                return analysis
 
-    async def _generate_search_ideas_material(self, material: list[TResponseInputItem], idea_agent: Agent) -> Analysis:
         try:
-            result = await Runner.run(idea_agent, material, context=self.context)
+            # The guardrail runs alongside the analysis and cancels it if it trips (see guardrails.py).
+            result = await run_guarded(idea_agent, material, context=self.context)
+            usage_accountant.record_run(result, idea_agent, "analysis", self.usage, self.session.usage)
             analysis = result.final_output_as(Analysis)
 
             self.session.set_analysis(analysis)
             self.session.set_input_items(result.to_input_list())
 
+            if upload_key is not None:
+                new_items = result.to_input_list()[len(material):]
+                await upload_cache.set_analysis(upload_key, self.context, analysis.model_dump(), new_items)
+
             return result.final_output_as(Analysis)
 
         except InputGuardrailTripwireTriggered as e:
-            print(f"Input guardrail triggered: {e}")
+            logger.warning(f"Input guardrail triggered: {e}")
             raise HTTPException(
                 status_code=400,
                 detail="The provided material contains sensitive content that cannot be processed. Please review and remove any sensitive information before resubmitting."
             )
 
-    async def _search(self, idea: MaterialSearchIdea) -> str | None:
+    async def _search(self, idea_id: int, idea: MaterialSearchIdea) -> str | None:
         """Search the web for a given idea."""
 
-        print(f"Searching: {idea.query} - {idea.reasoning}")
+        logger.info(f"Searching: {idea.query} - {idea.reasoning}")
         input_data = f"Search term: {idea.query}\nReason: {idea.reasoning}"
         try:
-            result = await Runner.run(search_agent, input_data, context=self.context)
+            cached = await search_cache.get(idea.query)
+            if cached is not None:
+                self.search_results.append(SearchResult(idea_id, idea.query, cached.result))
+                return cached.result
+
+            search_agent = self._agent("search")
+            result = await search_scheduler.run(self.session.session_id, search_agent, input_data, context=self.context)
+            usage_accountant.record_run(result, search_agent, "search", self.usage, self.session.usage)
             search_result = str(result.final_output)
-            self.session.add_input_items({"content": search_result, "role": "assistant"})
+            await search_cache.set(idea.query, search_result)
+            self.search_results.append(SearchResult(idea_id, idea.query, search_result))
             return search_result
         except Exception as e:
-            print(f"Search failed for {idea.query}: {e}")
+            ERRORS.inc(workflow="upload", stage="search_idea", error=type(e).__name__)
+            logger.warning(f"Search failed for {idea.query}: {e!r}")
             return None
 
-    async def _research_web(self, search_ideas: MaterialSearchIdeas) -> List[str]:
-        """Search the web for a given idea."""
+    async def _research_web(self, search_ideas: MaterialSearchIdeas) -> AsyncIterator[StreamEvent]:
+        """Search the web for each idea, reporting each search as it completes."""
 
         with custom_span("Search the web"):
-            tasks = [asyncio.create_task(self._search(idea)) for idea in search_ideas.ideas]
-            results: list[str] = []
-            num_completed = 0
-            for task in asyncio.as_completed(tasks):
-                result = await task
-                if result is not None:
-                    results.append(result)
-                num_completed += 1
-            return results
-
-    async def _generate_report(self, search_results: Sequence[str], material_analysis: MaterialInsights) -> str:
-        """Generate a report from a query and search results."""
+            async def search(idea_id: int, idea: MaterialSearchIdea) -> tuple[int, MaterialSearchIdea, str | None]:
+                with time_stage("upload", "search_idea"):
+                    return idea_id, idea, await self._search(idea_id, idea)
+
+            tasks = [asyncio.create_task(search(i, idea)) for i, idea in enumerate(search_ideas.ideas)]
+            try:
+                num_completed = 0
+                for task in asyncio.as_completed(tasks):
+                    idea_id, idea, result = await task
+                    num_completed += 1
+                    status = "完了しました" if result is not None else "失敗しました"
+                    yield update(
+                        f"{idea.query}の検索が{status} ({num_completed}/{len(tasks)})",
+                        stage="search",
+                        idea_id=idea_id,
+                        progress=Progress(completed=num_completed, total=len(tasks)),
+                    )
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        yield message("検索を完了しました！今からリポートを作成いたします。", stage="search")
+
+    async def _rank_search_results(self, query: str) -> AsyncIterator[StreamEvent]:
+        """Add the deduplicated, most relevant passages of the search results to the session."""
+        if not self.search_results:
+            return
+        yield update("検索結果を整理しています...", stage="report")
+        with custom_span("Rank search results"):
+            items = await search_ranker.rank(self.search_results, query, self.context)
+        for item in items:
+            self.session.add_input_items(item)
+
+    async def _generate_report(self) -> AsyncIterator[StreamEvent]:
+        """Generate a report from the material analysis and search results, streaming its text."""
 
         # verifier_tool = verifier_agent.as_tool(
         #     tool_name="verifier",
@@ -563,12 +696,23 @@ class ShinanMaterialIntelligence:
         # writer_agent_with_verifier = writer_agent.clone(tools=[verifier_tool])
 
         # Not using verifier for now.
-        result = await Runner.run(writer_agent, input=self.session.get_input_items(), context=self.context, max_turns=4)
-        return str(result.final_output)
+        writer_agent = self._agent("writer")
+        writer_input = context_manager.input_for(self.session, writer_agent.name)
+        result = Runner.run_streamed(writer_agent, input=writer_input, context=self.context, max_turns=4)
+
+        async for ev in usage_accountant.stream_events(result, writer_agent, "report", self.usage, self.session.usage):
+            if ev.type == "raw_response_event" and isinstance(ev.data, ResponseTextDeltaEvent):
+                yield report_delta(ev.data.delta)
+
+            elif ev.type == "run_item_stream_event" and ev.item.type == "message_output_item":
+                final_report = Report(report=ItemHelpers.text_message_output(ev.item))
+                self.session.set_report(final_report)
+                yield report(final_report.report)
 
-async def pdf_hybrid_to_material(upload_file: UploadFile, max_pages: int = 10) -> List[Dict[str, Any]]:
+async def pdf_hybrid_to_material(pdf_content: bytes, filename: str | None, max_pages: int = PDF_MAX_PAGES, dpi: int = PDF_DPI) -> List[Dict[str, Any]]:
     """
-    Convert PDF to both text and images for comprehensive analysis
+    Convert PDF to both text and images for comprehensive analysis.
+    Pages are rendered off the event loop (see materials.py); at most `max_pages` are included.
     
     Returns: 
         A list of dictionaries, each containing:
@@ -584,51 +728,16 @@ async def pdf_hybrid_to_material(upload_file: UploadFile, max_pages: int = 10) -
         },
         {
             "type": "input_image",
-            "image_url": "data:image/jpeg;base64,..."
+            "image_url": "data:image/png;base64,..."
         },
         ...
     ]
     """
     
-    pdf_content = await upload_file.read()
-    pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
-    
     content_parts = [
-        {
-            "type": "input_text",
-            "text": f"I'm providing a slide deck. {upload_file.filename} ({len(pdf_document)} pages)\n\n"
-        }
+        part async for part in stream_pdf_parts(pdf_content, filename, max_pages=max_pages, dpi=dpi)
     ]
     
-    for page_num in range(len(pdf_document)):
-        # Get the page
-        page = pdf_document[page_num]
-        
-        # Extract text
-        text_content = page.get_text() # type: ignore 
-        if text_content.strip():
-            content_parts.append({
-                "type": "input_text",
-                "text": f"**Slide {page_num + 1} Text:**\n{text_content.strip()}\n"
-            })
-        
-        # Convert to image
-        pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5)) # type: ignore 
-        img_data = pix.tobytes("png")
-        base64_image = base64.b64encode(img_data).decode('utf-8')
-        
-        content_parts.append({
-            "type": "input_image",
-            "image_url": f"data:image/jpeg;base64,{base64_image}"
-        })
-        
-        content_parts.append({
-            "type": "input_text",
-            "text": f"↑ Slide {page_num + 1} Visual\n---\n"
-        })
-    
-    pdf_document.close()
-    
     return [
         {
             "role": "user",
@@ -636,7 +745,7 @@ async def pdf_hybrid_to_material(upload_file: UploadFile, max_pages: int = 10) -
         }
     ]
 
-async def png_to_material(upload_file: UploadFile) -> List[Dict[str, Any]]: 
+async def png_to_material(image_content: bytes, filename: str | None) -> List[Dict[str, Any]]: 
     """
     Convert PNG to text (using OCR) and image for comprehensive analysis
     
@@ -654,34 +763,26 @@ async def png_to_material(upload_file: UploadFile) -> List[Dict[str, Any]]:
         },
         {
             "type": "input_image",
-            "image_url": "data:image/png;base64,..."
+            "image_url": "data:image/png;base64,..."  (or image/jpeg for photographs)
         },
         ...
     ]
     """
     
-    # Read the PNG file
-    image_content = await upload_file.read()
-    
-    image = Image.open(io.BytesIO(image_content))
-    
-    # Perform OCR to extract text
-    try:
-        ocr_text = pytesseract.image_to_string(image)
-    except Exception as e:
-        print(f"OCR failed: {e}")
-        ocr_text = ""
-    
-    # Convert to base64 for image processing
-    img_buffer = io.BytesIO()
-    image.save(img_buffer, format='PNG')
-    img_data = img_buffer.getvalue()
-    base64_image = base64.b64encode(img_data).decode('utf-8')
+    # Perform OCR to extract text (see ocr.py), while the image is downscaled and re-encoded
+    # only if needed (see images.py)
+    ocr_job = ocr_engine.job(filename)
+    ocr_text, prepared = await asyncio.gather(
+        ocr_job.recognize(image_content),
+        asyncio.to_thread(prepare_image, image_content, max_tokens=IMAGE_TOKEN_BUDGET),
+    )
+    ocr_job.finish()
+    report_savings(filename, [prepared])
     
     content_parts = [
         {
             "type": "input_text",
-            "text": f"I'm providing an image. {upload_file.filename}\n\n"
+            "text": f"I'm providing an image. {filename}\n\n"
         }
     ]
     
@@ -695,7 +796,7 @@ async def png_to_material(upload_file: UploadFile) -> List[Dict[str, Any]]:
     # Add the image
     content_parts.append({
         "type": "input_image",
-        "image_url": f"data:image/png;base64,{base64_image}"
+        "image_url": prepared.data_url()
     })
     
     content_parts.append({
@@ -713,12 +814,11 @@ async def png_to_material(upload_file: UploadFile) -> List[Dict[str, Any]]:
 
 ALLOWED_TYPES = {"application/pdf": pdf_hybrid_to_material, "image/png": png_to_material, }
 
-# Create the session manager, and generate a group ID to link all traces.
-session = ShinanSessionManager()
-manager = ShinanTextIntelligence(session=session)
+# Sessions are loaded per request from the session store (see sessions.py), keyed by the
+# shinan_session cookie or X-Shinan-Session header, so concurrent users never share state.
 
 @router.post("/context")
-async def set_context(context: ShinanContext):
+async def set_context(context: ShinanContext, session: ShinanSessionManager = Depends(get_session)):
     if not context.company or not context.role or context.interests is None:
         raise HTTPException(
             status_code=400,
@@ -726,14 +826,25 @@ async def set_context(context: ShinanContext):
         )
     logger.info(f"Context has been set to {context.model_dump(mode='str')}.")
     session.set_context(context)
+    await session_store.save(session)
+
+def _check_budget(session: ShinanSessionManager) -> None:
+    """Refuse requests from sessions that have used up their budget (see usage.py)."""
+    try:
+        usage_accountant.check(session.usage)
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
 
 @router.post("/query")
-async def run_query(request: ShinanQuery):
+async def run_query(request: ShinanQuery, http_request: Request, session: ShinanSessionManager = Depends(get_session)):
     """
     Main endpoint to process queries in a text format.
     Access to web search and MCP tools.
+    Streams events as NDJSON, or as SSE when the client accepts text/event-stream.
     """
 
+    _check_budget(session)
+
     # Reset the group id for each query.
     session.group_id = gen_group_id()
 
@@ -743,7 +854,14 @@ async def run_query(request: ShinanQuery):
     try:
         logger.info(f"Query {request.query} is running.")
         result = manager.run_query(request)
-        return StreamingResponse(result, media_type="application/json")
+        pacing = request.pacing if request.pacing is not None else UI_PACING_INTERVAL
+        log = event_logs.start(
+            save_on_completion(pace_updates(result, pacing), session, on_saved=context_manager.compact_later),
+            session.session_id,
+            workflow="query",
+            usage=manager.usage,
+        )
+        return attach_session(stream_response(http_request, log), session)
 
     except asyncio.exceptions.CancelledError:
         return {"result": "Stopped"}
@@ -752,14 +870,19 @@ async def run_query(request: ShinanQuery):
         return {"result": f"Error: {str(e)}"}
 
 @router.post("/messages")
-async def run_messages(request: ShinanQuery):
+async def run_messages(request: ShinanQuery, session: ShinanSessionManager = Depends(get_session)):
     """
     Main endpoint to respond simply to queries in a text format.
     """
 
+    _check_budget(session)
+    manager = ShinanTextIntelligence(session=session)
+
     try:
         result = await manager.run_messages(request)
-        return PlainTextResponse(result)
+        await session_store.save(session)
+        context_manager.compact_later(session)
+        return attach_session(PlainTextResponse(result), session)
 
     except asyncio.exceptions.CancelledError:
         return {"result": "Stopped"}
@@ -767,45 +890,121 @@ async def run_messages(request: ShinanQuery):
     except Exception as e:
         return {"result": f"Apologies, but there is an error. {str(e)}"}
 
-@router.post("/deep_research")
-async def run_query_research(request: ShinanQuery):
+@router.get("/usage")
+async def get_usage(session: ShinanSessionManager = Depends(get_session)):
+    """
+    The session's token usage and estimated cost, by agent, stage and model, and its budget.
+    """
+    return {
+        **session.usage.model_dump(),
+        "token_budget": usage_accountant.token_budget or None,
+        "cost_budget": usage_accountant.cost_budget or None,
+        "over_budget": usage_accountant.over_budget(session.usage),
+    }
+
+@router.post("/deep_research", status_code=202)
+async def run_query_research(request: ShinanQuery, session: ShinanSessionManager = Depends(get_session)):
     """
     Main endpoint to process queries in a text format via Deep Research API.
-    API call to Responses API Deep Research functionality.
+    Starts a background job and returns its ID; follow it with the events or polling endpoints below.
     """
 
-    # Reset the group id for each query.
-    session.group_id = gen_group_id()
-    manager = ShinanTextIntelligence(session=session)
+    _check_budget(session)
 
-    try: 
-        stream = await manager.run_deep_research(request) 
-        return stream  
+    # Save the session so the job can store its report there once it completes.
+    await session_store.save(session)
+    job = await deep_research.submit(session.session_id, request.query)
+    logger.info(f"Deep research {request.query} is running as job {job.job_id}.")
+    return {"job_id": job.job_id, "status": job.status}
 
-    except asyncio.exceptions.CancelledError:
-        return {"result": "Stopped"}
-        
-    except Exception as e:
-        return {"result": f"Error: {str(e)}"}
+async def _get_job(job_id: str, session: ShinanSessionManager) -> DeepResearchJob:
+    job = await job_store.get(job_id)
+    if job is None or job.session_id != session.session_id:
+        raise HTTPException(status_code=404, detail="Deep research job not found.")
+    return job
+
+@router.get("/deep_research/{job_id}")
+async def get_query_research(job_id: str, after: int = 0, session: ShinanSessionManager = Depends(get_session)):
+    """
+    Poll a deep research job: its status, report and citations, and any events after `after`.
+    """
+    job = await _get_job(job_id, session)
+    return {**job.model_dump(), "events": await job_store.events(job_id, after)}
+
+@router.get("/deep_research/{job_id}/events")
+async def stream_query_research(
+    job_id: str,
+    after: int = 0,
+    last_event_id: int | None = Header(None),
+    session: ShinanSessionManager = Depends(get_session),
+):
+    """
+    Follow a deep research job as Server-Sent Events. Reconnecting clients resume after the
+    Last-Event-ID header (sent automatically by EventSource) or the `after` query parameter.
+    """
+    await _get_job(job_id, session)
+    start = last_event_id if last_event_id is not None else after
+    return attach_session(
+        StreamingResponse(
+            deep_research.follow(job_id, start),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        ),
+        session,
+    )
+
+@router.delete("/deep_research/{job_id}")
+async def cancel_query_research(job_id: str, session: ShinanSessionManager = Depends(get_session)):
+    """
+    Cancel a deep research job.
+    """
+    job = await deep_research.cancel(await _get_job(job_id, session))
+    return {"job_id": job.job_id, "status": job.status}
+
+@router.get("/streams/{stream_id}")
+async def resume_stream(
+    stream_id: str,
+    http_request: Request,
+    after: int = 0,
+    last_event_id: int | None = Header(None),
+    session: ShinanSessionManager = Depends(get_session),
+):
+    """
+    Reconnect to a /query or /upload stream (ID in its X-Shinan-Stream header), replaying the
+    events after the Last-Event-ID header or the `after` query parameter.
+    """
+    log = event_logs.get(stream_id, session.session_id)
+    if log is None:
+        raise HTTPException(status_code=404, detail="Stream not found.")
+    start = last_event_id if last_event_id is not None else after
+    return attach_session(stream_response(http_request, log, start), session)
 
 @router.post("/upload")
-async def run_upload(file: UploadFile = File(...)):
+async def run_upload(http_request: Request, file: UploadFile = File(...), session: ShinanSessionManager = Depends(get_session)):
     """
     Main endpoint to process queries in a PDF or PNG format.
+    Streams progress updates, the material analysis and then the report.
     """
 
+    _check_budget(session)
+
     # Reset the group id for each query.
     session.group_id = gen_group_id()
     manager = ShinanMaterialIntelligence(session=session)
 
     content_type = file.content_type or ""
-    processor = ALLOWED_TYPES.get(content_type)
-    if not processor:
+    if content_type not in ALLOWED_TYPES:
         raise HTTPException(
             status_code=HTTP_400_BAD_REQUEST,
             detail=f"Unsupported file type: {content_type}. Only PDF and PNG are supported."
         )
 
-    material = await processor(file)
-    result = await manager.run_upload(material)
-    return result
\ No newline at end of file
+    # Progress, the material analysis and the report are streamed as in /query.
+    result = manager.run_upload(await file.read(), file.filename, content_type)
+    log = event_logs.start(
+        save_on_completion(pace_updates(result, UI_PACING_INTERVAL), session, on_saved=context_manager.compact_later),
+        session.session_id,
+        workflow="upload",
+        usage=manager.usage,
+    )
+    return attach_session(stream_response(http_request, log), session)
\ No newline at end of file
@@ -1,6 +1,8 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Response, status
 from pydantic import BaseModel
 
+from readiness import ReadinessReport, readiness
+
 router = APIRouter(prefix="/health", tags=["health"])
 
 class HealthCheckResponse(BaseModel):
@@ -19,4 +21,33 @@ async def health_check() -> HealthCheckResponse:
     """
     Simple health check returning OK status.
     """
-    return HealthCheckResponse()
\ No newline at end of file
+    return HealthCheckResponse()
+
+@router.get(
+    "/live",
+    summary="Liveness probe",
+    status_code=status.HTTP_200_OK,
+    response_model=HealthCheckResponse,
+)
+async def live() -> HealthCheckResponse:
+    """
+    The process is up and serving requests. Does not check dependencies, so an instance is not
+    restarted because the MCP server or OpenAI is down.
+    """
+    return HealthCheckResponse()
+
+@router.get(
+    "/ready",
+    summary="Readiness probe",
+    response_model=ReadinessReport,
+    responses={status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ReadinessReport}},
+)
+async def ready(response: Response) -> ReadinessReport:
+    """
+    Whether the instance should take traffic: warmup has finished and the MCP, OpenAI and session
+    store probes pass (see readiness.py). 503 otherwise, with each probe's result.
+    """
+    report = await readiness.check()
+    if not report.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return report
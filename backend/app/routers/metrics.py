@@ -0,0 +1,51 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import guardrails
+from mcp_pool import mcp_pool
+from metrics import CONTENT_TYPE, registry
+from ocr import ocr_engine
+from readiness import readiness
+from search_cache import search_cache
+from search_ranking import search_ranker
+from search_scheduler import search_scheduler
+from tools.registry import agent_registry
+from upload_cache import upload_cache
+from usage import usage_accountant
+
+router = APIRouter(tags=["metrics"])
+
+# Components whose snapshot() stats are exported as shinan_<component>_<stat> metrics.
+COMPONENTS = {
+    "search_scheduler": search_scheduler.snapshot,
+    "search_cache": search_cache.snapshot,
+    "search_ranking": search_ranker.snapshot,
+    "guardrails": guardrails.snapshot,
+    "ocr": ocr_engine.snapshot,
+    "upload_cache": upload_cache.snapshot,
+    "mcp_pool": mcp_pool.status,
+    "agents": agent_registry.snapshot,
+    "readiness": readiness.snapshot,
+    "usage": usage_accountant.snapshot,
+}
+
+# Their cumulative stats, exported as shinan_<component>_<stat>_total counters; the others are gauges.
+_CACHE_COUNTERS = {"hits", "local_hits", "redis_hits", "misses", "sets", "evictions", "invalidations"}
+COUNTERS = {
+    "search_scheduler": {"started", "completed", "failed", "rate_limited", "retries", "throttled_seconds"},
+    "search_cache": {"hits", "misses", "stale", "sets", "evictions", "embedding_failures"},
+    "search_ranking": {"runs", "passages", "duplicates", "kept", "tokens_in", "tokens_out", "embedding_failures"},
+    "guardrails": _CACHE_COUNTERS,
+    "ocr": {"pages", "failures", "timeouts", "skipped", "characters", "seconds"},
+    "upload_cache": _CACHE_COUNTERS,
+    "mcp_pool": {"reconnects"},
+    "usage": {"requests", "input_tokens", "cached_tokens", "output_tokens", "reasoning_tokens", "cost_usd"},
+}
+
+@router.get("/metrics", summary="Prometheus metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """
+    Stage latencies, time to first event, errors, tool calls and token usage, and the stats of
+    the caches, scheduler and pools, in the Prometheus text format (see metrics.py).
+    """
+    return PlainTextResponse(registry.render(COMPONENTS, COUNTERS), media_type=CONTENT_TYPE)
@@ -0,0 +1,214 @@
+# Shinan Semantic Search Cache
+#
+# Analysts ask near-identical questions all day ("SoftBank Vision Fund AI investments", "Vision
+# Fund AI investments by SoftBank"), so search results are shared across sessions by meaning
+# rather than by exact text. Each search query is embedded, and a cached result is reused when a
+# previous query is similar enough (cosine similarity at least SHINAN_SEARCH_CACHE_THRESHOLD) and
+# the result is still fresh (younger than SHINAN_SEARCH_CACHE_TTL, as results include news).
+#
+# Embeddings are kept normalized in a NumPy matrix, a flat index searched with one matrix-vector
+# product. Beyond SHINAN_SEARCH_CACHE_MAX_ENTRIES the least recently used entry is evicted. The
+# cache is per process. SHINAN_SEARCH_CACHE=off disables it.
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_ENABLED = os.environ.get("SHINAN_SEARCH_CACHE", "on").lower() not in ("0", "off", "false", "no")
+SEARCH_CACHE_EMBEDDING_MODEL = os.environ.get("SHINAN_SEARCH_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+SEARCH_CACHE_THRESHOLD = float(os.environ.get("SHINAN_SEARCH_CACHE_THRESHOLD", "0.92"))
+SEARCH_CACHE_TTL = float(os.environ.get("SHINAN_SEARCH_CACHE_TTL", str(60 * 60 * 6)))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SHINAN_SEARCH_CACHE_MAX_ENTRIES", "2048"))
+
+# Embeddings of recent queries, so storing a result does not embed its query again.
+EMBEDDING_MEMO_SIZE = 1024
+
+class SearchCacheStats(BaseModel):
+    """Counters for the semantic search cache."""
+    hits: int = 0
+    misses: int = 0
+    stale: int = 0  # Similar entries that were too old to reuse.
+    sets: int = 0
+    evictions: int = 0
+    embedding_failures: int = 0
+    entries: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+@dataclass
+class SearchCacheHit:
+    """A cached search result and how it matched."""
+    query: str  # The query the result was found for.
+    result: str
+    similarity: float
+    age: float  # Seconds.
+
+class VectorIndex:
+    """
+    A flat index of normalized vectors in a preallocated matrix, with an LRU order over its rows.
+    Rows of removed entries are reused.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        # Allocated once the embedding size is known.
+        self._matrix: Optional["np.ndarray"] = None
+        self._live: Optional["np.ndarray"] = None
+        self._lru: OrderedDict[int, None] = OrderedDict()
+        self._free: List[int] = list(range(capacity - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def nearest(self, vector: "np.ndarray") -> tuple[Optional[int], float]:
+        """The row most similar to a normalized vector, and its cosine similarity."""
+        import numpy as np
+
+        if self._matrix is None or self._live is None or not self._lru:
+            return None, 0.0
+        similarities = self._matrix @ vector
+        similarities[~self._live] = -1.0
+        row = int(np.argmax(similarities))
+        return row, float(similarities[row])
+
+    def add(self, vector: "np.ndarray") -> tuple[int, Optional[int]]:
+        """Store a normalized vector. Returns its row and the row evicted to make room, if any."""
+        if self._matrix is None or self._live is None:
+            import numpy as np
+
+            self._matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            self._live = np.zeros(self.capacity, dtype=bool)
+        evicted = None
+        if not self._free:
+            evicted = next(iter(self._lru))
+            self.remove(evicted)
+        row = self._free.pop()
+        self._matrix[row] = vector
+        self._live[row] = True
+        self._lru[row] = None
+        return row, evicted
+
+    def touch(self, row: int) -> None:
+        self._lru.move_to_end(row)
+
+    def remove(self, row: int) -> None:
+        if row in self._lru and self._live is not None:
+            del self._lru[row]
+            self._live[row] = False
+            self._free.append(row)
+
+class SemanticSearchCache:
+    """Search results keyed by the embeddings of their queries."""
+
+    def __init__(
+        self,
+        threshold: float = SEARCH_CACHE_THRESHOLD,
+        ttl: float = SEARCH_CACHE_TTL,
+        max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+        model: str = SEARCH_CACHE_EMBEDDING_MODEL,
+        enabled: bool = SEARCH_CACHE_ENABLED,
+    ) -> None:
+        self.threshold = threshold
+        self.ttl = ttl
+        self.model = model
+        self.enabled = enabled
+        self.stats = SearchCacheStats()
+        self._index = VectorIndex(max_entries)
+        self._entries: Dict[int, tuple[str, str, float]] = {}  # Row -> (query, result, stored at).
+        self._embeddings: OrderedDict[str, "np.ndarray"] = OrderedDict()
+        self._client: Optional[AsyncOpenAI] = None
+
+    async def _embed(self, query: str) -> Optional["np.ndarray"]:
+        """The normalized embedding of a query, or None if it cannot be computed."""
+        import numpy as np
+
+        key = " ".join(query.lower().split())
+        vector = self._embeddings.get(key)
+        if vector is not None:
+            self._embeddings.move_to_end(key)
+            return vector
+        if self._client is None:
+            self._client = AsyncOpenAI()
+        try:
+            response = await self._client.embeddings.create(model=self.model, input=key)
+        except Exception as e:
+            self.stats.embedding_failures += 1
+            logger.warning(f"Could not embed search query {query!r}: {e!r}")
+            return None
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        self._embeddings[key] = vector
+        if len(self._embeddings) > EMBEDDING_MEMO_SIZE:
+            self._embeddings.popitem(last=False)
+        return vector
+
+    async def get(self, query: str) -> Optional[SearchCacheHit]:
+        """A fresh cached result for a query similar enough to this one, if there is one."""
+        if not self.enabled:
+            return None
+        vector = await self._embed(query)
+        if vector is None:
+            return None
+        row, similarity = self._index.nearest(vector)
+        if row is None or similarity < self.threshold:
+            self.stats.misses += 1
+            return None
+        cached_query, result, stored_at = self._entries[row]
+        age = time.time() - stored_at
+        if age > self.ttl:
+            self._remove(row)
+            self.stats.stale += 1
+            self.stats.misses += 1
+            return None
+        self._index.touch(row)
+        self.stats.hits += 1
+        logger.info(f"Search cache hit for {query!r}: {cached_query!r} (similarity {similarity:.3f}, {age / 60:.0f} min old).")
+        return SearchCacheHit(cached_query, result, similarity, age)
+
+    async def set(self, query: str, result: str) -> None:
+        """Cache the result of a search. A near-duplicate entry is replaced."""
+        if not self.enabled:
+            return
+        vector = await self._embed(query)
+        if vector is None:
+            return
+        row, similarity = self._index.nearest(vector)
+        if row is not None and similarity >= self.threshold:
+            self._remove(row)
+        row, evicted = self._index.add(vector)
+        if evicted is not None:
+            self._entries.pop(evicted, None)
+            self.stats.evictions += 1
+        self._entries[row] = (query, result, time.time())
+        self.stats.sets += 1
+        self.stats.entries = len(self._index)
+
+    def _remove(self, row: int) -> None:
+        self._index.remove(row)
+        self._entries.pop(row, None)
+        self.stats.entries = len(self._index)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging."""
+        return {
+            **self.stats.model_dump(),
+            "hit_ratio": round(self.stats.hit_ratio, 3),
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+        }
+
+search_cache = SemanticSearchCache()
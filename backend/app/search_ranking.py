@@ -0,0 +1,252 @@
+# Shinan Search Ranking
+#
+# The searches of one query often find the same news, so their results repeat each other's
+# paragraphs, and the writer paid for every copy. Before the report is written, the results go
+# through a ranking stage instead of straight into the session:
+# - Results are split into passages (paragraphs, with their headings).
+# - Near-duplicate passages are clustered with MinHash and locality-sensitive hashing, and each
+#   cluster is kept once, as its longest passage.
+# - If the passages exceed SHINAN_SEARCH_RANK_TOP_K or SHINAN_SEARCH_RANK_TOKENS, they are ranked
+#   by the embedding similarity of each passage to the query and the user's context (company,
+#   role and interests), and the best are kept within both limits. Passages found by several
+#   searches rank slightly higher. The MinHash signatures (in a thread) and the embeddings are
+#   computed at the same time.
+# - The kept passages are returned per search, in their original order, as input items.
+
+import asyncio
+import logging
+import os
+import re
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+from agents import TResponseInputItem
+from context import ShinanContext
+from context_window import count_text_tokens, shingles
+from search_cache import SEARCH_CACHE_EMBEDDING_MODEL
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEARCH_RANK_TOP_K = int(os.environ.get("SHINAN_SEARCH_RANK_TOP_K", "24"))
+SEARCH_RANK_TOKENS = int(os.environ.get("SHINAN_SEARCH_RANK_TOKENS", "12000"))
+# Passages whose estimated Jaccard similarity is at least this are duplicates.
+SEARCH_DEDUPE_THRESHOLD = float(os.environ.get("SHINAN_SEARCH_DEDUPE_THRESHOLD", "0.5"))
+
+# 128 MinHash permutations in 32 bands of 4 rows: passages with a similarity around 0.42 or more
+# become candidates, which are then checked against the threshold.
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32
+MINHASH_PRIME = 4294967311  # The first prime above 2**32.
+# Score bonus per additional search a passage was found by.
+CORROBORATION_BONUS = 0.02
+# Characters of a passage that are embedded.
+EMBEDDING_MAX_CHARS = 2000
+# Blocks shorter than this that look like headings are joined to the next block.
+HEADING_MAX_CHARS = 80
+
+@lru_cache(maxsize=1)
+def _minhash_coefficients() -> Tuple["np.ndarray", "np.ndarray"]:
+    """The MinHash permutations' coefficients, fixed so signatures are stable across processes."""
+    import numpy as np
+
+    rng = np.random.default_rng(20240601)
+    a = rng.integers(1, 2**31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, 2**31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    return a, b
+
+@dataclass
+class SearchResult:
+    """The result of one search."""
+    idea_id: int
+    query: str
+    text: str
+
+@dataclass
+class Passage:
+    idea_id: int
+    position: int  # Within its result.
+    text: str
+    tokens: int
+    found_by: int = 1  # The searches that found this passage or a near-duplicate.
+    score: float = 0.0
+
+class RankingStats(BaseModel):
+    """Counters for the search ranking stage."""
+    runs: int = 0
+    passages: int = 0
+    duplicates: int = 0
+    kept: int = 0
+    tokens_in: int = 0
+    tokens_out: int = 0
+    embedding_failures: int = 0
+
+# --- Passages ---
+def split_passages(result: SearchResult) -> List[Passage]:
+    """The paragraphs of a search result, each heading joined to the paragraph after it."""
+    blocks = [block.strip() for block in re.split(r"\n\s*\n", result.text) if block.strip()]
+    passages: List[str] = []
+    heading = ""
+    for block in blocks:
+        if len(block) <= HEADING_MAX_CHARS and (block.startswith("#") or block.endswith((":", "："))):
+            heading = f"{heading}\n{block}".strip()
+            continue
+        passages.append(f"{heading}\n{block}".strip())
+        heading = ""
+    if heading:
+        passages.append(heading)
+    return [Passage(result.idea_id, i, text, count_text_tokens(text)) for i, text in enumerate(passages)]
+
+# --- Near-duplicate clustering ---
+def minhash(text: str) -> "np.ndarray":
+    """The MinHash signature of a passage's shingles."""
+    import numpy as np
+
+    a, b = _minhash_coefficients()
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64)
+    return ((np.outer(hashes, a) + b) % MINHASH_PRIME).min(axis=0)
+
+def cluster(passages: List[Passage], threshold: float = SEARCH_DEDUPE_THRESHOLD) -> List[List[int]]:
+    """Groups of near-duplicate passages, by index."""
+    import numpy as np
+
+    signatures = np.stack([minhash(passage.text) for passage in passages])
+    parent = list(range(len(passages)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    for band in range(LSH_BANDS):
+        buckets: Dict[bytes, int] = {}
+        for i, signature in enumerate(signatures[:, band * rows:(band + 1) * rows]):
+            key = signature.tobytes()
+            j = buckets.setdefault(key, i)
+            if j != i and find(i) != find(j) and np.mean(signatures[i] == signatures[j]) >= threshold:
+                parent[find(i)] = find(j)
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(len(passages)):
+        clusters.setdefault(find(i), []).append(i)
+    return list(clusters.values())
+
+# --- Ranking ---
+def relevance_text(query: str, context: ShinanContext) -> str:
+    """What passages are ranked against: the query and who is asking."""
+    return f"{query}\n{context.company} {context.role}\n{', '.join(context.interests)}"
+
+class SearchRanker:
+    """Deduplicates and ranks a query's search results before they reach the writer."""
+
+    def __init__(
+        self,
+        top_k: int = SEARCH_RANK_TOP_K,
+        max_tokens: int = SEARCH_RANK_TOKENS,
+        model: str = SEARCH_CACHE_EMBEDDING_MODEL,
+    ) -> None:
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.model = model
+        self.stats = RankingStats()
+        self._client: Optional[AsyncOpenAI] = None
+
+    async def _embed(self, texts: List[str]) -> Optional["np.ndarray"]:
+        """Normalized embeddings of the texts, in one request. None if they cannot be computed."""
+        import numpy as np
+
+        if self._client is None:
+            self._client = AsyncOpenAI()
+        try:
+            response = await self._client.embeddings.create(
+                model=self.model, input=[text[:EMBEDDING_MAX_CHARS] for text in texts]
+            )
+        except Exception as e:
+            self.stats.embedding_failures += 1
+            logger.warning(f"Could not embed search passages for ranking: {e!r}")
+            return None
+        vectors = np.asarray([data.embedding for data in response.data], dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def _lexical_scores(self, passages: List[Passage], relevance: str) -> List[float]:
+        """Share of the relevance text's shingles in each passage, when embeddings fail."""
+        terms = shingles(relevance.replace(",", " "))
+        return [len(terms & shingles(passage.text)) / max(len(terms), 1) for passage in passages]
+
+    async def rank(self, results: List[SearchResult], query: str, context: ShinanContext) -> List[TResponseInputItem]:
+        """Input items of the deduplicated, best passages of the search results."""
+        passages = [passage for result in results for passage in split_passages(result)]
+        if not passages:
+            return []
+        total_tokens = sum(passage.tokens for passage in passages)
+        must_select = len(passages) > self.top_k or total_tokens > self.max_tokens
+
+        # Clustering and embedding run side by side; the embeddings are only needed to select.
+        relevance = relevance_text(query, context)
+        embedding = self._embed([relevance] + [passage.text for passage in passages]) if must_select else None
+        if embedding is not None:
+            clusters, vectors = await asyncio.gather(asyncio.to_thread(cluster, passages), embedding)
+        else:
+            clusters, vectors = await asyncio.to_thread(cluster, passages), None
+
+        representatives: List[int] = []
+        for members in clusters:
+            best = max(members, key=lambda i: passages[i].tokens)
+            passages[best].found_by = len({passages[i].idea_id for i in members})
+            representatives.append(best)
+
+        kept = representatives
+        if must_select:
+            if vectors is not None:
+                similarities = vectors[1:] @ vectors[0]
+                scores = [float(similarities[i]) for i in representatives]
+            else:
+                scores = self._lexical_scores([passages[i] for i in representatives], relevance)
+            for i, score in zip(representatives, scores):
+                passages[i].score = score + CORROBORATION_BONUS * (passages[i].found_by - 1)
+
+            kept, used = [], 0
+            for i in sorted(representatives, key=lambda i: passages[i].score, reverse=True):
+                if len(kept) >= self.top_k:
+                    break
+                if used + passages[i].tokens <= self.max_tokens:
+                    kept.append(i)
+                    used += passages[i].tokens
+
+        # Back into one item per search, in the original order.
+        by_result: Dict[int, List[Passage]] = {}
+        for i in sorted(kept, key=lambda i: (passages[i].idea_id, passages[i].position)):
+            by_result.setdefault(passages[i].idea_id, []).append(passages[i])
+        queries = {result.idea_id: result.query for result in results}
+        items: List[TResponseInputItem] = [
+            {"content": f"検索: {queries[idea_id]}\n\n" + "\n\n".join(p.text for p in kept_passages), "role": "assistant"}
+            for idea_id, kept_passages in by_result.items()
+        ]
+
+        kept_tokens = sum(passages[i].tokens for i in kept)
+        self.stats.runs += 1
+        self.stats.passages += len(passages)
+        self.stats.duplicates += len(passages) - len(representatives)
+        self.stats.kept += len(kept)
+        self.stats.tokens_in += total_tokens
+        self.stats.tokens_out += kept_tokens
+        logger.info(
+            f"Search ranking kept {len(kept)} of {len(passages)} passages "
+            f"({len(passages) - len(representatives)} duplicates), {kept_tokens} of {total_tokens} tokens."
+        )
+        return items
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging."""
+        return {**self.stats.model_dump(), "top_k": self.top_k, "max_tokens": self.max_tokens}
+
+search_ranker = SearchRanker()
@@ -0,0 +1,209 @@
+# Shinan Search Scheduler
+#
+# Every web search of every user goes through one shared scheduler, so a burst of queries cannot
+# fan out into more OpenAI calls than the account allows. A search waits for a slot under a
+# per-tenant cap (a tenant is a session, so one user's ideas cannot take every slot) and a global
+# cap, then for the request and token buckets, which refill at the account's RPM and TPM limits.
+# Searches rejected with 429 anyway are retried with jittered exponential backoff, honouring the
+# API's Retry-After.
+#
+# SHINAN_SEARCH_CONCURRENCY and SHINAN_SEARCH_TENANT_CONCURRENCY set the caps, SHINAN_SEARCH_RPM
+# and SHINAN_SEARCH_TPM the rate limits, and SHINAN_SEARCH_MAX_RETRIES the retries on 429.
+
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from agents import Agent, Runner, RunResult
+from agents.result import RunResultBase
+from openai import RateLimitError
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONCURRENCY = int(os.environ.get("SHINAN_SEARCH_CONCURRENCY", "8"))
+SEARCH_TENANT_CONCURRENCY = int(os.environ.get("SHINAN_SEARCH_TENANT_CONCURRENCY", "3"))
+SEARCH_RPM = int(os.environ.get("SHINAN_SEARCH_RPM", "500"))
+SEARCH_TPM = int(os.environ.get("SHINAN_SEARCH_TPM", "200000"))
+SEARCH_MAX_RETRIES = int(os.environ.get("SHINAN_SEARCH_MAX_RETRIES", "4"))
+# Tokens reserved for a search before it runs; the difference is settled once its usage is known.
+SEARCH_ESTIMATED_TOKENS = int(os.environ.get("SHINAN_SEARCH_ESTIMATED_TOKENS", "6000"))
+# Stream events a query's searches can buffer before they wait for the client to catch up.
+SEARCH_QUEUE_SIZE = int(os.environ.get("SHINAN_SEARCH_QUEUE_SIZE", "32"))
+
+SEARCH_BACKOFF_BASE = 1.0
+SEARCH_BACKOFF_MAX = 30.0
+
+class TokenBucket:
+    """
+    Holds up to `capacity` tokens and refills at `rate` tokens per second. Acquisitions wait in
+    order. The level can go negative when actual usage exceeds what was reserved, which delays
+    later acquisitions until the debt is paid off.
+    """
+
+    def __init__(self, capacity: float, rate: float) -> None:
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float) -> float:
+        """Take `amount` tokens, waiting for them if needed. Returns the seconds waited."""
+        amount = min(amount, self.capacity)
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return time.monotonic() - started
+                await asyncio.sleep((amount - self.level) / self.rate)
+
+    def settle(self, amount: float) -> None:
+        """Take (or, if negative, return) tokens without waiting."""
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+class SchedulerStats(BaseModel):
+    """Counters for the search scheduler."""
+    started: int = 0
+    completed: int = 0
+    failed: int = 0
+    rate_limited: int = 0  # 429s from the API.
+    retries: int = 0
+    running: int = 0
+    waiting: int = 0
+    throttled_seconds: float = 0.0  # Time spent waiting on the rate limits.
+
+class SearchSlot:
+    """A scheduled search. Record its run's result so its actual token usage is settled."""
+
+    def __init__(self, estimated_tokens: int) -> None:
+        self.estimated_tokens = estimated_tokens
+        self.tokens: Optional[int] = None
+
+    def record(self, result: RunResultBase) -> None:
+        self.tokens = result.context_wrapper.usage.total_tokens
+
+class _Tenant:
+    def __init__(self, concurrency: int) -> None:
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.users = 0
+
+class SearchScheduler:
+    """Schedules searches under global and per-tenant concurrency caps and the API rate limits."""
+
+    def __init__(
+        self,
+        concurrency: int = SEARCH_CONCURRENCY,
+        tenant_concurrency: int = SEARCH_TENANT_CONCURRENCY,
+        rpm: int = SEARCH_RPM,
+        tpm: int = SEARCH_TPM,
+        max_retries: int = SEARCH_MAX_RETRIES,
+    ) -> None:
+        self.concurrency = max(concurrency, 1)
+        self.tenant_concurrency = max(min(tenant_concurrency, self.concurrency), 1)
+        self.max_retries = max_retries
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.stats = SchedulerStats()
+        self._global = asyncio.Semaphore(self.concurrency)
+        self._tenants: Dict[str, _Tenant] = {}
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, estimated_tokens: int = SEARCH_ESTIMATED_TOKENS) -> AsyncIterator[SearchSlot]:
+        """Wait for a tenant's turn, a global slot and the rate limits, and hold the slot while searching."""
+        state = self._tenants.get(tenant)
+        if state is None:
+            state = self._tenants[tenant] = _Tenant(self.tenant_concurrency)
+        state.users += 1
+        slot = SearchSlot(estimated_tokens)
+        waiting = True
+        self.stats.waiting += 1
+        try:
+            async with state.semaphore, self._global:
+                self.stats.throttled_seconds += await self.requests.acquire(1)
+                self.stats.throttled_seconds += await self.tokens.acquire(estimated_tokens)
+                waiting = False
+                self.stats.waiting -= 1
+                self.stats.running += 1
+                self.stats.started += 1
+                try:
+                    yield slot
+                    self.stats.completed += 1
+                except BaseException:
+                    self.stats.failed += 1
+                    raise
+                finally:
+                    self.stats.running -= 1
+                    if slot.tokens is not None:
+                        self.tokens.settle(slot.tokens - estimated_tokens)
+        finally:
+            if waiting:
+                self.stats.waiting -= 1
+            state.users -= 1
+            if state.users == 0:
+                del self._tenants[tenant]
+
+    async def backoff(self, attempt: int, error: RateLimitError) -> None:
+        """Wait before retrying a search rejected with 429, or re-raise once out of retries."""
+        self.stats.rate_limited += 1
+        if attempt >= self.max_retries:
+            raise error
+        delay = _retry_after(error)
+        if delay is None:
+            # Full jitter, so searches rejected together do not retry together.
+            delay = random.uniform(0, min(SEARCH_BACKOFF_MAX, SEARCH_BACKOFF_BASE * 2 ** attempt))
+        # A long Retry-After would hold the search (and its stream) for too long.
+        delay = min(delay, SEARCH_BACKOFF_MAX)
+        self.stats.retries += 1
+        logger.warning(f"Search rate limited; retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries}).")
+        await asyncio.sleep(delay)
+
+    async def run(self, tenant: str, agent: Agent[Any], input: Any, **kwargs: Any) -> RunResult:
+        """Run a search agent to completion in a slot, retrying on 429."""
+        attempt = 0
+        while True:
+            try:
+                async with self.slot(tenant) as slot:
+                    result = await Runner.run(agent, input, **kwargs)
+                    slot.record(result)
+                    return result
+            except RateLimitError as e:
+                await self.backoff(attempt, e)
+                attempt += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging."""
+        return {
+            **self.stats.model_dump(),
+            "tenants": len(self._tenants),
+            "concurrency": self.concurrency,
+            "tenant_concurrency": self.tenant_concurrency,
+            "request_bucket": round(self.requests.level, 1),
+            "token_bucket": round(self.tokens.level),
+        }
+
+def _retry_after(error: RateLimitError) -> Optional[float]:
+    """The delay the API asked for in its Retry-After headers, if any."""
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+search_scheduler = SearchScheduler()
@@ -0,0 +1,275 @@
+# Shinan Session Store
+#
+# Per-user session state for the client router. Sessions are keyed by a session ID carried in a
+# cookie (or the X-Shinan-Session header) and kept in a pluggable store, so that any uvicorn
+# worker or node can serve any request.
+#
+# SHINAN_SESSION_STORE selects the backend: "memory" (default, per process) or "redis" (REDIS_URL).
+
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, TypeVar
+
+from fastapi import Request, Response
+
+from agents import TResponseInputItem
+from context import ShinanContext
+from tools.schemas import (
+    Analysis,
+    MaterialInsights,
+    MaterialSearchIdeas,
+    Report,
+    TextSearchIdeas,
+)
+from usage import UsageReport
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SESSION_COOKIE = "shinan_session"
+SESSION_HEADER = "X-Shinan-Session"
+SESSION_TTL = int(os.environ.get("SHINAN_SESSION_TTL", str(60 * 60 * 24)))
+SESSION_MAX_ENTRIES = int(os.environ.get("SHINAN_SESSION_MAX_ENTRIES", "1024"))
+
+# Creating the Shinan Session Manager for data handling.
+# NOTE OpenAI has an implementation of this as well @ https://github.com/openai/openai-agents-python/blob/main/src/agents/memory/session.py
+class ShinanSessionManager:
+    def __init__(self, session_id: str = "") -> None:
+        self.session_id: str = session_id or uuid.uuid4().hex
+        self.context : ShinanContext = ShinanContext(company="SoftBank", role="Intern", interests=["AI", "Strategy"])   # If reset
+        self.input_items : list[TResponseInputItem] = []    # The input items helps agents understand history
+        self.group_id: str = ""
+        self.text_ideas: TextSearchIdeas = TextSearchIdeas(ideas=[])
+        self.analysis: Analysis = Analysis(
+            ideas=MaterialSearchIdeas(ideas=[]),
+            insights=MaterialInsights(insights=[])
+        )
+
+        self.report: Report = Report(report="")
+        self.usage: UsageReport = UsageReport()    # Tokens and cost of the session so far (see usage.py).
+
+    # --- Context management ---
+    def get_context(self) -> ShinanContext:
+        """Get the current session context."""
+        return self.context
+
+    def set_context(self, context : ShinanContext):
+        """Set the session context."""
+        self.context = context
+
+    # --- Input item management ---
+    def get_input_items(self) -> List[TResponseInputItem]:
+        """Get the list of input items for the session."""
+        return self.input_items
+
+    def set_input_items(self, input_items : List[TResponseInputItem]) -> None:
+        """Set the list of input items for the session."""
+        self.input_items = input_items
+
+    def add_input_items(self, input_item : TResponseInputItem) -> None:
+        """Add a single input item to the session."""
+        self.input_items.append(input_item)
+
+    # --- Search ideas and analysis management ---
+    def set_text_ideas(self, text_ideas : TextSearchIdeas) -> None:
+        """Set the text search ideas for the session."""
+        self.text_ideas = text_ideas
+
+    def set_analysis(self, analysis : Analysis) -> None:
+        """Set the material analysis for the session."""
+        self.analysis = analysis
+
+    # --- Report management ---
+    def set_report(self, report: Report) -> None:
+        """Set the generated report for the session."""
+        self.report = report
+
+    def get_report(self) -> Report:
+        """Get the generated report for the session."""
+        return self.report
+
+    # --- Serialization ---
+    def to_json(self) -> str:
+        """Serialize the session for a session store."""
+        return json.dumps({
+            "session_id": self.session_id,
+            "context": self.context.model_dump(),
+            "input_items": self.input_items,
+            "group_id": self.group_id,
+            "text_ideas": self.text_ideas.model_dump(),
+            "analysis": self.analysis.model_dump(),
+            "report": self.report.model_dump(),
+            "usage": self.usage.model_dump(),
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str | bytes) -> "ShinanSessionManager":
+        """Deserialize a session written by `to_json`."""
+        raw: Dict[str, Any] = json.loads(data)
+        session = cls(session_id=raw["session_id"])
+        session.context = ShinanContext.model_validate(raw["context"])
+        session.input_items = raw["input_items"]
+        session.group_id = raw["group_id"]
+        session.text_ideas = TextSearchIdeas.model_validate(raw["text_ideas"])
+        session.analysis = Analysis.model_validate(raw["analysis"])
+        session.report = Report.model_validate(raw["report"])
+        session.usage = UsageReport.model_validate(raw.get("usage", {}))
+        return session
+
+class SessionStore(ABC):
+    """A store of Shinan sessions keyed by session ID, with TTL eviction."""
+
+    def __init__(self, ttl: int = SESSION_TTL) -> None:
+        self.ttl = ttl
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[ShinanSessionManager]:
+        """Get a session, refreshing its TTL. None if it does not exist or has expired."""
+
+    @abstractmethod
+    async def save(self, session: ShinanSessionManager) -> None:
+        """Save a session, resetting its TTL."""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        """Delete a session."""
+
+    async def load(self, session_id: str) -> ShinanSessionManager:
+        """Get a session, or create a new one under the same ID."""
+        session = await self.get(session_id)
+        if session is None:
+            logger.info(f"Creating session {session_id}.")
+            session = ShinanSessionManager(session_id=session_id)
+        return session
+
+    async def close(self) -> None:
+        """Release any resources held by the store."""
+
+class InMemorySessionStore(SessionStore):
+    """
+    Per-process LRU session store. Sessions expire `ttl` seconds after last use and the least
+    recently used sessions are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, ttl: int = SESSION_TTL, max_entries: int = SESSION_MAX_ENTRIES) -> None:
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._sessions: OrderedDict[str, tuple[float, ShinanSessionManager]] = OrderedDict()
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        expired = [sid for sid, (expires_at, _) in self._sessions.items() if expires_at <= now]
+        for sid in expired:
+            del self._sessions[sid]
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+
+    async def get(self, session_id: str) -> Optional[ShinanSessionManager]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        expires_at, session = entry
+        if expires_at <= time.monotonic():
+            del self._sessions[session_id]
+            return None
+        self._sessions[session_id] = (time.monotonic() + self.ttl, session)
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def save(self, session: ShinanSessionManager) -> None:
+        self._sessions[session.session_id] = (time.monotonic() + self.ttl, session)
+        self._sessions.move_to_end(session.session_id)
+        self._evict()
+
+    async def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+class RedisSessionStore(SessionStore):
+    """Session store shared across workers and nodes. Redis expires sessions `ttl` seconds after last use."""
+
+    def __init__(self, redis: "Redis", ttl: int = SESSION_TTL, prefix: str = "shinan:session:") -> None:
+        super().__init__(ttl)
+        self.redis = redis
+        self.prefix = prefix
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    async def get(self, session_id: str) -> Optional[ShinanSessionManager]:
+        data = await self.redis.getex(self._key(session_id), ex=self.ttl)
+        if data is None:
+            return None
+        try:
+            return ShinanSessionManager.from_json(data)
+        except (ValueError, KeyError) as e:
+            logger.error(f"Discarding unreadable session {session_id}: {e}")
+            await self.delete(session_id)
+            return None
+
+    async def save(self, session: ShinanSessionManager) -> None:
+        await self.redis.set(self._key(session.session_id), session.to_json(), ex=self.ttl)
+
+    async def delete(self, session_id: str) -> None:
+        await self.redis.delete(self._key(session_id))
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+def create_session_store() -> SessionStore:
+    """Create the session store configured by SHINAN_SESSION_STORE."""
+    backend = os.environ.get("SHINAN_SESSION_STORE", "memory").lower()
+    if backend == "redis":
+        # Only imported when Redis is used.
+        from redis.asyncio import Redis
+
+        redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+        logger.info(f"Using Redis session store at {redis_url}.")
+        return RedisSessionStore(Redis.from_url(redis_url))
+    if backend != "memory":
+        raise ValueError(f"Unknown session store: {backend}. Use 'memory' or 'redis'.")
+    return InMemorySessionStore()
+
+session_store: SessionStore = create_session_store()
+
+# --- Request helpers ---
+def get_session_id(request: Request) -> str:
+    """Get the session ID from the header or cookie, or mint a new one."""
+    return request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE) or uuid.uuid4().hex
+
+def attach_session(response: Response, session: ShinanSessionManager) -> Response:
+    """Send the session ID back to the client as both a cookie and a header."""
+    response.set_cookie(SESSION_COOKIE, session.session_id, max_age=session_store.ttl, httponly=True, samesite="lax")
+    response.headers[SESSION_HEADER] = session.session_id
+    return response
+
+async def get_session(request: Request, response: Response) -> ShinanSessionManager:
+    """FastAPI dependency that loads the caller's session."""
+    session = await session_store.load(get_session_id(request))
+    attach_session(response, session)
+    return session
+
+async def save_on_completion(
+    stream: AsyncIterator[T],
+    session: ShinanSessionManager,
+    on_saved: Optional[Callable[[ShinanSessionManager], None]] = None,
+) -> AsyncIterator[T]:
+    """
+    Relay a response stream and save the session once it has finished, even if the client
+    disconnects. `on_saved` is then called with the session, e.g. to compact it.
+    """
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await session_store.save(session)
+        if on_saved is not None:
+            on_saved(session)
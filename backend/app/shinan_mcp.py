@@ -6,24 +6,251 @@ This server implements the Model Context Protocol (MCP) with search and fetch
 capabilities designed to work with ChatGPT's deep research feature.
 """
 
+import asyncio
+import hashlib
+import json
 import logging
-from typing import Dict, List, Any
+import time
+import unicodedata
+from typing import Dict, List, Any, Optional, Tuple
+import httpx
 from fastmcp import FastMCP
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, NotFoundError
+from redis.asyncio import Redis
+from starlette.requests import Request
+from starlette.responses import JSONResponse
 from dotenv import load_dotenv
 import os
 
+from caching import ResultCache
+
 load_dotenv()
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 VECTOR_STORE_ID = os.environ.get("VECTOR_STORE_ID")
 
+# Vector store API client limits. One pooled client is shared by every tool call.
+OPENAI_TIMEOUT = float(os.environ.get("SHINAN_MCP_OPENAI_TIMEOUT", "30"))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("SHINAN_MCP_OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("SHINAN_MCP_OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_RETRIES = int(os.environ.get("SHINAN_MCP_OPENAI_MAX_RETRIES", "2"))
+
+# Result cache. Fetched files are revalidated against their metadata before reuse once they are
+# older than FETCH_REVALIDATE_AFTER, and a changed file invalidates every cached search.
+SEARCH_CACHE_BYTES = int(os.environ.get("SHINAN_MCP_SEARCH_CACHE_BYTES", str(8 * 1024 * 1024)))
+SEARCH_CACHE_TTL = float(os.environ.get("SHINAN_MCP_SEARCH_CACHE_TTL", "600"))
+FETCH_CACHE_BYTES = int(os.environ.get("SHINAN_MCP_FETCH_CACHE_BYTES", str(64 * 1024 * 1024)))
+FETCH_CACHE_TTL = float(os.environ.get("SHINAN_MCP_FETCH_CACHE_TTL", "86400"))
+FETCH_REVALIDATE_AFTER = float(os.environ.get("SHINAN_MCP_FETCH_REVALIDATE_AFTER", "300"))
+CACHE_REDIS_URL = os.environ.get("SHINAN_MCP_CACHE_REDIS_URL")
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=OPENAI_API_KEY) 
+# Initialize a shared async OpenAI client, so tool calls never block the FastMCP event loop.
+openai_client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    max_retries=OPENAI_MAX_RETRIES,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        ),
+    ),
+)
+
+# Initialize the result caches, optionally shared through Redis.
+cache_redis = Redis.from_url(CACHE_REDIS_URL) if CACHE_REDIS_URL else None
+search_cache = ResultCache("shinan:mcp:search", max_bytes=SEARCH_CACHE_BYTES, ttl=SEARCH_CACHE_TTL, redis=cache_redis)
+fetch_cache = ResultCache("shinan:mcp:fetch", max_bytes=FETCH_CACHE_BYTES, ttl=FETCH_CACHE_TTL, redis=cache_redis)
+_search_generations: Dict[str, int] = {}
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different phrasings share a cache entry."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+def _file_version(file_info: Any) -> str:
+    """A fingerprint of a vector store file that changes whenever the file does."""
+    return json.dumps([
+        getattr(file_info, "created_at", None),
+        getattr(file_info, "usage_bytes", None),
+        getattr(file_info, "status", None),
+        getattr(file_info, "attributes", None),
+    ], sort_keys=True, default=str)
+
+async def _search_generation(vector_store_id: str) -> int:
+    """The current search generation for a vector store. Bumped whenever one of its files changes."""
+    if cache_redis is not None:
+        try:
+            generation = await cache_redis.get(f"shinan:mcp:generation:{vector_store_id}")
+            return int(generation or 0)
+        except Exception as e:
+            logger.warning(f"Could not read search generation from Redis: {e!r}")
+    return _search_generations.get(vector_store_id, 0)
+
+async def _invalidate_searches(vector_store_id: str) -> None:
+    """Invalidate every cached search of a vector store."""
+    _search_generations[vector_store_id] = _search_generations.get(vector_store_id, 0) + 1
+    search_cache.stats.invalidations += 1
+    if cache_redis is not None:
+        try:
+            await cache_redis.incr(f"shinan:mcp:generation:{vector_store_id}")
+        except Exception as e:
+            logger.warning(f"Could not bump search generation in Redis: {e!r}")
+
+async def search_vector_store(query: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Search the vector store and return snippets of the matching files, cached by normalized query."""
+    if not query or not query.strip():
+        return {"results": []}
+
+    generation = await _search_generation(str(VECTOR_STORE_ID))
+    query_hash = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+    key = f"{VECTOR_STORE_ID}:{generation}:{query_hash}"
+
+    cached = await search_cache.get(key)
+    if cached is not None:
+        logger.info(f"Vector store search cache hit for query: '{query}'")
+        return cached
+
+    results = await _search_vector_store(query)
+    await search_cache.set(key, results)
+    return results
+
+async def _search_vector_store(query: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Search the vector store through the API."""
+    if not openai_client:
+        logger.error("OpenAI client not initialized - API key missing")
+        raise ValueError(
+            "OpenAI API key is required for vector store search")
+
+    # Search the vector store using OpenAI API
+    logger.info(
+        f"Searching vector store {VECTOR_STORE_ID} for query: '{query}'")
+
+    response = await openai_client.vector_stores.search(
+        vector_store_id=VECTOR_STORE_ID, query=query)  # type: ignore[arg-type]
+
+    results = []
+
+    # Process the vector store search results
+    if hasattr(response, 'data') and response.data:
+        for i, item in enumerate(response.data):
+            # Extract file_id, filename, and content from the VectorStoreSearchResponse
+            item_id = getattr(item, 'file_id', f"vs_{i}")
+            item_filename = getattr(item, 'filename', f"Document {i+1}")
+
+            # Extract text content from the content array
+            content_list = getattr(item, 'content', [])
+            text_content = ""
+            if content_list and len(content_list) > 0:
+                # Get text from the first content item
+                first_content = content_list[0]
+                if hasattr(first_content, 'text'):
+                    text_content = first_content.text
+                elif isinstance(first_content, dict):
+                    text_content = first_content.get('text', '')
+
+            if not text_content:
+                text_content = "No content available"
+
+            # Create a snippet from content
+            text_snippet = text_content[:200] + "..." if len(
+                text_content) > 200 else text_content
+
+            result = {
+                "id": item_id,
+                "title": item_filename,
+                "text": text_snippet,
+                "url": f"https://platform.openai.com/storage/files/{item_id}"
+            }
+
+            results.append(result)
+
+    logger.info(f"Vector store search returned {len(results)} results")
+    return {"results": results}
+
+async def fetch_vector_store_file(id: str) -> Dict[str, Any]:
+    """Fetch the full text and metadata of a vector store file, cached by (vector store ID, file ID)."""
+    if not id:
+        raise ValueError("Document ID is required")
+
+    key = f"{VECTOR_STORE_ID}:{id}"
+    cached: Optional[Dict[str, Any]] = await fetch_cache.get(key)
+    if cached is not None:
+        if time.time() - cached["validated_at"] < FETCH_REVALIDATE_AFTER:
+            logger.info(f"Vector store file cache hit: {id}")
+            return cached["result"]
+
+        # Revalidate with a cheap metadata lookup before reusing the full text.
+        try:
+            file_info = await openai_client.vector_stores.files.retrieve(
+                vector_store_id=VECTOR_STORE_ID, file_id=id)  # type: ignore[arg-type]
+        except NotFoundError:
+            logger.info(f"Vector store file {id} was removed, invalidating cached results.")
+            await fetch_cache.delete(key)
+            await _invalidate_searches(str(VECTOR_STORE_ID))
+            raise
+        if _file_version(file_info) == cached["version"]:
+            logger.info(f"Vector store file cache hit (revalidated): {id}")
+            await fetch_cache.set(key, {**cached, "validated_at": time.time()})
+            return cached["result"]
+
+        logger.info(f"Vector store file {id} changed, invalidating cached results.")
+        await fetch_cache.delete(key)
+        await _invalidate_searches(str(VECTOR_STORE_ID))
+
+    result, version = await _fetch_vector_store_file(id)
+    await fetch_cache.set(key, {"result": result, "version": version, "validated_at": time.time()})
+    return result
+
+async def _fetch_vector_store_file(id: str) -> Tuple[Dict[str, Any], str]:
+    """Fetch a vector store file through the API. Returns the result and the file's version."""
+    if not openai_client:
+        logger.error("OpenAI client not initialized - API key missing")
+        raise ValueError(
+            "OpenAI API key is required for vector store file retrieval")
+
+    logger.info(f"Fetching content from vector store for file ID: {id}")
+
+    # Fetch file content and metadata concurrently
+    content_response, file_info = await asyncio.gather(
+        openai_client.vector_stores.files.content(
+            vector_store_id=VECTOR_STORE_ID, file_id=id),  # type: ignore[arg-type]
+        openai_client.vector_stores.files.retrieve(
+            vector_store_id=VECTOR_STORE_ID, file_id=id),  # type: ignore[arg-type]
+    )
+
+    # Extract content from paginated response
+    file_content = ""
+    if hasattr(content_response, 'data') and content_response.data:
+        # Combine all content chunks from FileContentResponse objects
+        content_parts = []
+        for content_item in content_response.data:
+            if hasattr(content_item, 'text'):
+                content_parts.append(content_item.text)
+        file_content = "\n".join(content_parts)
+    else:
+        file_content = "No content available"
+
+    # Use filename as title and create proper URL for citations
+    filename = getattr(file_info, 'filename', f"Document {id}")
+
+    result = {
+        "id": id,
+        "title": filename,
+        "text": file_content,
+        "url": f"https://platform.openai.com/storage/files/{id}",
+        "metadata": None
+    }
+
+    # Add metadata if available from file info
+    if hasattr(file_info, 'attributes') and file_info.attributes:
+        result["metadata"] = file_info.attributes
+
+    logger.info(f"Successfully fetched vector store file: {id}")
+    return result, _file_version(file_info)
 
 def create_server():
     """Create and configure the MCP server with search and fetch tools."""
@@ -59,59 +286,7 @@ def create_server():
          id、タイトル、全文コンテンツ、オプションのURL、およびメタデータを含む完全なドキュメント
 
         """
-        if not query or not query.strip():
-            return {"results": []}
-
-        if not openai_client:
-            logger.error("OpenAI client not initialized - API key missing")
-            raise ValueError(
-                "OpenAI API key is required for vector store search")
-
-        # Search the vector store using OpenAI API
-        logger.info(
-            f"Searching vector store {VECTOR_STORE_ID} for query: '{query}'")
-
-        response = openai_client.vector_stores.search(
-            vector_store_id=VECTOR_STORE_ID, query=query)
-
-        results = []
-
-        # Process the vector store search results
-        if hasattr(response, 'data') and response.data:
-            for i, item in enumerate(response.data):
-                # Extract file_id, filename, and content from the VectorStoreSearchResponse
-                item_id = getattr(item, 'file_id', f"vs_{i}")
-                item_filename = getattr(item, 'filename', f"Document {i+1}")
-
-                # Extract text content from the content array
-                content_list = getattr(item, 'content', [])
-                text_content = ""
-                if content_list and len(content_list) > 0:
-                    # Get text from the first content item
-                    first_content = content_list[0]
-                    if hasattr(first_content, 'text'):
-                        text_content = first_content.text
-                    elif isinstance(first_content, dict):
-                        text_content = first_content.get('text', '')
-
-                if not text_content:
-                    text_content = "No content available"
-
-                # Create a snippet from content
-                text_snippet = text_content[:200] + "..." if len(
-                    text_content) > 200 else text_content
-
-                result = {
-                    "id": item_id,
-                    "title": item_filename,
-                    "text": text_snippet,
-                    "url": f"https://platform.openai.com/storage/files/{item_id}"
-                }
-
-                results.append(result)
-
-        logger.info(f"Vector store search returned {len(results)} results")
-        return {"results": results}
+        return await search_vector_store(query)
 
     @mcp.tool()
     async def file_fetch(id: str) -> Dict[str, Any]:
@@ -135,53 +310,12 @@ def create_server():
         戻り値:
          id、タイトル、全文コンテンツ、オプションのURL、およびメタデータを含む完全なドキュメント 
         """
-        if not id:
-            raise ValueError("Document ID is required")
-
-        if not openai_client:
-            logger.error("OpenAI client not initialized - API key missing")
-            raise ValueError(
-                "OpenAI API key is required for vector store file retrieval")
-
-        logger.info(f"Fetching content from vector store for file ID: {id}")
-
-        # Fetch file content from vector store
-        content_response = openai_client.vector_stores.files.content(
-            vector_store_id=VECTOR_STORE_ID, file_id=id)
-
-        # Get file metadata
-        file_info = openai_client.vector_stores.files.retrieve(
-            vector_store_id=VECTOR_STORE_ID, file_id=id)
-
-        # Extract content from paginated response
-        file_content = ""
-        if hasattr(content_response, 'data') and content_response.data:
-            # Combine all content chunks from FileContentResponse objects
-            content_parts = []
-            for content_item in content_response.data:
-                if hasattr(content_item, 'text'):
-                    content_parts.append(content_item.text)
-            file_content = "\n".join(content_parts)
-        else:
-            file_content = "No content available"
-
-        # Use filename as title and create proper URL for citations
-        filename = getattr(file_info, 'filename', f"Document {id}")
-        
-        result = {
-            "id": id,
-            "title": filename,
-            "text": file_content,
-            "url": f"https://platform.openai.com/storage/files/{id}",
-            "metadata": None
-        }
-
-        # Add metadata if available from file info
-        if hasattr(file_info, 'attributes') and file_info.attributes:
-            result["metadata"] = file_info.attributes
-
-        logger.info(f"Successfully fetched vector store file: {id}")
-        return result
+        return await fetch_vector_store_file(id)
+
+    @mcp.custom_route("/cache/stats", methods=["GET"])
+    async def cache_stats(request: Request) -> JSONResponse:
+        """Hit/miss metrics for the search and fetch result caches."""
+        return JSONResponse({"search": search_cache.snapshot(), "fetch": fetch_cache.snapshot()})
 
     return mcp
 
@@ -0,0 +1,388 @@
+# Shinan Streaming Utilities
+#
+# Helpers for the streamed client endpoints. Agent events are emitted as soon as they happen;
+# anything that shapes how they reach the client (such as UI pacing) wraps the stream here
+# rather than sleeping inside the agent workflows.
+#
+# The workflows yield typed StreamEvents:
+# - update:       a status update, e.g. a web search starting
+# - message:      a complete message, e.g. the proposed search ideas
+# - report_delta: a piece of the report text, as the writer generates it
+# - report:       the complete report, once it is finished
+# - error:        the workflow failed; no more content follows
+# - done:         always the last event of a stream, with the request's token usage and cost
+# Events carry the workflow stage and, during research, the search idea they belong to and the
+# progress of the searches. Each event is numbered and timed as it is recorded, so clients can
+# measure stage latency.
+#
+# A workflow runs as a task writing into an EventLog, independent of the request that started
+# it. Clients read the log as newline-delimited JSON or, when they accept text/event-stream, as
+# Server-Sent Events, both with heartbeats on idle streams. A client that loses its connection
+# reconnects to the stream (its ID is in the X-Shinan-Stream header) with Last-Event-ID or
+# ?after= and resumes where it left off. Logs live in the process running the workflow, so
+# resuming needs sticky sessions when several workers serve the API.
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator, Dict, Literal, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from metrics import ERRORS, FIRST_EVENT_SECONDS, STREAM_SECONDS
+from usage import UsageReport
+
+logger = logging.getLogger(__name__)
+
+StreamEventType = Literal["update", "message", "report_delta", "report", "error", "done"]
+Stage = Literal["context", "material", "analysis", "ideas", "search", "report"]
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+STREAM_HEADER = "X-Shinan-Stream"
+
+# Server-wide default for the minimum gap between status updates, in seconds. 0 disables pacing.
+UI_PACING_INTERVAL = float(os.environ.get("SHINAN_UI_PACING_INTERVAL", "0"))
+UI_PACING_MAX_INTERVAL = 5.0
+
+# Comment line sent on idle SSE streams so proxies and load balancers keep the connection open.
+SSE_HEARTBEAT = ": heartbeat\n\n"
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SHINAN_SSE_HEARTBEAT_INTERVAL", "15"))
+# The NDJSON equivalent, which clients skip.
+NDJSON_HEARTBEAT = '{"type":"heartbeat"}\n'
+
+# How long a finished stream can still be resumed, and how long a workflow keeps running with
+# no client connected before it is cancelled.
+STREAM_RETENTION = float(os.environ.get("SHINAN_STREAM_RETENTION", "300"))
+STREAM_ORPHAN_TIMEOUT = float(os.environ.get("SHINAN_STREAM_ORPHAN_TIMEOUT", "60"))
+
+def format_sse(data: str, event: str | None = None, id: str | int | None = None) -> str:
+    """Format one Server-Sent Event. Multi-line data is split across data fields."""
+    lines = []
+    if id is not None:
+        lines.append(f"id: {id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+# --- Events ---
+class Progress(BaseModel):
+    """Progress through a stage with several steps, e.g. searches completed of total."""
+    completed: int
+    total: int
+
+class StreamEvent(BaseModel):
+    """An event of a streamed workflow."""
+    type: StreamEventType
+    text: str = ""
+    stage: Optional[Stage] = None
+    idea_id: Optional[int] = None  # Index of the search idea, during research.
+    progress: Optional[Progress] = None
+    # Set when the event is recorded (see EventLog.append).
+    seq: int = 0
+    at: float = 0.0  # Wall-clock time, in seconds since the epoch.
+    elapsed_ms: int = 0  # Since the stream started.
+    stage_elapsed_ms: Optional[int] = None  # Since the first event of its stage.
+    usage: Optional[UsageReport] = None  # On the done event (see usage.py).
+
+def event(
+    event_type: StreamEventType,
+    text: str = "",
+    stage: Stage | None = None,
+    idea_id: int | None = None,
+    progress: Progress | None = None,
+) -> StreamEvent:
+    return StreamEvent(type=event_type, text=text, stage=stage, idea_id=idea_id, progress=progress)
+
+def update(text: str, stage: Stage | None = None, idea_id: int | None = None, progress: Progress | None = None) -> StreamEvent:
+    """A status update."""
+    return event("update", text, stage, idea_id, progress)
+
+def message(text: str, stage: Stage | None = None) -> StreamEvent:
+    """A complete message."""
+    return event("message", text, stage)
+
+def report_delta(text: str) -> StreamEvent:
+    """A piece of the report, as it is generated."""
+    return event("report_delta", text, "report")
+
+def report(text: str) -> StreamEvent:
+    """The complete report."""
+    return event("report", text, "report")
+
+def is_update(event: StreamEvent) -> bool:
+    """Whether an event is a status update rather than message or report content."""
+    return event.type == "update"
+
+def to_ndjson(event: StreamEvent) -> str:
+    return event.model_dump_json(exclude_none=True) + "\n"
+
+def to_sse(event: StreamEvent) -> str:
+    return format_sse(event.model_dump_json(exclude_none=True), event=event.type, id=event.seq)
+
+async def merge(*streams: AsyncIterator[StreamEvent]) -> AsyncIterator[StreamEvent]:
+    """
+    Interleave several event streams in the order their events arrive. If any stream raises, the
+    others are cancelled and the exception is raised.
+    """
+    queue: asyncio.Queue[tuple[int, StreamEvent | None]] = asyncio.Queue()
+
+    async def produce(index: int, stream: AsyncIterator[StreamEvent]) -> None:
+        try:
+            async for ev in stream:
+                await queue.put((index, ev))
+        finally:
+            await queue.put((index, None))
+
+    producers = [asyncio.create_task(produce(i, stream)) for i, stream in enumerate(streams)]
+    try:
+        remaining = len(producers)
+        while remaining:
+            index, ev = await queue.get()
+            if ev is None:
+                remaining -= 1
+                # Surface the stream's exception, if it failed.
+                await producers[index]
+            else:
+                yield ev
+    finally:
+        for producer in producers:
+            producer.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+
+async def pace_updates(stream: AsyncIterator[StreamEvent], min_interval: float) -> AsyncIterator[StreamEvent]:
+    """
+    Space status updates at least `min_interval` seconds apart, for a paced feel in the UI.
+
+    The upstream stream is drained by a separate task, so pacing never slows the agents down.
+    Only status updates are paced: as soon as message or report content is waiting behind them,
+    any pending updates are flushed immediately, so report bytes are never held back.
+    """
+    if min_interval <= 0:
+        async for chunk in stream:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[StreamEvent | None] = asyncio.Queue()
+    content_waiting = asyncio.Event()
+    pending_content = 0
+
+    async def produce() -> None:
+        nonlocal pending_content
+        try:
+            async for chunk in stream:
+                if not is_update(chunk):
+                    pending_content += 1
+                    content_waiting.set()
+                await queue.put(chunk)
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    last_update = float("-inf")
+
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+
+            if not is_update(chunk):
+                pending_content -= 1
+                if pending_content == 0:
+                    content_waiting.clear()
+                yield chunk
+                continue
+
+            delay = last_update + min_interval - loop.time()
+            if delay > 0 and not content_waiting.is_set():
+                try:
+                    await asyncio.wait_for(content_waiting.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            last_update = loop.time()
+            yield chunk
+
+        # Surface any exception raised by the upstream stream.
+        await producer
+
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+# --- Event logs ---
+class EventLog:
+    """
+    The recorded events of one workflow run. The workflow runs as a task writing into the log,
+    so it carries on while clients disconnect, reconnect and replay what they missed.
+    """
+
+    def __init__(self, owner: str, workflow: str = "stream", usage: Optional[UsageReport] = None) -> None:
+        self.stream_id = uuid.uuid4().hex
+        self.owner = owner  # The session the stream belongs to.
+        self.workflow = workflow  # For metrics, e.g. "query" or "upload".
+        self.usage = usage  # The workflow's usage, sent with the done event.
+        self.events: list[StreamEvent] = []
+        self.finished_at: float | None = None
+        self._started = time.monotonic()
+        self._stage_started: Dict[str, float] = {}
+        self._condition = asyncio.Condition()
+        self._task: asyncio.Task | None = None
+        self._followers = 0
+        self._orphan_timer: asyncio.TimerHandle | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    async def append(self, ev: StreamEvent) -> StreamEvent:
+        """Number and time an event, and wake its followers."""
+        now = time.monotonic()
+        async with self._condition:
+            ev.seq = len(self.events) + 1
+            ev.at = time.time()
+            ev.elapsed_ms = round((now - self._started) * 1000)
+            if ev.stage is not None:
+                ev.stage_elapsed_ms = round((now - self._stage_started.setdefault(ev.stage, now)) * 1000)
+            self.events.append(ev)
+            self._condition.notify_all()
+        return ev
+
+    def start(self, stream: AsyncIterator[StreamEvent]) -> None:
+        self._task = asyncio.create_task(self._run(stream))
+
+    async def _run(self, stream: AsyncIterator[StreamEvent]) -> None:
+        outcome = "ok"
+        try:
+            async for ev in stream:
+                if not self.events:
+                    FIRST_EVENT_SECONDS.observe(time.monotonic() - self._started, workflow=self.workflow)
+                await self.append(ev)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            await self.append(event("error", "Stopped"))
+            raise
+        except Exception as e:
+            outcome = "error"
+            logger.error(f"Stream {self.stream_id} failed: {e!r}", exc_info=True)
+            stage = self.events[-1].stage if self.events else None
+            ERRORS.inc(workflow=self.workflow, stage=stage or "stream", error=type(e).__name__)
+            await self.append(event("error", f"Error: {e}"))
+        finally:
+            done = event("done")
+            done.usage = self.usage
+            await self.append(done)
+            self.finished_at = time.time()
+            STREAM_SECONDS.observe(time.monotonic() - self._started, workflow=self.workflow, outcome=outcome)
+
+    async def follow(self, after: int = 0, heartbeat: float = SSE_HEARTBEAT_INTERVAL) -> AsyncIterator[StreamEvent | None]:
+        """
+        Yield the events after seq `after` until the done event, waiting for new ones as they are
+        recorded. Yields None as a heartbeat when nothing is recorded for `heartbeat` seconds.
+        """
+        self._attach()
+        try:
+            last = after
+            while True:
+                async with self._condition:
+                    try:
+                        await asyncio.wait_for(self._condition.wait_for(lambda: len(self.events) > last), heartbeat)
+                    except asyncio.TimeoutError:
+                        pass
+                    new = self.events[last:]
+                if not new:
+                    yield None
+                    continue
+                for ev in new:
+                    yield ev
+                    if ev.type == "done":
+                        return
+                last += len(new)
+        finally:
+            self._detach()
+
+    def _attach(self) -> None:
+        self._followers += 1
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+
+    def _detach(self) -> None:
+        self._followers -= 1
+        if self._followers == 0 and not self.finished and self._task is not None:
+            # Nobody is following the workflow; stop it unless a client reconnects in time.
+            self._orphan_timer = asyncio.get_running_loop().call_later(STREAM_ORPHAN_TIMEOUT, self.cancel)
+
+    def cancel(self) -> None:
+        if self._task is not None and not self._task.done():
+            logger.info(f"Cancelling stream {self.stream_id}.")
+            self._task.cancel()
+
+    async def wait(self) -> None:
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+class EventLogs:
+    """The event logs of this process, kept for `retention` seconds after their stream finishes."""
+
+    def __init__(self, retention: float = STREAM_RETENTION) -> None:
+        self.retention = retention
+        self._logs: Dict[str, EventLog] = {}
+
+    def _evict(self) -> None:
+        expired = time.time() - self.retention
+        for stream_id in [sid for sid, log in self._logs.items() if log.finished_at is not None and log.finished_at <= expired]:
+            del self._logs[stream_id]
+
+    def start(
+        self, stream: AsyncIterator[StreamEvent], owner: str, workflow: str = "stream", usage: Optional[UsageReport] = None
+    ) -> EventLog:
+        """Run a workflow's event stream into a new log."""
+        self._evict()
+        log = EventLog(owner, workflow, usage)
+        self._logs[log.stream_id] = log
+        log.start(stream)
+        return log
+
+    def get(self, stream_id: str, owner: str) -> Optional[EventLog]:
+        """A stream's log, or None if it does not exist, has expired or belongs to another session."""
+        self._evict()
+        log = self._logs.get(stream_id)
+        return log if log is not None and log.owner == owner else None
+
+    async def close(self) -> None:
+        """Stop any running workflows."""
+        for log in self._logs.values():
+            log.cancel()
+        await asyncio.gather(*(log.wait() for log in self._logs.values()))
+        self._logs.clear()
+
+event_logs = EventLogs()
+
+# --- Responses ---
+def wants_sse(request: Request) -> bool:
+    """Whether the client asked for Server-Sent Events rather than NDJSON."""
+    return SSE_MEDIA_TYPE in request.headers.get("accept", "")
+
+async def _frame(log: EventLog, after: int, sse: bool) -> AsyncIterator[str]:
+    async for ev in log.follow(after):
+        if ev is None:
+            yield SSE_HEARTBEAT if sse else NDJSON_HEARTBEAT
+        else:
+            yield to_sse(ev) if sse else to_ndjson(ev)
+
+def stream_response(request: Request, log: EventLog, after: int = 0) -> StreamingResponse:
+    """Stream a log's events after seq `after`, as SSE or NDJSON depending on the Accept header."""
+    sse = wants_sse(request)
+    return StreamingResponse(
+        _frame(log, after, sse),
+        media_type=SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE,
+        headers={STREAM_HEADER: log.stream_id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,84 @@
+# Shinan Structured Output Streaming
+#
+# Agents with a structured output type stream their output as JSON text deltas. Waiting for the
+# whole output wastes the time it takes to generate the rest: the idea agent's first search idea
+# is complete long before its last. ArrayItemParser picks complete items out of the streamed
+# JSON as soon as their closing brace arrives, so each can be acted on immediately.
+
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ArrayItemParser:
+    """
+    Incrementally parses the objects of the array under `field` in a streamed JSON object, e.g.
+    each idea of {"ideas": [{"query": ..., "reasoning": ...}, ...]}. Feed it text deltas; it
+    returns the items completed by each delta. Only the top-level field is considered.
+    """
+
+    def __init__(self, field: str) -> None:
+        self.field = field
+        self.reset()
+
+    def reset(self) -> None:
+        """Start over, e.g. for a new output message."""
+        self._item: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string: List[str] = []
+        self._last_string: Optional[str] = None
+        self._key: Optional[str] = None
+        self._in_array = False
+
+    def feed(self, delta: str) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        for char in delta:
+            in_item = self._in_array and self._depth >= 3
+            if in_item:
+                self._item.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = "".join(self._string)
+                    self._string = []
+                elif self._depth == 1:
+                    self._string.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char == ":" and self._depth == 1:
+                self._key = self._last_string
+            elif char in "{[":
+                self._depth += 1
+                if char == "[" and self._depth == 2:
+                    self._in_array = self._key == self.field
+                elif char == "{" and self._depth == 3 and self._in_array:
+                    self._item = [char]
+            elif char in "}]":
+                self._depth -= 1
+                if char == "}" and self._depth == 2 and self._in_array:
+                    item = self._parse("".join(self._item))
+                    if item is not None:
+                        items.append(item)
+                    self._item = []
+                elif char == "]" and self._depth == 1:
+                    self._in_array = False
+        return items
+
+    def _parse(self, text: str) -> Optional[Dict[str, Any]]:
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.debug(f"Could not parse a streamed {self.field} item: {e}")
+            return None
+        return item if isinstance(item, dict) else None
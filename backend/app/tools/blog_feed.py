@@ -0,0 +1,199 @@
+"""
+Cached SoftBank blog feed.
+
+The sbnews page is scraped at most once per TTL with a single async fetch. Stale entries are
+served while a background refresh runs (stale-while-revalidate), and the last good feed is
+written to a snapshot file so cold or offline boots still have something to render prompts with.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+
+import httpx
+from bs4 import BeautifulSoup
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+SBNEWS_URL = "https://www.softbank.jp/sbnews"
+
+BLOG_FEED_TIMEOUT = float(os.environ.get("SHINAN_BLOG_FEED_TIMEOUT", "5"))
+BLOG_FEED_TTL = float(os.environ.get("SHINAN_BLOG_FEED_TTL", "900"))
+BLOG_FEED_STALE_TTL = float(os.environ.get("SHINAN_BLOG_FEED_STALE_TTL", "86400"))
+BLOG_FEED_RETRY_INTERVAL = float(os.environ.get("SHINAN_BLOG_FEED_RETRY_INTERVAL", "60"))
+BLOG_FEED_SNAPSHOT = os.environ.get(
+    "SHINAN_BLOG_FEED_SNAPSHOT",
+    os.path.join(os.environ.get("SHINAN_CACHE_DIR", ".cache"), "softbank_blogs.json"),
+)
+
+
+class Blog(BaseModel):
+    """A single sbnews entry."""
+    title: str
+    url: str
+
+
+class BlogSnapshot(BaseModel):
+    """The feed as persisted to disk."""
+    fetched_at: float
+    blogs: List[Blog]
+
+
+def parse_blogs(html: str, limit: int = 5) -> List[Blog]:
+    """Parse the most recently published blogs from the sbnews page."""
+    soup = BeautifulSoup(html, "html.parser")
+    items = soup.select("li.urllist-item.recent-entries-item")
+    blogs: List[Blog] = []
+
+    for item in items[:limit]:
+        title_tag = item.select_one("a.urllist-title-link")
+        title = title_tag.text.strip() if title_tag else "No title"
+        article_url = str(title_tag["href"]) if title_tag else "No URL"
+        blogs.append(Blog(title=title, url=article_url))
+
+    return blogs
+
+
+def format_blogs(blogs: List[Blog]) -> str:
+    """repr form of the list of blogs, as embedded into prompts."""
+    return repr("".join(f"Title: {blog.title}, URL: {blog.url}\n" for blog in blogs))
+
+
+class BlogFeed:
+    """
+    TTL cache over the sbnews page.
+
+    - Fresh (younger than `ttl`): served from memory.
+    - Stale (younger than `stale_ttl`): served from memory, refreshed in the background.
+    - Expired or empty: the snapshot is loaded, otherwise one fetch is awaited (bounded by `timeout`).
+    Concurrent callers share a single in-flight fetch, and a failed fetch is not retried for
+    `retry_interval` seconds so an unreachable sbnews never stalls every prompt.
+    """
+
+    def __init__(
+        self,
+        url: str = SBNEWS_URL,
+        timeout: float = BLOG_FEED_TIMEOUT,
+        ttl: float = BLOG_FEED_TTL,
+        stale_ttl: float = BLOG_FEED_STALE_TTL,
+        snapshot_path: Optional[str] = BLOG_FEED_SNAPSHOT,
+        retry_interval: float = BLOG_FEED_RETRY_INTERVAL,
+    ) -> None:
+        self.url = url
+        self.timeout = timeout
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.snapshot_path = snapshot_path
+        self.retry_interval = retry_interval
+        self._failed_at: float = 0.0
+        self._snapshot: Optional[BlogSnapshot] = None
+        self._refresh_task: Optional[asyncio.Task[Optional[BlogSnapshot]]] = None
+        self._snapshot_loaded = False
+
+    # --- Cache state ---
+    def _age(self) -> float:
+        if self._snapshot is None:
+            return float("inf")
+        return time.time() - self._snapshot.fetched_at
+
+    def _load_snapshot(self) -> None:
+        """Load the on-disk snapshot once, for cold or offline boots."""
+        if self._snapshot_loaded:
+            return
+        self._snapshot_loaded = True
+
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                self._snapshot = BlogSnapshot.model_validate(json.load(f))
+            logger.info(f"Loaded blog feed snapshot from {self.snapshot_path}")
+        except Exception as e:
+            logger.warning(f"Could not load blog feed snapshot: {e}")
+
+    def _write_snapshot(self, snapshot: BlogSnapshot) -> None:
+        if not self.snapshot_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(snapshot.model_dump_json())
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Could not write blog feed snapshot: {e}")
+
+    # --- Fetching ---
+    async def _fetch(self) -> Optional[BlogSnapshot]:
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True) as client:
+                response = await client.get(self.url)
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"Blog feed fetch failed: {e!r}")
+            self._failed_at = time.time()
+            return None
+
+        blogs = parse_blogs(response.text)
+        if not blogs:
+            logger.warning("Blog feed fetch returned no entries, keeping the previous feed.")
+            self._failed_at = time.time()
+            return None
+
+        snapshot = BlogSnapshot(fetched_at=time.time(), blogs=blogs)
+        self._snapshot = snapshot
+        await asyncio.to_thread(self._write_snapshot, snapshot)
+        return snapshot
+
+    def _backing_off(self) -> bool:
+        return time.time() - self._failed_at < self.retry_interval
+
+    def refresh(self) -> Optional[asyncio.Task[Optional[BlogSnapshot]]]:
+        """
+        Start a refresh unless one is already in flight, and return its task.
+        Returns None while backing off after a failed fetch.
+        """
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return self._refresh_task
+        if self._backing_off():
+            return None
+        self._refresh_task = asyncio.create_task(self._fetch())
+        return self._refresh_task
+
+    # --- Access ---
+    async def get_blogs(self) -> List[Blog]:
+        """Get the blogs, fetching only when nothing usable is cached."""
+        self._load_snapshot()
+        age = self._age()
+
+        if age < self.ttl:
+            return self._snapshot.blogs  # type: ignore[union-attr]
+
+        if age < self.stale_ttl:
+            self.refresh()
+            return self._snapshot.blogs  # type: ignore[union-attr]
+
+        task = self.refresh()
+        if task is not None:
+            # Wait for the refresh, but do not let a cancelled caller cancel the shared fetch.
+            await asyncio.shield(task)
+
+        # An expired feed still beats an empty one when sbnews is unreachable.
+        return self._snapshot.blogs if self._snapshot else []
+
+    async def get(self) -> str:
+        """Get the blogs formatted for prompts."""
+        return format_blogs(await self.get_blogs())
+
+    def warm(self) -> None:
+        """Load the snapshot and refresh in the background if it is not fresh. Never blocks."""
+        self._load_snapshot()
+        if self._age() >= self.ttl:
+            self.refresh()
+
+
+blog_feed = BlogFeed()
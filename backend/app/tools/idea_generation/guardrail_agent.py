@@ -1,9 +1,14 @@
+import hashlib
+
 from agents import Agent, input_guardrail, Runner, GuardrailFunctionOutput
 from agents.run_context import RunContextWrapper
 from pydantic import BaseModel
+from guardrails import Verdict, screen
+from usage import usage_accountant
 from ..prompts import Prompt
 
 GUARDRAIL_PROMPT = Prompt().get_guardrail_prompt()
+GUARDRAIL_VERSION = hashlib.sha256(GUARDRAIL_PROMPT.encode("utf-8")).hexdigest()[:16]
 
 class IsSensitive(BaseModel):
     is_sensitive: bool
@@ -17,10 +22,17 @@ guardrail_agent = Agent(
 
 @input_guardrail
 async def sensitive_guardrail(ctx: RunContextWrapper, agent: Agent, input: str | list) -> GuardrailFunctionOutput:
-    """Guardrail for the idea agent."""
-    result = await Runner.run(guardrail_agent, input, context=ctx.context)
+    """Guardrail for the idea agent. Obvious cases are decided locally and verdicts are cached (see guardrails.py)."""
+
+    async def check() -> Verdict:
+        result = await Runner.run(guardrail_agent, input, context=ctx.context)
+        # Counted towards the request the guardrail screens (see usage.py).
+        usage_accountant.record_in_scope(result, guardrail_agent, "guardrail")
+        return Verdict(**result.final_output.model_dump(), source="model")
+
+    verdict = await screen(input, check, version=GUARDRAIL_VERSION)
     
     return GuardrailFunctionOutput(
-        output_info=result.final_output,
-        tripwire_triggered=result.final_output.is_sensitive,  
-    )
\ No newline at end of file
+        output_info=verdict,
+        tripwire_triggered=verdict.is_sensitive,  
+    )
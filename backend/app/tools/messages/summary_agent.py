@@ -0,0 +1,12 @@
+from agents import Agent
+from context import ShinanContext
+from ..prompts import Prompt
+
+SUMMARY_INSTRUCTIONS = Prompt().get_summary_prompt()
+
+summary_agent = Agent[ShinanContext](
+    name="Summarizer",
+    instructions=SUMMARY_INSTRUCTIONS,
+    model="gpt-4.1-nano",
+    output_type=str,
+)
@@ -1,49 +1,68 @@
-import requests
-from bs4 import BeautifulSoup
+class Prompt:
+    """
+    A class that contains all the prompts for the agents.
 
+    Prompts are rendered on access rather than on construction. The text and web search prompts
+    embed the SoftBank blog feed, so they take the already-fetched feed (see tools/blog_feed.py)
+    instead of scraping sbnews themselves.
+    """
 
-def softbank_blogs() -> str:
-    """ 
-    Scrape five most recently published blogs from Softbank's website. 
+    @property
+    def material_prompt(self) -> str:
+        return self.get_material_prompt()
 
-    Returns: 
-    repr form of list of blogs on sbnews page.
-    """
+    @property
+    def text_prompt(self) -> str:
+        return self.get_text_prompt()
 
-    search_endpoint = "https://www.softbank.jp/sbnews"
+    @property
+    def guardrail_prompt(self) -> str:
+        return self.get_guardrail_prompt()
 
-    try:
-        response = requests.get(search_endpoint)
-    except requests.exceptions.RequestException as e:
-        raise 
+    @property
+    def web_search_prompt(self) -> str:
+        return self.get_web_search_prompt()
 
-    soup = BeautifulSoup(response.text, 'html.parser')
-    items = soup.select('li.urllist-item.recent-entries-item')
-    blogs = ""
+    @property
+    def verifier_prompt(self) -> str:
+        return self.get_verifier_prompt()
 
-    for item in items[:5]:
-        title_tag = item.select_one('a.urllist-title-link')
-        title = title_tag.text.strip() if title_tag else 'No title'
-        article_url = title_tag['href'] if title_tag else 'No URL'
-        blogs += f"Title: {title}, URL: {article_url}\n"
+    @property
+    def writer_prompt(self) -> str:
+        return self.get_writer_prompt()
 
-    return repr(blogs)
+    @property
+    def triage_prompt(self) -> str:
+        return self.get_triage_prompt()
 
-class Prompt:
-    """
-    A class that contains all the prompts for the agents.
-    """
+    @property
+    def clarification_prompt(self) -> str:
+        return self.get_clarification_prompt()
+
+    @property
+    def instruction_prompt(self) -> str:
+        return self.get_deep_research_instruction_prompt()
+
+    @property
+    def summary_prompt(self) -> str:
+        return self.get_summary_prompt()
+
+    def get_deep_research_system_prompt(self):
+        """Get the system prompt for Deep Research API runs."""
+        DEEP_RESEARCH_SYSTEM_PROMPT = (
+            """
+            You are a professional researcher preparing a helpful, data-driven note on a company's current events in line with the user's queries.
 
-    def __init__(self) -> None:
-        self.material_prompt: str = self.get_material_prompt()
-        self.text_prompt: str = self.get_text_prompt()
-        self.guardrail_prompt: str = self.get_guardrail_prompt()
-        self.web_search_prompt: str = self.get_web_search_prompt()
-        self.verifier_prompt: str = self.get_verifier_prompt()
-        self.writer_prompt: str = self.get_writer_prompt()
-        self.triage_prompt: str = self.get_triage_prompt()
-        self.clarification_prompt: str = self.get_clarification_prompt()
-        self.instruction_prompt: str = self.get_deep_research_instruction_prompt()
+            Do:
+            - Focus on data-rich insights.
+            - When appropriate, summarize data in a way that could be turned into charts or tables, and call this out in the response.
+            - Prioritize reliable, up-to-date sources: blogs, articles, etc.
+            - Include inline citations and return all source metadata.
+
+            Be analytical, avoid generalities, and ensure that each section is helpful to the user's queries.
+            """
+        )
+        return DEEP_RESEARCH_SYSTEM_PROMPT
 
     def get_deep_research_instruction_prompt(self):
         """Get the research instruction prompt."""
@@ -149,23 +168,29 @@ class Prompt:
         )
         return MATERIAL_PROMPT
     
-    def get_text_prompt(self):
+    def get_text_prompt(self, blogs: str = ""):
         """
         Get the text analysis prompt.
+
+        Args:
+            blogs: The formatted SoftBank blog feed.
         """
         TEXT_PROMPT = (
             f"""
             You generate search ideas for a business research assistant to provide real-world insights on companies.
             Generate exactly three specific ideas to search.
-            Exactly one of them may be inspired by {softbank_blogs()}.
+            Exactly one of them may be inspired by {blogs}.
             You must include explicit references to the context (Company, Role, and Interests).
         """
         )
         return TEXT_PROMPT
     
-    def get_web_search_prompt(self) -> str:
+    def get_web_search_prompt(self, blogs: str = "") -> str:
         """
         Get the web search prompt using Chain-of-Thought reasoning.
+
+        Args:
+            blogs: The formatted SoftBank blog feed.
         """
         WEB_SEARCH_PROMPT = f"""
             Search for useful information to the person's context and to the individual's query.
@@ -180,7 +205,7 @@ class Prompt:
             - Broader industry news relevant to SoftBank’s moves.
 
             3. Here are a few Softbank blogs. Only 1 time, search the most relevant.
-            {softbank_blogs()}
+            {blogs}
 
             4. Next, search 2 or 3 others that are most relevant from web_search_preview.
             """
@@ -247,4 +272,22 @@ class Prompt:
 
         """
         )
-        return GUARDRAIL_PROMPT
\ No newline at end of file
+        return GUARDRAIL_PROMPT
+
+    def get_summary_prompt(self):
+        """
+        Get the conversation summary prompt.
+        """
+        SUMMARY_PROMPT = (
+            ""
+            + """
+        You compact the earlier part of a research conversation so it can be continued within a limited context.
+        Summarize it as notes for the assistant that will continue the conversation:
+        - The user's questions and what they were looking for.
+        - Every concrete finding: facts, figures, dates, company and product names, and their sources (site names or URLs).
+        - What was already reported to the user.
+
+        Be concise and drop repetition, but never drop a figure or a source. Write in the language of the conversation.
+        """
+        )
+        return SUMMARY_PROMPT
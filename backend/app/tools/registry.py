@@ -0,0 +1,61 @@
+# Shinan Agent Registry
+#
+# Agents (and the prompts they render) are built on first use rather than when the server starts.
+# Each agent is registered here by the module that defines it, and that module is imported the
+# first time the agent is asked for, so a cold start only pays for the agents its first requests
+# use. The agents' output types live in tools/schemas.py, which builds nothing.
+
+import importlib
+import logging
+import time
+from typing import Any, Dict
+
+from agents import Agent
+
+logger = logging.getLogger(__name__)
+
+# Name -> "module:attribute" of the agent.
+AGENTS: Dict[str, str] = {
+    "text": "tools.idea_generation.text_idea_agent:text_agent",
+    "material": "tools.idea_generation.material_idea_agent:material_agent",
+    "search": "tools.research.search_agent:search_agent",
+    "writer": "tools.report_generation.writer_agent:writer_agent",
+    "verifier": "tools.report_generation.verifier_agent:verifier_agent",
+    "messages": "tools.messages.messages_agent:messages_agent",
+    "summary": "tools.messages.summary_agent:summary_agent",
+}
+
+class AgentRegistry:
+    """Agents by name, each built the first time it is requested."""
+
+    def __init__(self, agents: Dict[str, str] = AGENTS) -> None:
+        self._paths = dict(agents)
+        self._agents: Dict[str, Agent[Any]] = {}
+        self._build_ms: Dict[str, float] = {}
+
+    def get(self, name: str) -> Agent[Any]:
+        """The agent registered under `name`, built on first use."""
+        agent = self._agents.get(name)
+        if agent is None:
+            module_name, attribute = self._paths[name].split(":")
+            started = time.perf_counter()
+            agent = getattr(importlib.import_module(module_name), attribute)
+            self._build_ms[name] = (time.perf_counter() - started) * 1000
+            logger.info(f"Built the {name} agent in {self._build_ms[name]:.0f} ms.")
+            self._agents[name] = agent
+        return agent
+
+    def warm(self) -> None:
+        """Build every registered agent, e.g. before taking traffic."""
+        for name in self._paths:
+            self.get(name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging."""
+        return {
+            "registered": len(self._paths),
+            "built": len(self._agents),
+            "build_ms": {name: round(ms, 1) for name, ms in self._build_ms.items()},
+        }
+
+agent_registry = AgentRegistry()
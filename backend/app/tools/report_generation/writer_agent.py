@@ -7,19 +7,11 @@ from agents import (
     function_tool,
     ModelSettings
 )
-from pydantic import BaseModel
 from context import ShinanContext
 from ..prompts import Prompt
-import requests
-from bs4 import BeautifulSoup
 
 WRITER_INSTRUCTIONS = Prompt().get_writer_prompt()
 
-class Report(BaseModel):
-    """A financial research summary."""
-    report: str
-    """The report content."""
-
 instructions_with_blogs = WRITER_INSTRUCTIONS
 
 writer_agent = Agent[ShinanContext](
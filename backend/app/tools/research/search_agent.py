@@ -1,17 +1,19 @@
-from agents import Agent, HostedMCPTool, function_tool, WebSearchTool, FileSearchTool
+from agents import Agent, HostedMCPTool, RunContextWrapper, function_tool, WebSearchTool, FileSearchTool
 from agents.model_settings import ModelSettings
 from pydantic import BaseModel
 from context import ShinanContext
 from ..prompts import Prompt
-import requests
-from bs4 import BeautifulSoup
+from ..blog_feed import blog_feed
 
-prompts = Prompt()
-SEARCH_PROMPT = prompts.get_web_search_prompt()
+async def search_instructions(
+    context: RunContextWrapper[ShinanContext], agent: Agent[ShinanContext]
+) -> str:
+    """Render the web search prompt from the cached blog feed when the agent runs."""
+    return Prompt().get_web_search_prompt(await blog_feed.get())
 
 search_agent = Agent[ShinanContext](
     name="Searcher",
-    instructions=Prompt().web_search_prompt,
+    instructions=search_instructions,
     tools=[
         WebSearchTool(),
     ],
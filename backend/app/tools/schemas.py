@@ -0,0 +1,61 @@
+from pydantic import BaseModel
+from typing import Sequence
+
+# Output types of the agents, kept apart from the agents themselves so that sessions and routers
+# can use them without building any agent (see tools/registry.py).
+
+class TextSearchIdea(BaseModel):
+    """
+    A search idea.
+    Defines:
+    - query: The search idea.
+    - reasoning: Why this is a good search idea in context of the text.
+    """
+    query: str
+    reasoning: str
+
+class TextSearchIdeas(BaseModel):
+    """A list of search ideas."""
+    ideas: Sequence[TextSearchIdea]
+
+class MaterialSearchIdea(BaseModel):
+    """
+    A search idea.
+    Defines:
+    - query: The search idea.
+    - reasoning: Why this is a good search idea in context of the text.
+    """
+    query: str
+    reasoning: str
+
+class MaterialSearchIdeas(BaseModel):
+    """A list of search ideas."""
+    ideas: Sequence[MaterialSearchIdea]
+
+class MaterialInsightPoint(BaseModel):
+    """
+    Input to the report generation agent.
+    Defines:
+    - material_analysis: A point of interest analysis of the material.
+    - point_of_interest: Where in the material this was found.
+    - reasoning: Why this analysis is relevant in context of the material.
+    """
+    material_analysis: str
+    point_of_interest: str
+    reasoning: str
+
+class MaterialInsights(BaseModel):
+    """
+    A list of material analysis points.
+    """
+    insights: Sequence[MaterialInsightPoint]
+
+class Analysis(BaseModel):
+    """A list of search ideas and material analysis points."""
+    ideas: MaterialSearchIdeas
+    insights: MaterialInsights
+
+class Report(BaseModel):
+    """A financial research summary."""
+    report: str
+    """The report content."""
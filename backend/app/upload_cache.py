@@ -0,0 +1,121 @@
+# Shinan Upload Cache
+#
+# Content-addressed cache for processed uploads. The same deck is often uploaded again by other
+# analysts, so uploads are keyed by the SHA-256 of their bytes (plus the processing settings) and
+# the extracted text, OCR output and prepared images are kept, along with the material agent's
+# Analysis for each user context. A repeat upload skips processing and analysis entirely.
+#
+# SHINAN_UPLOAD_CACHE selects the backend:
+# - "disk" (default): an LRU of files under SHINAN_CACHE_DIR, bounded by SHINAN_UPLOAD_CACHE_BYTES.
+# - "redis": shared through REDIS_URL, with a small per-process LRU in front. Configure Redis with
+#   an LRU maxmemory-policy (e.g. allkeys-lru); entries also expire after SHINAN_UPLOAD_CACHE_TTL.
+# - "off": disables the cache.
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from caching import DiskLRUCache, ResultCache
+from context import ShinanContext
+import images
+import materials
+import ocr
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CACHE_BACKEND = os.environ.get("SHINAN_UPLOAD_CACHE", "disk").lower()
+UPLOAD_CACHE_DIR = os.path.join(os.environ.get("SHINAN_CACHE_DIR", ".cache"), "uploads")
+UPLOAD_CACHE_BYTES = int(os.environ.get("SHINAN_UPLOAD_CACHE_BYTES", str(1024 * 1024 * 1024)))
+UPLOAD_CACHE_LOCAL_BYTES = int(os.environ.get("SHINAN_UPLOAD_CACHE_LOCAL_BYTES", str(128 * 1024 * 1024)))
+UPLOAD_CACHE_TTL = int(os.environ.get("SHINAN_UPLOAD_CACHE_TTL", str(60 * 60 * 24 * 30)))
+
+# Bump when the material format or the analysis changes shape, to ignore older entries.
+UPLOAD_CACHE_VERSION = 1
+
+def _settings_fingerprint() -> str:
+    """The processing settings that change what an upload is turned into."""
+    settings = {
+        "version": UPLOAD_CACHE_VERSION,
+        "pdf_max_pages": materials.PDF_MAX_PAGES,
+        "pdf_dpi": materials.PDF_DPI,
+        "image_format": images.IMAGE_FORMAT,
+        "image_lossy_format": images.IMAGE_LOSSY_FORMAT,
+        "image_quality": images.IMAGE_QUALITY,
+        "image_max_edge": images.IMAGE_MAX_EDGE,
+        "image_token_budget": images.IMAGE_TOKEN_BUDGET,
+        "ocr_enabled": ocr.OCR_ENABLED,
+        "ocr_languages": ocr.OCR_LANGUAGES,
+        "ocr_dpi": ocr.OCR_DPI,
+        "ocr_min_text_chars": ocr.OCR_MIN_TEXT_CHARS,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+SETTINGS_FINGERPRINT = _settings_fingerprint()
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+async def upload_key(data: bytes, content_type: str) -> str:
+    """The cache key of an upload: the SHA-256 of its bytes, its type and the processing settings."""
+    digest = await asyncio.to_thread(_digest, data) if len(data) > 1024 * 1024 else _digest(data)
+    return f"{digest}:{content_type}:{SETTINGS_FINGERPRINT}"
+
+def _context_digest(context: ShinanContext) -> str:
+    return hashlib.sha256(context.model_dump_json().encode("utf-8")).hexdigest()[:16]
+
+class UploadCache:
+    """Processed material and analyses of uploads, keyed by `upload_key`."""
+
+    def __init__(self, cache: DiskLRUCache | ResultCache | None) -> None:
+        self.cache = cache
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache is not None
+
+    async def get_material(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        if self.cache is None:
+            return None
+        entry = await self.cache.get(f"material:{key}")
+        return entry["material"] if entry else None
+
+    async def set_material(self, key: str, material: List[Dict[str, Any]]) -> None:
+        if self.cache is not None:
+            await self.cache.set(f"material:{key}", {"material": material})
+
+    async def get_analysis(self, key: str, context: ShinanContext) -> Optional[Dict[str, Any]]:
+        """The cached Analysis and the agent's new input items, for this upload and context."""
+        if self.cache is None:
+            return None
+        return await self.cache.get(f"analysis:{key}:{_context_digest(context)}")
+
+    async def set_analysis(self, key: str, context: ShinanContext, analysis: Dict[str, Any], items: List[Any]) -> None:
+        if self.cache is not None:
+            await self.cache.set(f"analysis:{key}:{_context_digest(context)}", {"analysis": analysis, "items": items})
+
+    async def close(self) -> None:
+        """Close the Redis client of the "redis" backend."""
+        if isinstance(self.cache, ResultCache):
+            await self.cache.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging."""
+        return {"backend": UPLOAD_CACHE_BACKEND, **(self.cache.snapshot() if self.cache else {})}
+
+def create_upload_cache() -> UploadCache:
+    """Create the upload cache configured by SHINAN_UPLOAD_CACHE."""
+    if UPLOAD_CACHE_BACKEND == "off":
+        return UploadCache(None)
+    if UPLOAD_CACHE_BACKEND == "redis":
+        from redis.asyncio import Redis  # Only imported when Redis is used.
+
+        redis = Redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+        return UploadCache(ResultCache("shinan:upload", max_bytes=UPLOAD_CACHE_LOCAL_BYTES, ttl=UPLOAD_CACHE_TTL, redis=redis))
+    if UPLOAD_CACHE_BACKEND != "disk":
+        raise ValueError(f"Unknown upload cache: {UPLOAD_CACHE_BACKEND}. Use 'disk', 'redis' or 'off'.")
+    return UploadCache(DiskLRUCache(UPLOAD_CACHE_DIR, max_bytes=UPLOAD_CACHE_BYTES))
+
+upload_cache = create_upload_cache()
@@ -0,0 +1,227 @@
+# Shinan Usage Accounting
+#
+# Token usage and its estimated cost, recorded from each agent run's usage (RunResult and
+# RunResultStreaming alike) and added up per agent, per stage and per model, both for the request
+# (sent in the stream's final "done" event) and for the session (kept with it in the session store).
+# Costs are estimated from MODEL_PRICES, in USD per million tokens; SHINAN_MODEL_PRICES (JSON, e.g.
+# {"o4-mini": [1.1, 0.275, 4.4]}) overrides or adds prices. Tool fees such as web search calls are
+# not included.
+#
+# Sessions can be held to SHINAN_SESSION_TOKEN_BUDGET tokens and SHINAN_SESSION_COST_BUDGET USD
+# (0, the default, is unlimited). Once a session is over budget, SHINAN_BUDGET_ACTION decides:
+# - "abort" (default): new requests are refused, and running ones stop before their next agent run.
+# - "downgrade": agents run on cheaper models (SHINAN_BUDGET_DOWNGRADES, "model=cheaper,...");
+#   agents whose model has no cheaper counterpart are unchanged.
+# Runs made on a request's behalf outside its workflow, such as the guardrail classifier, are
+# counted through the request's usage scope (UsageAccountant.scope), and deep research jobs from
+# their response's usage (deep_research.py).
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from agents import Agent
+from agents.result import RunResultBase, RunResultStreaming
+from agents.stream_events import StreamEvent
+from agents.models.openai_provider import DEFAULT_MODEL
+from agents.usage import Usage
+from pydantic import BaseModel
+
+from metrics import BUDGET_ACTIONS, COST_USD, STAGE_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# USD per million input, cached input and output tokens. Names match by prefix, so dated
+# snapshots ("gpt-4.1-nano-2025-04-14") use their model's price.
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "o3-mini": (1.10, 0.55, 4.40),
+    "o4-mini": (1.10, 0.275, 4.40),
+    "o3": (2.00, 0.50, 8.00),
+    "o3-deep-research": (10.00, 2.50, 40.00),
+    "o4-mini-deep-research": (2.00, 0.50, 8.00),
+}
+MODEL_PRICES.update({model: tuple(price) for model, price in json.loads(os.environ.get("SHINAN_MODEL_PRICES", "{}")).items()})  # type: ignore[misc]
+
+SESSION_TOKEN_BUDGET = int(os.environ.get("SHINAN_SESSION_TOKEN_BUDGET", "0"))
+SESSION_COST_BUDGET = float(os.environ.get("SHINAN_SESSION_COST_BUDGET", "0"))
+BUDGET_ACTION = os.environ.get("SHINAN_BUDGET_ACTION", "abort")
+BUDGET_DOWNGRADES = dict(
+    pair.strip().split("=", 1)
+    for pair in os.environ.get("SHINAN_BUDGET_DOWNGRADES", "o4-mini=gpt-4.1-mini,o3-mini=gpt-4.1-mini,gpt-4.1=gpt-4.1-mini").split(",")
+    if "=" in pair
+)
+
+# The reports (request's and session's) of the request being served; see UsageAccountant.scope.
+_scope: ContextVar[Tuple["UsageReport", ...]] = ContextVar("shinan_usage_scope", default=())
+
+class BudgetExceeded(Exception):
+    """A session has used up its token or cost budget."""
+
+class TokenUsage(BaseModel):
+    """Tokens used and their estimated cost."""
+    requests: int = 0
+    input_tokens: int = 0
+    cached_tokens: int = 0  # Included in input_tokens.
+    output_tokens: int = 0
+    reasoning_tokens: int = 0  # Included in output_tokens.
+    cost_usd: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, other: "TokenUsage") -> None:
+        self.requests += other.requests
+        self.input_tokens += other.input_tokens
+        self.cached_tokens += other.cached_tokens
+        self.output_tokens += other.output_tokens
+        self.reasoning_tokens += other.reasoning_tokens
+        self.cost_usd = round(self.cost_usd + other.cost_usd, 6)
+
+class UsageReport(BaseModel):
+    """Usage in total and by agent, stage and model, for a request or a session."""
+    total: TokenUsage = TokenUsage()
+    by_agent: Dict[str, TokenUsage] = {}
+    by_stage: Dict[str, TokenUsage] = {}
+    by_model: Dict[str, TokenUsage] = {}
+
+    def add(self, usage: TokenUsage, agent: str, stage: str, model: str) -> None:
+        self.total.add(usage)
+        for breakdown, key in ((self.by_agent, agent), (self.by_stage, stage), (self.by_model, model)):
+            breakdown.setdefault(key, TokenUsage()).add(usage)
+
+def price(model: str) -> Optional[Tuple[float, float, float]]:
+    """The price of a model, by its longest matching name."""
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+class UsageAccountant:
+    """Records agent runs' usage and holds sessions to their budgets."""
+
+    def __init__(
+        self,
+        token_budget: int = SESSION_TOKEN_BUDGET,
+        cost_budget: float = SESSION_COST_BUDGET,
+        action: str = BUDGET_ACTION,
+        downgrades: Dict[str, str] = BUDGET_DOWNGRADES,
+    ) -> None:
+        self.token_budget = token_budget
+        self.cost_budget = cost_budget
+        self.action = action
+        self.downgrades = downgrades
+        self.total = UsageReport()  # Of this process, for metrics.
+        self._lock = threading.Lock()
+        self._unpriced: set = set()
+
+    def cost(self, model: str, usage: TokenUsage) -> float:
+        """Estimated USD cost of the usage; 0 for models without a price."""
+        rates = price(model)
+        if rates is None:
+            if model not in self._unpriced:
+                self._unpriced.add(model)
+                logger.warning(f"No price for model {model}; its cost is not counted.")
+            return 0.0
+        uncached = usage.input_tokens - usage.cached_tokens
+        return (uncached * rates[0] + usage.cached_tokens * rates[1] + usage.output_tokens * rates[2]) / 1_000_000
+
+    def record(self, usage: Usage, agent: Agent[Any], stage: str, *reports: UsageReport) -> TokenUsage:
+        """Add a run's usage to each report (e.g. the request's and the session's)."""
+        return self.record_usage(usage, agent.name, str(agent.model or DEFAULT_MODEL), stage, *reports, requests=usage.requests)
+
+    def record_usage(self, usage: Any, name: str, model: str, stage: str, *reports: UsageReport, requests: int = 1) -> TokenUsage:
+        """Add usage in the Responses API's shape (input and output tokens, with details) to each report."""
+        tokens = TokenUsage(
+            requests=requests,
+            input_tokens=usage.input_tokens,
+            cached_tokens=getattr(usage.input_tokens_details, "cached_tokens", 0) or 0,
+            output_tokens=usage.output_tokens,
+            reasoning_tokens=getattr(usage.output_tokens_details, "reasoning_tokens", 0) or 0,
+        )
+        tokens.cost_usd = round(self.cost(model, tokens), 6)
+        for report in reports:
+            report.add(tokens, name, stage, model)
+        with self._lock:
+            self.total.add(tokens, name, stage, model)
+        COST_USD.inc(tokens.cost_usd, agent=name, model=model, stage=stage)
+        STAGE_TOKENS.inc(tokens.input_tokens, stage=stage, kind="input")
+        STAGE_TOKENS.inc(tokens.output_tokens, stage=stage, kind="output")
+        return tokens
+
+    def record_run(self, result: RunResultBase, agent: Agent[Any], stage: str, *reports: UsageReport) -> TokenUsage:
+        """Add the usage of a finished (or failed) run to each report."""
+        return self.record(result.context_wrapper.usage, agent, stage, *reports)
+
+    @contextmanager
+    def scope(self, *reports: UsageReport) -> Iterator[None]:
+        """Count runs made on the request's behalf (see record_in_scope) towards its reports."""
+        previous = _scope.get()
+        _scope.set(reports)
+        try:
+            yield
+        finally:
+            # Not a token reset: a workflow generator may be closed from another context.
+            _scope.set(previous)
+
+    def record_in_scope(self, result: RunResultBase, agent: Agent[Any], stage: str) -> TokenUsage:
+        """Add a run's usage to the reports of the request being served, if any."""
+        return self.record_run(result, agent, stage, *_scope.get())
+
+    async def stream_events(
+        self, result: RunResultStreaming, agent: Agent[Any], stage: str, *reports: UsageReport
+    ) -> AsyncIterator[StreamEvent]:
+        """A streamed run's events. Its usage is recorded once they end, even if the run fails or is cancelled."""
+        try:
+            async for ev in result.stream_events():
+                yield ev
+        finally:
+            self.record_run(result, agent, stage, *reports)
+
+    def over_budget(self, session: UsageReport) -> Optional[str]:
+        """Why the session is over budget, or None."""
+        if self.token_budget and session.total.total_tokens >= self.token_budget:
+            return f"{session.total.total_tokens} of {self.token_budget} tokens used"
+        if self.cost_budget and session.total.cost_usd >= self.cost_budget:
+            return f"${session.total.cost_usd:.4f} of ${self.cost_budget:.4f} used"
+        return None
+
+    def check(self, session: UsageReport) -> None:
+        """Raise BudgetExceeded if the session is over budget and over-budget requests are refused."""
+        reason = self.over_budget(session)
+        if reason is not None and self.action == "abort":
+            BUDGET_ACTIONS.inc(action="abort")
+            raise BudgetExceeded(f"This session has used up its budget ({reason}).")
+
+    def agent_for(self, agent: Agent[Any], session: UsageReport) -> Agent[Any]:
+        """The agent to run for the session: as is within budget, else downgraded or refused."""
+        self.check(session)
+        if self.over_budget(session) is None:
+            return agent
+        model = str(agent.model or "")
+        cheaper = next((self.downgrades[name] for name in sorted(self.downgrades, key=len, reverse=True) if model.startswith(name)), None)
+        current, target = price(model), price(cheaper or "")
+        if cheaper is None or cheaper == model or (current and target and target[2] >= current[2]):
+            return agent
+        BUDGET_ACTIONS.inc(action="downgrade")
+        logger.info(f"Session over budget; running {agent.name} on {cheaper} instead of {model}.")
+        return agent.clone(model=cheaper)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stats for metrics and logging."""
+        with self._lock:
+            total = self.total.total.model_copy()
+        return {
+            **total.model_dump(),
+            "token_budget": self.token_budget,
+            "cost_budget": self.cost_budget,
+        }
+
+usage_accountant = UsageAccountant()
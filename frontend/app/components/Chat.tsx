@@ -6,11 +6,55 @@ import { motion, AnimatePresence, m } from "framer-motion";
 import { Toaster, toast } from 'sonner'
 import FileUpload from "./FileUpload";
 
+// Minimum seconds between streamed status updates, for a readable progress feed.
+const UPDATE_PACING_SECONDS = 0.5;
+
 interface Message {
   role: "user" | "bot" | "update";
   text: string;
 }
 
+interface StreamEvent {
+  seq: number;
+  type: "update" | "message" | "report_delta" | "report" | "error" | "done" | "heartbeat";
+  text: string;
+  stage?: "context" | "material" | "analysis" | "ideas" | "search" | "report";
+  idea_id?: number;
+  progress?: { completed: number; total: number };
+  at: number;
+  elapsed_ms: number;
+  stage_elapsed_ms?: number;
+}
+
+const STREAM_RESUME_ATTEMPTS = 3;
+
+interface DeepResearchEvent {
+  seq: number;
+  type: "status" | "reasoning" | "search" | "citation" | "delta" | "final" | "error";
+  data: Record<string, any>;
+}
+
+// Follows a background deep research job over SSE. EventSource reconnects on its own and resumes
+// from the last event it received (Last-Event-ID), so a dropped connection loses nothing.
+const followDeepResearch = (jobId: string, onEvent: (event: DeepResearchEvent) => void) =>
+  new Promise<void>((resolve, reject) => {
+    const source = new EventSource(
+      `http://localhost:8000/client/deep_research/${jobId}/events`,
+      { withCredentials: true },
+    );
+    const handle = (e: MessageEvent) => {
+      const event: DeepResearchEvent = JSON.parse(e.data);
+      onEvent(event);
+      if (event.type === "status" && ["completed", "failed", "cancelled"].includes(event.data.status)) {
+        source.close();
+        event.data.status === "completed" ? resolve() : reject(new Error(`Deep research ${event.data.status}`));
+      }
+    };
+    ["status", "reasoning", "search", "citation", "delta", "final", "error"].forEach((type) =>
+      source.addEventListener(type, handle as EventListener)
+    );
+  });
+
 interface Query {
   type: "bubble" | "streamingBubble" | "updates";
   text: string;
@@ -41,6 +85,98 @@ const Chat: React.FC<ChatProps> = ({ shinanContext, mode: initialMode = "researc
     }
   }, [messages, loading]);
 
+  // Reads a streamed response of newline-delimited JSON events: "update" is progress, "message" a
+  // complete bot message, "report_delta" report text as it is written, "report" the final report,
+  // "error" a failure and "done" the end of the stream. If the connection drops before "done", the
+  // stream is resumed after the last event seen. Plain-text responses (e.g. /messages) are shown as
+  // one bot message.
+  const readStream = async (res: Response) => {
+    if (!res.ok) throw new Error(`Server error: ${res.status}`);
+    if (!res.body) throw new Error("No response body");
+
+    if (!res.headers.get("Content-Type")?.includes("application/x-ndjson")) {
+      const text = await res.text();
+      setMessages((msgs) => [...msgs, { role: "bot", text }]);
+      return;
+    }
+
+    const streamId = res.headers.get("X-Shinan-Stream");
+    let lastSeq = 0;
+    let finished = false;
+    let streaming = false;
+
+    const handle = (event: StreamEvent) => {
+      if (event.type === "heartbeat") return;
+      lastSeq = event.seq;
+      if (event.type === "done") {
+        finished = true;
+      } else if (event.type === "error") {
+        streaming = false;
+        setMessages((msgs) => [...msgs, { role: "bot", text: event.text }]);
+      } else if (event.type === "update") {
+        streaming = false;
+        setMessages((msgs) => [...msgs, { role: "update", text: event.text }]);
+      } else if (event.type === "message") {
+        streaming = false;
+        setMessages((msgs) => [...msgs, { role: "bot", text: event.text }]);
+      } else if (event.type === "report_delta") {
+        const wasStreaming = streaming;
+        streaming = true;
+        setMessages((msgs) => {
+          if (!wasStreaming) return [...msgs, { role: "bot", text: event.text }];
+          const updated = [...msgs];
+          const lastIndex = updated.length - 1;
+          updated[lastIndex] = { ...updated[lastIndex], text: updated[lastIndex].text + event.text };
+          return updated;
+        });
+      } else if (event.type === "report") {
+        // The complete report replaces the streamed text, or is shown as is if nothing was streamed.
+        const wasStreaming = streaming;
+        streaming = false;
+        setMessages((msgs) => {
+          if (!wasStreaming) return [...msgs, { role: "bot", text: event.text }];
+          const updated = [...msgs];
+          updated[updated.length - 1] = { role: "bot", text: event.text };
+          return updated;
+        });
+      }
+    };
+
+    const consume = async (body: ReadableStream<Uint8Array>) => {
+      const reader = body.getReader();
+      const decoder = new TextDecoder("utf-8");
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop() ?? "";
+        for (const line of lines) {
+          if (line.trim()) handle(JSON.parse(line));
+        }
+      }
+      if (buffer.trim()) handle(JSON.parse(buffer));
+    };
+
+    let body: ReadableStream<Uint8Array> = res.body;
+    for (let attempt = 0; ; attempt++) {
+      try {
+        await consume(body);
+      } catch (err) {
+        if (!streamId || attempt >= STREAM_RESUME_ATTEMPTS) throw err;
+      }
+      if (finished || !streamId || attempt >= STREAM_RESUME_ATTEMPTS) return;
+
+      const resumed = await fetch(`http://localhost:8000/client/streams/${streamId}?after=${lastSeq}`, {
+        credentials: "include",
+      });
+      if (!resumed.ok || !resumed.body) throw new Error(`Server error: ${resumed.status}`);
+      body = resumed.body;
+    }
+  };
+
   const sendMessage = async () => {
     if (!input.trim() || !shinanContext) return;
 
@@ -66,57 +202,38 @@ const Chat: React.FC<ChatProps> = ({ shinanContext, mode: initialMode = "researc
       };
       const endpoint = endpoints[selectedMode] || endpoints.research;
 
+      if (selectedMode === "deep") {
+        const res = await fetch(endpoint, {
+          method: "POST",
+          credentials: "include",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ query: userInput }),
+        });
+        if (!res.ok) throw new Error(`Server error: ${res.status}`);
+        const { job_id } = await res.json();
+
+        await followDeepResearch(job_id, (event) => {
+          if (event.type === "reasoning") {
+            setMessages((msgs) => [...msgs, { role: "update", text: event.data.text }]);
+          } else if (event.type === "search") {
+            setMessages((msgs) => [...msgs, { role: "update", text: `Searching: ${event.data.query}` }]);
+          } else if (event.type === "final") {
+            setMessages((msgs) => [...msgs, { role: "bot", text: event.data.report }]);
+          } else if (event.type === "error") {
+            setMessages((msgs) => [...msgs, { role: "bot", text: `Error: ${event.data.message}` }]);
+          }
+        });
+        return;
+      }
+
       const res = await fetch(endpoint, {
         method: "POST",
+        credentials: "include",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ query: userInput }),
+        // Opt in to paced status updates; the report itself is never delayed.
+        body: JSON.stringify({ query: userInput, pacing: UPDATE_PACING_SECONDS }),
       });
-  
-      if (!res.ok) throw new Error(`Server error: ${res.status}`);
-      if (!res.body) throw new Error("No response body");
-      
-      const reader = res.body.getReader();
-      const decoder = new TextDecoder("utf-8");
-      
-      let streaming = false;
-      let streamingMsgIndex: number;
-
-      while (true) {
-        const { value, done } = await reader.read();
-        if (done) break;
-  
-        const chunk = decoder.decode(value, { stream: true });
-
-        if (chunk.startsWith("UPDATE " )) {
-          streaming = false;
-          const update_message = chunk.slice(7);
-          setMessages((msgs) => [...msgs, { role: "update", text: update_message}]);
-        } 
-
-        else if (chunk.startsWith("STREAMING ")) {
-          const stream_initial = chunk.slice(10);
-          streaming = true;
-          setMessages((msgs) => [...msgs, { role: "bot", text: ""}]);
-        }
-
-        else if (streaming) {
-          setMessages((msgs) => {
-            const updated = [...msgs]; 
-            const lastIndex = updated.length - 1;
-          
-            updated[lastIndex] = {
-              ...updated[lastIndex],
-              text: updated[lastIndex].text + chunk,
-            };
-            return updated;
-          });
-        }
-
-        else {
-          streaming = false;
-          setMessages((msgs) => [...msgs, { role: "bot", text: chunk }]);
-        }
-      }
+      await readStream(res);
     } catch (err: any) {
       setMessages((msgs) => [...msgs, { role: "bot", text: "Error: Could not get response." }]);
       setError(err.message || "Unknown error");
@@ -338,30 +455,15 @@ const Chat: React.FC<ChatProps> = ({ shinanContext, mode: initialMode = "researc
               autoFocus
             />
 
-            <FileUpload onResult={(result: string) => {
-              let parsed: any;
-              try { parsed = JSON.parse(result); } catch { parsed = null; }
-              if (parsed && Array.isArray(parsed)) {
-                parsed.forEach((msg: any) => {
-                  if (msg.content) {
-                    msg.content.forEach((item: any) => {
-                      if (item.type === 'input_text') {
-                        setMessages((msgs) => [...msgs, { role: 'bot', text: item.text }]);
-                      } else if (item.type === 'input_image' && item.image_url) {
-                        setMessages((msgs) => [...msgs, { role: 'bot', text: item.image_url }]);
-                      }
-                    });
-                  }
-                });
-              } else {
-                setMessages((msgs) => [...msgs, { role: 'bot', text: result }]);
-              }
-            }} />
+            <FileUpload
+              onResponse={readStream}
+              onResult={(result: string) => setMessages((msgs) => [...msgs, { role: 'bot', text: result }])}
+            />
 
             {/* Send button */}
             <motion.button
               type="submit"
-              disabled={loading || !input.trim() || selectedMode==="deep"}
+              disabled={loading || !input.trim()}
               variants={{
                 idle: {
                   backgroundColor: "#757575",
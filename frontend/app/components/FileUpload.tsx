@@ -93,7 +93,14 @@ const buttonTextMap: Record<ButtonState, React.ReactNode> = {
   error: "Upload Failed - Retry",
 };
 
-const FileUpload: React.FC<{ onResult: (result: string) => void }> = ({ onResult }) => {
+interface FileUploadProps {
+  // Consumes the streamed analysis and report.
+  onResponse: (res: Response) => Promise<void>;
+  // Shows an error message.
+  onResult: (result: string) => void;
+}
+
+const FileUpload: React.FC<FileUploadProps> = ({ onResponse, onResult }) => {
   const [loading, setLoading] = useState(false);
   const [buttonState, setButtonState] = useState<ButtonState>("idle");
   const fileInputRef = useRef<HTMLInputElement>(null);
@@ -127,11 +134,15 @@ const FileUpload: React.FC<{ onResult: (result: string) => void }> = ({ onResult
     try {
       const res = await fetch("http://localhost:8000/client/upload", {
         method: "POST",
+        credentials: "include",
         body: formData,
       });
-      const data = await res.json();
-      onResult(typeof data === "string" ? data : data.result || JSON.stringify(data));
+      if (!res.ok) {
+        const data = await res.json().catch(() => null);
+        throw new Error(data?.detail || `Server error: ${res.status}`);
+      }
       setButtonState("success");
+      await onResponse(res);
     } catch (error: any) {
       onResult(error.message);
       setButtonState("error");
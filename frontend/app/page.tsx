@@ -146,6 +146,7 @@ export default function Home() {
     try {
       const res = await fetch("http://localhost:8000/client/context", {
         method: "POST",
+        credentials: "include",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(context),
       });